@@ -2,8 +2,13 @@ from behave import *
 import subprocess
 import os
 import time
+import timeit
 import re
 import json
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+import gp_create
 
 @given(u'Command {cmdString}')
 def step_impl(context, cmdString):
@@ -28,21 +33,14 @@ def step_impl(context):
 @then(u'The group {grpName} is created')
 def step_impl(context, grpName):
     context.groupName=grpName
-    time.sleep(10)
+    # poll the containers api until the group is done being created, for
+    # up to GROUP_CREATE_TIMEOUT seconds
+    deadline = timeit.default_timer() + float(os.getenv("GROUP_CREATE_TIMEOUT", "600"))
+    for name, status, info in gp_create.watch_groups([grpName], deadline=deadline):
+        print(status)
     try:
         context.groupInfo = json.loads(subprocess.check_output("cf ic group inspect "+grpName, shell=True))
         print(context.groupInfo["Status"])
-        while context.groupInfo["Status"] == "CREATE_IN_PROGRESS":
-            time.sleep(20)
-            try:
-                context.groupInfo = json.loads(subprocess.check_output("cf ic group inspect "+grpName, shell=True))
-                print(context.groupInfo["Status"])
-            except subprocess.CalledProcessError as e:
-                print (e.cmd)
-                print (e.output)
-                time.sleep(20)
-                context.groupInfo = json.loads(subprocess.check_output("cf ic group inspect "+grpName, shell=True))
-                print(context.groupInfo["Status"])
         print (json.dumps(context.groupInfo, sort_keys=True, indent=2))
     except subprocess.CalledProcessError as e:
         print (e.cmd)
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+
+#***************************************************************************
+# Copyright 2015 IBM
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#***************************************************************************
+
+# Load driver for gp_create's group create requests.  Sends --requests
+# creates at each of the --concurrency levels over one pooled session, the
+# way create_groups does, and reports the throughput, latency percentiles,
+# errors and connections opened at each level:
+#
+#    python bench/bench_gp_create.py [--url http://127.0.0.1:8443]
+#        [--concurrency 1,2,4,8,16,32] [--requests 200] [--output FILE]
+#        [--latency 0.02] [--jitter 0.01] [--error-rate 0]
+#
+# Without --url a ccs_server.py stand in is started in this process with
+# the given --latency, --jitter and --error-rate.  For throughput numbers
+# that aren't sharing an interpreter with the server, start ccs_server.py
+# separately and pass its --url
+
+import argparse
+import collections
+import json
+import math
+import os
+import platform
+import sys
+import threading
+import time
+import timeit
+import uuid
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import ccs_server
+import gp_create
+import requests
+
+
+# the p'th percentile of sorted values, nearest rank
+def percentile (values, p):
+    if not values:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+# the stand in's counters, or None if the server doesn't have them
+def get_stats (session, url):
+    try:
+        response = session.get(url + "/_stats")
+    except requests.exceptions.RequestException:
+        return None
+    if response.status_code != 200:
+        return None
+    return response.json()
+
+# send count creates, concurrency at a time, over one session.  Returns
+# the elapsed time and a (latency, status) per request, where the status is
+# the http status code or the name of the exception the request raised
+def run_level (auth, concurrency, count, prefix):
+    session = gp_create.new_session(auth, pool_size=concurrency)
+    pending = queue.Queue()
+    for i in range(count):
+        pending.put(gp_create.spec_to_args({ "Name": "%s-c%i-%i" % (prefix, concurrency, i), "Image": "bench/image" }))
+    samples = []
+    samplesLock = threading.Lock()
+
+    def worker ():
+        while True:
+            try:
+                spec = pending.get_nowait()
+            except queue.Empty:
+                return
+            start = timeit.default_timer()
+            try:
+                status = gp_create.post_group(spec, session).status_code
+            except requests.exceptions.RequestException as e:
+                status = type(e).__name__
+            latency = timeit.default_timer() - start
+            with samplesLock:
+                samples.append((latency, status))
+
+    start = timeit.default_timer()
+    threads = [threading.Thread(target=worker) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = timeit.default_timer() - start
+    session.close()
+    return elapsed, samples
+
+def summarize (concurrency, elapsed, samples, connections):
+    latencies = sorted(latency for latency, status in samples)
+    errors = collections.Counter(str(status) for latency, status in samples if not (isinstance(status, int) and status < 400))
+    result = collections.OrderedDict()
+    result["concurrency"] = concurrency
+    result["requests"] = len(samples)
+    result["elapsed"] = elapsed
+    result["throughput"] = len(samples) / elapsed if elapsed else None
+    result["p50"] = percentile(latencies, 50)
+    result["p99"] = percentile(latencies, 99)
+    result["max"] = latencies[-1] if latencies else None
+    result["errors"] = dict(errors)
+    result["error_rate"] = sum(errors.values()) / float(len(samples)) if samples else 0
+    result["connections"] = connections
+    return result
+
+def main (argv=None):
+    parser = argparse.ArgumentParser(prog="bench_gp_create.py")
+    parser.add_argument("--url", help="containers api to load, by default a stand in started here")
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32", help="comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="creates to send at each level")
+    parser.add_argument("--latency", type=float, default=0.02, help="stand in latency per call, seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="stand in latency jitter, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="stand in fraction of calls that fail")
+    parser.add_argument("--output", metavar="FILE", help="write the results as json to FILE")
+    args = parser.parse_args(argv)
+
+    server = None
+    url = args.url
+    if url is None:
+        server = ccs_server.start_server(["--port", "0", "--latency", str(args.latency), "--jitter", str(args.jitter), "--error-rate", str(args.error_rate)])
+        url = server.url
+
+    auth = { "token": "bearer bench", "space_guid": "bench", "ccs_api_server": url }
+    statsSession = requests.Session()
+    prefix = "load-" + uuid.uuid4().hex[:8]
+
+    print("%11s %8s %9s %10s %9s %9s %9s %7s %s" % ("concurrency", "requests", "elapsed", "req/s", "p50(s)", "p99(s)", "max(s)", "conns", "errors"))
+    results = []
+    try:
+        for concurrency in [int(level) for level in args.concurrency.split(",")]:
+            before = get_stats(statsSession, url)
+            elapsed, samples = run_level(auth, concurrency, args.requests, prefix)
+            after = get_stats(statsSession, url)
+            connections = None
+            if before is not None and after is not None:
+                connections = after["connections"] - before["connections"]
+            result = summarize(concurrency, elapsed, samples, connections)
+            results.append(result)
+            print("%11i %8i %9.3f %10.1f %9.4f %9.4f %9.4f %7s %s" % (concurrency, result["requests"], elapsed, result["throughput"], result["p50"], result["p99"], result["max"], connections, json.dumps(result["errors"], sort_keys=True)))
+            sys.stdout.flush()
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    if args.output:
+        report = collections.OrderedDict()
+        report["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        report["python"] = platform.python_version()
+        report["url"] = args.url or "in process stand in"
+        report["stand_in"] = { "latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate } if server else None
+        report["results"] = results
+        with open(args.output, "w") as outputFile:
+            json.dump(report, outputFile, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+#!/usr/bin/python
+
+#***************************************************************************
+# Copyright 2015 IBM
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#***************************************************************************
+
+# Benchmarks for the python_utils service and credential lookups, run
+# against fake_cf.py at a few space sizes.  Each lookup is timed in two
+# modes:
+#    e2e     fake_cf.py is put on the PATH as cf, so the time includes
+#            starting a cf process for each command
+#    inproc  the cf output is generated up front and handed back in
+#            process, so the time is just python_utils' own work
+#
+#    python bench/bench_python_utils.py [--scenarios small,medium,large]
+#        [--modes e2e,inproc] [--runs 5] [--output results.json]
+#        [--thresholds bench/thresholds.json] [--baseline old.json]
+#
+# Results are written as json.  The run fails (rc 1) if a median is over
+# its limit in the thresholds file, or more than --max-slowdown times the
+# median in the baseline results
+
+import argparse
+import collections
+import io
+import json
+import logging
+import os
+import platform
+import shlex
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import fake_cf
+import python_utils
+
+# name -> (number of service instances, size of VCAP_SERVICES in KB)
+SCENARIOS = collections.OrderedDict([
+    ("small", (10, 4)),
+    ("medium", (1000, 256)),
+    ("large", (10000, 4096)),
+])
+MODES = ["e2e", "inproc"]
+
+# name -> (lookup, expected result)
+BENCHMARKS = collections.OrderedDict([
+    ("find_service_name_in_space", (lambda: python_utils.find_service_name_in_space(fake_cf.TARGET_SERVICE), fake_cf.TARGET_INSTANCE)),
+    ("find_bound_app_for_service", (lambda: python_utils.find_bound_app_for_service(fake_cf.TARGET_SERVICE), "app-other")),
+    ("get_credentials_from_bound_app", (lambda: python_utils.get_credentials_from_bound_app(fake_cf.TARGET_SERVICE), fake_cf.TARGET_CREDENTIALS)),
+    ("get_credentials_for_non_binding_service", (lambda: python_utils.get_credentials_for_non_binding_service(fake_cf.TARGET_SERVICE), fake_cf.TARGET_CREDENTIALS)),
+])
+
+
+# a file like a process pipe, for StringIO
+def text_stream (text):
+    if not isinstance(text, type(u"")):
+        text = text.decode("utf-8")
+    return io.StringIO(text)
+
+# stands in for subprocess.Popen in python_utils for the inproc mode,
+# answering cf commands from fake_cf output generated ahead of time
+class ReplayPopen (object):
+
+    # rendered output by cf args, shared by all the instances
+    outputs = {}
+
+    def __init__ (self, args, shell=False, stdout=None, stderr=None, universal_newlines=False, env=None, **kwargs):
+        if shell:
+            args = shlex.split(args[0])
+        key = tuple(args[1:])
+        if key not in ReplayPopen.outputs:
+            ReplayPopen.outputs[key] = fake_cf.render(list(key))
+        self.returncode, out = ReplayPopen.outputs[key]
+        self.stdout = text_stream(out)
+        self.stderr = text_stream("")
+
+    def communicate (self):
+        return self.stdout.read(), self.stderr.read()
+
+    def poll (self):
+        return self.returncode
+
+    def wait (self):
+        return self.returncode
+
+    def kill (self):
+        pass
+
+# put fake_cf.py on the PATH as cf, in a directory that's returned so it
+# can be removed
+def install_fake_cf ():
+    binDir = tempfile.mkdtemp(prefix="bench_cf_")
+    cf = os.path.join(binDir, "cf")
+    with open(cf, "w") as cfFile:
+        cfFile.write("#!/bin/sh\nexec '%s' '%s' \"$@\"\n" % (sys.executable, os.path.join(BENCH_DIR, "fake_cf.py")))
+    os.chmod(cf, 0o755)
+    os.environ["PATH"] = binDir + os.pathsep + os.environ["PATH"]
+    return binDir
+
+# time runs calls of lookup, each starting without a services snapshot.
+# Returns the times in seconds, or raises Exception if the lookup doesn't
+# find what it should
+def time_lookup (name, lookup, expected, runs):
+    times = []
+    for i in range(runs):
+        python_utils.invalidate_services_snapshot()
+        start = timeit.default_timer()
+        result = lookup()
+        times.append(timeit.default_timer() - start)
+        if result != expected:
+            raise Exception("%s returned %r, expected %r" % (name, result, expected))
+    return times
+
+def median (values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def run_benchmarks (scenarios, modes, runs):
+    realPopen = python_utils.Popen
+    results = []
+    for scenario in scenarios:
+        services, vcapKb = SCENARIOS[scenario]
+        os.environ["FAKE_CF_SERVICES"] = str(services)
+        os.environ["FAKE_CF_VCAP_KB"] = str(vcapKb)
+        ReplayPopen.outputs = {}
+        for mode in modes:
+            if mode == "inproc":
+                python_utils.Popen = ReplayPopen
+            try:
+                for name in BENCHMARKS:
+                    lookup, expected = BENCHMARKS[name]
+                    if mode == "inproc":
+                        # generate the output before timing
+                        time_lookup(name, lookup, expected, 1)
+                    times = time_lookup(name, lookup, expected, runs)
+                    result = collections.OrderedDict()
+                    result["benchmark"] = name
+                    result["scenario"] = scenario
+                    result["mode"] = mode
+                    result["services"] = services
+                    result["vcap_kb"] = vcapKb
+                    result["runs"] = runs
+                    result["min"] = min(times)
+                    result["median"] = median(times)
+                    result["max"] = max(times)
+                    results.append(result)
+                    print("%-40s %-7s %-7s %9.4f s  (min %.4f, max %.4f)" % (name, scenario, mode, result["median"], result["min"], result["max"]))
+                    sys.stdout.flush()
+            finally:
+                python_utils.Popen = realPopen
+    return results
+
+def result_key (result):
+    return "%s/%s/%s" % (result["benchmark"], result["scenario"], result["mode"])
+
+# return the messages for the results that are over their threshold, or
+# slower than the baseline by more than max_slowdown times
+def check_results (results, thresholds, baseline, max_slowdown):
+    failures = []
+    baselineMedians = {}
+    if baseline:
+        for result in baseline["results"]:
+            baselineMedians[result_key(result)] = result["median"]
+    for result in results:
+        key = result_key(result)
+        limit = thresholds.get(key)
+        if limit is not None and result["median"] > limit:
+            failures.append("%s: median %.4f s is over the %.4f s threshold" % (key, result["median"], limit))
+        previous = baselineMedians.get(key)
+        if previous and result["median"] > previous * max_slowdown:
+            failures.append("%s: median %.4f s is %.1fx the baseline %.4f s" % (key, result["median"], result["median"] / previous, previous))
+    return failures
+
+def main (argv=None):
+    parser = argparse.ArgumentParser(prog="bench_python_utils.py")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="scenarios to run, of " + ", ".join(SCENARIOS))
+    parser.add_argument("--modes", default=",".join(MODES), help="modes to run, of " + ", ".join(MODES))
+    parser.add_argument("--runs", type=int, default=5, help="timed runs of each lookup")
+    parser.add_argument("--output", metavar="FILE", help="write the results as json to FILE")
+    parser.add_argument("--thresholds", metavar="FILE", default=os.path.join(BENCH_DIR, "thresholds.json"), help="json of benchmark/scenario/mode -> most median seconds allowed")
+    parser.add_argument("--baseline", metavar="FILE", help="results of an earlier run to compare against")
+    parser.add_argument("--max-slowdown", type=float, default=1.5, help="most a median may grow over the baseline")
+    args = parser.parse_args(argv)
+
+    scenarios = args.scenarios.split(",")
+    modes = args.modes.split(",")
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error("unknown scenario " + scenario)
+    for mode in modes:
+        if mode not in MODES:
+            parser.error("unknown mode " + mode)
+
+    # lookups go through the cli, every time, quietly
+    python_utils.LOGGER = logging.getLogger("bench")
+    python_utils.LOGGER.addHandler(logging.StreamHandler(sys.stderr))
+    python_utils.LOGGER.setLevel(logging.WARNING)
+    python_utils.CF_BACKEND = python_utils.CFCliBackend()
+    python_utils.DEBUG = None
+    python_utils.TRACE_FILE = None
+    os.environ.pop("CF_CREDENTIALS_CACHE", None)
+    os.environ.pop("SETUP_SERVICE_SPACE", None)
+
+    binDir = install_fake_cf()
+    try:
+        results = run_benchmarks(scenarios, modes, args.runs)
+    finally:
+        shutil.rmtree(binDir)
+
+    report = collections.OrderedDict()
+    report["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    report["python"] = platform.python_version()
+    report["platform"] = platform.platform()
+    report["results"] = results
+    if args.output:
+        with open(args.output, "w") as outputFile:
+            json.dump(report, outputFile, indent=2)
+
+    thresholds = {}
+    if args.thresholds and os.path.exists(args.thresholds):
+        with open(args.thresholds) as thresholdsFile:
+            thresholds = json.load(thresholdsFile)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baselineFile:
+            baseline = json.load(baselineFile)
+
+    failures = check_results(results, thresholds, baseline, args.max_slowdown)
+    for failure in failures:
+        print(python_utils.LABEL_RED + failure + python_utils.LABEL_NO_COLOR)
+    if failures:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+#!/usr/bin/python
+
+#***************************************************************************
+# Copyright 2015 IBM
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#***************************************************************************
+
+# A local stand in for the containers (ccs) api groups endpoint, to run
+# gp_create.py and the load driver against without the real service:
+#    POST   /v3/containers/groups         create a group
+#    GET    /v3/containers/groups         list the groups
+#    GET    /v3/containers/groups/NAME    inspect a group, by name or id
+#    DELETE /v3/containers/groups/NAME    remove a group
+#    GET    /_stats                       request and connection counts
+#
+#    python bench/ccs_server.py [--port 8443] [--latency 0.05] [--jitter 0.02]
+#        [--error-rate 0.01] [--create-time 5] [--fail-rate 0]
+#
+# Groups report CREATE_IN_PROGRESS for --create-time seconds, then
+# CREATE_COMPLETE (or CREATE_FAILED for --fail-rate of them).  Point
+# gp_create.py at it with CCS_API_SERVER=http://127.0.0.1:8443
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+GROUPS_PATH = "/v3/containers/groups"
+
+
+class CCSHandler (BaseHTTPRequestHandler):
+    # keep-alive, like the real api.  Without nodelay the separate header
+    # and body writes of a response wait out the client's delayed ack
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message (self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def setup (self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.count("connections")
+
+    def send_json (self, status, data=None):
+        body = b""
+        if data is not None:
+            body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # the simulated latency and failures, common to every api call.
+    # Returns True if the request was answered with an error
+    def simulate (self):
+        self.server.count("requests")
+        options = self.server.options
+        delay = options.latency + random.uniform(-options.jitter, options.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if options.token and not self.headers.get("X-Auth-Token"):
+            self.server.count("unauthorized")
+            self.send_json(401, { "code": "IC4001E", "description": "Missing auth token" })
+            return True
+        if random.random() < options.error_rate:
+            self.server.count("injected_errors")
+            self.send_json(random.choice([500, 502, 503]), { "code": "IC5000E", "description": "Injected failure" })
+            return True
+        return False
+
+    def read_body (self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length == 0:
+            return None
+        return json.loads(self.rfile.read(length).decode("utf-8"))
+
+    def group_name (self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == GROUPS_PATH:
+            return ""
+        if path.startswith(GROUPS_PATH + "/"):
+            return path[len(GROUPS_PATH) + 1:]
+        return None
+
+    def do_GET (self):
+        if self.path == "/_stats":
+            return self.send_json(200, self.server.get_stats())
+        name = self.group_name()
+        if name is None:
+            return self.send_json(404, {})
+        if self.simulate():
+            return
+        if name == "":
+            return self.send_json(200, self.server.list_groups())
+        group = self.server.get_group(name)
+        if group is None:
+            return self.send_json(404, { "code": "IC4040E", "description": "Group " + name + " not found" })
+        self.send_json(200, group)
+
+    def do_POST (self):
+        if self.group_name() != "":
+            return self.send_json(404, {})
+        try:
+            data = self.read_body()
+        except ValueError:
+            return self.send_json(400, { "code": "IC4000E", "description": "Request body is not json" })
+        if self.simulate():
+            return
+        if not isinstance(data, dict) or not data.get("Name") or not data.get("Image"):
+            return self.send_json(400, { "code": "IC4000E", "description": "Name and Image are required" })
+        group = self.server.add_group(data)
+        if group is None:
+            return self.send_json(409, { "code": "IC4090E", "description": "Group " + data["Name"] + " already exists" })
+        self.send_json(201, { "Id": group["Id"], "Name": group["Name"] })
+
+    def do_DELETE (self):
+        name = self.group_name()
+        if not name:
+            return self.send_json(404, {})
+        if self.simulate():
+            return
+        if not self.server.remove_group(name):
+            return self.send_json(404, {})
+        self.send_json(204)
+
+
+class CCSServer (ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # the default listen backlog of 5 drops connections under load, and
+    # the client's syn retry shows up as a second of latency
+    request_queue_size = 128
+
+    def __init__ (self, address, options, verbose=False):
+        HTTPServer.__init__(self, address, CCSHandler)
+        self.options = options
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.groups = {}
+        self.stats = { "connections": 0, "requests": 0, "injected_errors": 0, "unauthorized": 0 }
+
+    def count (self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def get_stats (self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["groups"] = len(self.groups)
+        return stats
+
+    def add_group (self, data):
+        with self.lock:
+            if data["Name"] in self.groups:
+                return None
+            group = dict(data)
+            group["Id"] = str(uuid.uuid4())
+            group["Created"] = time.time()
+            group["Failed"] = random.random() < self.options.fail_rate
+            group.setdefault("Routes", [])
+            group.setdefault("Cmd", [])
+            self.groups[data["Name"]] = group
+            return group
+
+    # the group as the api shows it, with its status as of now
+    def show_group (self, group):
+        group = dict(group)
+        if time.time() - group["Created"] < self.options.create_time:
+            group["Status"] = "CREATE_IN_PROGRESS"
+        elif group["Failed"]:
+            group["Status"] = "CREATE_FAILED"
+        else:
+            group["Status"] = "CREATE_COMPLETE"
+        del group["Failed"]
+        return group
+
+    def find_group (self, name):
+        group = self.groups.get(name)
+        if group is None:
+            for candidate in self.groups.values():
+                if candidate["Id"] == name:
+                    return candidate
+        return group
+
+    def get_group (self, name):
+        with self.lock:
+            group = self.find_group(name)
+            if group is None:
+                return None
+            return self.show_group(group)
+
+    def list_groups (self):
+        with self.lock:
+            return [self.show_group(group) for group in self.groups.values()]
+
+    def remove_group (self, name):
+        with self.lock:
+            group = self.find_group(name)
+            if group is None:
+                return False
+            del self.groups[group["Name"]]
+            return True
+
+
+option_parser = argparse.ArgumentParser(prog="ccs_server.py")
+option_parser.add_argument("--host", default="127.0.0.1")
+option_parser.add_argument("--port", type=int, default=8443, help="port to listen on, 0 to pick a free one")
+option_parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every api call")
+option_parser.add_argument("--jitter", type=float, default=0.0, help="up to this many seconds more or less latency")
+option_parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of api calls answered with a 5xx")
+option_parser.add_argument("--create-time", type=float, default=5.0, help="seconds a new group is CREATE_IN_PROGRESS")
+option_parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of groups that end up CREATE_FAILED")
+option_parser.add_argument("--token", action="store_true", help="refuse calls without an X-Auth-Token")
+option_parser.add_argument("--verbose", action="store_true", help="log every request")
+
+# start a server in a background thread, for benchmarks and tests.  args
+# are ccs_server.py command line arguments.  Returns the server, its url is
+# server.url, stop it with server.shutdown()
+def start_server (args=None):
+    options = option_parser.parse_args(args or ["--port", "0"])
+    server = CCSServer((options.host, options.port), options, options.verbose)
+    server.url = "http://%s:%i" % server.server_address[:2]
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def main (argv=None):
+    options = option_parser.parse_args(argv)
+    server = CCSServer((options.host, options.port), options, options.verbose)
+    print("Serving the containers api on http://%s:%i" % server.server_address[:2])
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
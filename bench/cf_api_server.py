@@ -0,0 +1,269 @@
+#!/usr/bin/python
+
+#***************************************************************************
+# Copyright 2015 IBM
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#***************************************************************************
+
+# A local stand in for the parts of the cloud foundry v2 api that
+# python_utils.CFRestBackend looks things up with, serving the same space
+# as fake_cf.py (FAKE_CF_SERVICES and FAKE_CF_VCAP_KB size it):
+#    GET  /v2/spaces/SPACE/summary
+#    GET  /v2/spaces/SPACE/apps?q=name:NAME
+#    GET  /v2/spaces/SPACE/service_instances?q=name:NAME
+#    GET  /v2/apps/GUID/env
+#    GET  /v2/service_instances/GUID/service_keys[?q=name:NAME]
+#    GET  /_stats                       request and connection counts
+#
+#    python bench/cf_api_server.py [--port 8080] [--latency 0] [--verbose]
+#
+# --latency holds every api call back that many seconds, a large one
+# stands in for an api that hangs.  Run "python bench/cf_api_server.py
+# --check" to run CFRestBackend's lookups against it, including one
+# against a hung api that has to give up at the command deadline
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import timeit
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import fake_cf
+
+SPACE_GUID = "bench-space-guid"
+KEY_GUID = "bench-key-guid"
+
+
+def guid (name):
+    return name + "-guid"
+
+def resource (name, entity=None):
+    entity = dict(entity or {})
+    entity["name"] = name
+    return { "metadata": { "guid": guid(name) }, "entity": entity }
+
+def page (resources):
+    return { "total_results": len(resources), "total_pages": 1, "next_url": None, "resources": resources }
+
+# the space summary, the same services and apps the cf cli stand in lists
+def space_summary (count):
+    apps = []
+    services = []
+    for i in range(count - 1):
+        apps.append({ "name": "app-%05i" % i, "service_names": ["instance-%05i" % i] })
+        services.append({
+            "name": "instance-%05i" % i,
+            "service_plan": { "name": "free", "service": { "label": "service-%03i" % (i % 200) } },
+            "last_operation": { "type": "create", "state": "succeeded" }
+        })
+    apps.append({ "name": "app-other", "service_names": [fake_cf.TARGET_INSTANCE] })
+    apps.append({ "name": fake_cf.TARGET_APP, "service_names": [fake_cf.TARGET_INSTANCE] })
+    services.append({
+        "name": fake_cf.TARGET_INSTANCE,
+        "service_plan": { "name": "free", "service": { "label": fake_cf.TARGET_SERVICE } },
+        "last_operation": { "type": "create", "state": "succeeded" },
+        "dashboard_url": "https://bench.example.com/dashboard"
+    })
+    return { "guid": SPACE_GUID, "name": "bench", "apps": apps, "services": services }
+
+
+class CFAPIHandler (BaseHTTPRequestHandler):
+    # keep-alive, like the real api
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message (self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def setup (self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.count("connections")
+
+    def send_json (self, status, data=None):
+        body = b""
+        if data is not None:
+            body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # the name asked for with q=name:NAME, None if there's no query
+    def query_name (self, query):
+        for q in query.get("q", []):
+            field, sep, value = q.partition(":")
+            if sep:
+                return value
+        return None
+
+    def do_GET (self):
+        url = urlparse(self.path)
+        path = url.path.rstrip("/")
+        query = parse_qs(url.query)
+        if path == "/_stats":
+            return self.send_json(200, self.server.get_stats())
+
+        self.server.count("requests")
+        if self.server.options.latency > 0:
+            time.sleep(self.server.options.latency)
+        if not self.headers.get("Authorization"):
+            return self.send_json(401, { "error_code": "CF-NotAuthenticated" })
+
+        spacePath = "/v2/spaces/" + SPACE_GUID
+        name = self.query_name(query)
+        if path == spacePath + "/summary":
+            return self.send_json(200, space_summary(fake_cf.services_count()))
+        if path == spacePath + "/apps":
+            summary = space_summary(fake_cf.services_count())
+            return self.send_json(200, page([resource(app["name"]) for app in summary["apps"] if name in (None, app["name"])]))
+        if path == spacePath + "/service_instances":
+            summary = space_summary(fake_cf.services_count())
+            return self.send_json(200, page([resource(instance["name"], { "dashboard_url": instance.get("dashboard_url") })
+                                             for instance in summary["services"] if name in (None, instance["name"])]))
+        if path == "/v2/apps/" + guid(fake_cf.TARGET_APP) + "/env":
+            return self.send_json(200, { "system_env_json": { "VCAP_SERVICES": fake_cf.vcap_services(fake_cf.vcap_kb()) } })
+        if path == "/v2/service_instances/" + guid(fake_cf.TARGET_INSTANCE) + "/service_keys":
+            keys = [{ "metadata": { "guid": KEY_GUID }, "entity": { "name": fake_cf.KEY_NAME, "credentials": fake_cf.TARGET_CREDENTIALS } }]
+            return self.send_json(200, page([key for key in keys if name in (None, key["entity"]["name"])]))
+        if path.startswith("/v2/service_instances/") and path.endswith("/service_keys"):
+            return self.send_json(200, page([]))
+        self.send_json(404, { "error_code": "CF-NotFound" })
+
+
+class CFAPIServer (ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__ (self, address, options, verbose=False):
+        HTTPServer.__init__(self, address, CFAPIHandler)
+        self.options = options
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.stats = { "connections": 0, "requests": 0 }
+
+    def count (self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def get_stats (self):
+        with self.lock:
+            return dict(self.stats)
+
+
+option_parser = argparse.ArgumentParser(prog="cf_api_server.py")
+option_parser.add_argument("--host", default="127.0.0.1")
+option_parser.add_argument("--port", type=int, default=8080, help="port to listen on, 0 to pick a free one")
+option_parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every api call")
+option_parser.add_argument("--verbose", action="store_true", help="log every request")
+option_parser.add_argument("--check", action="store_true", help="check CFRestBackend against the api, then exit")
+
+# start a server in a background thread, for benchmarks and tests.  args
+# are cf_api_server.py command line arguments.  Returns the server, its url
+# is server.url, stop it with server.shutdown()
+def start_server (args=None):
+    options = option_parser.parse_args(args or ["--port", "0"])
+    server = CFAPIServer((options.host, options.port), options, options.verbose)
+    server.url = "http://%s:%i" % server.server_address[:2]
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+# run the CFRestBackend lookups against a stand in api, then against one
+# that doesn't answer for longer than PIPELINE_COMMAND_TIMEOUT, which has
+# to fail at the deadline rather than hang.  Returns the failures
+def check_rest_backend ():
+    import python_utils
+
+    failures = []
+    server = start_server()
+    try:
+        backend = python_utils.CFRestBackend(server.url, "bench-token", SPACE_GUID)
+        checks = [
+            ("list_services", lambda: backend.list_services().find_by_service(fake_cf.TARGET_SERVICE)[0].name, fake_cf.TARGET_INSTANCE),
+            ("get_service_dashboard", lambda: backend.get_service_dashboard(fake_cf.TARGET_INSTANCE), "https://bench.example.com/dashboard"),
+            ("app_exists", lambda: backend.app_exists(fake_cf.TARGET_APP), True),
+            ("get_vcap_services", lambda: backend.get_vcap_services(fake_cf.TARGET_APP)[fake_cf.TARGET_SERVICE][0]["credentials"], fake_cf.TARGET_CREDENTIALS),
+            ("list_service_keys", lambda: backend.list_service_keys(fake_cf.TARGET_INSTANCE), [fake_cf.KEY_NAME]),
+            ("get_service_key", lambda: backend.get_service_key(fake_cf.TARGET_INSTANCE, fake_cf.KEY_NAME), fake_cf.TARGET_CREDENTIALS),
+        ]
+        for name, check, expected in checks:
+            result = check()
+            if result != expected:
+                failures.append("%s returned %r, expected %r" % (name, result, expected))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    savedTimeout = python_utils.COMMAND_TIMEOUT
+    python_utils.COMMAND_TIMEOUT = 2
+    server = start_server(["--port", "0", "--latency", "30"])
+    try:
+        backend = python_utils.CFRestBackend(server.url, "bench-token", SPACE_GUID)
+        start = timeit.default_timer()
+        result = backend.list_services()
+        elapsed = timeit.default_timer() - start
+        if result is not None:
+            failures.append("list_services against a hung api returned %r, expected None" % (result,))
+        if elapsed > python_utils.COMMAND_TIMEOUT + 2:
+            failures.append("list_services against a hung api took %.1fs, the deadline was %.1fs" % (elapsed, python_utils.COMMAND_TIMEOUT))
+    finally:
+        python_utils.COMMAND_TIMEOUT = savedTimeout
+        server.shutdown()
+        server.server_close()
+
+    return failures
+
+def main (argv=None):
+    options = option_parser.parse_args(argv)
+    if options.check:
+        import python_utils
+        python_utils.LOGGER = logging.getLogger("bench")
+        python_utils.LOGGER.addHandler(logging.StreamHandler(sys.stderr))
+        python_utils.LOGGER.setLevel(logging.WARNING)
+        python_utils.TRACE_FILE = None
+        failures = check_rest_backend()
+        for failure in failures:
+            print("FAILED: " + failure)
+        if failures:
+            return 1
+        print("CFRestBackend checks passed")
+        return 0
+
+    server = CFAPIServer((options.host, options.port), options, options.verbose)
+    print("Serving the cf api on http://%s:%i, space guid %s" % (server.server_address[:2] + (SPACE_GUID,)))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+
+#***************************************************************************
+# Copyright 2015 IBM
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#***************************************************************************
+
+# A stand in for the cf cli for the benchmarks, answering with generated
+# output in the same format as the real one.  The size of the space is
+# set with:
+#    FAKE_CF_SERVICES  number of service instances (default 100)
+#    FAKE_CF_VCAP_KB   size of the VCAP_SERVICES of the bound app, in KB
+#                      (default 16)
+# The service the benchmarks look for, TARGET_SERVICE, is listed last,
+# bound to TARGET_APP, and has a service key
+#
+# Run as "python fake_cf.py <cf args>", or import it and call render()
+
+import json
+import os
+import sys
+
+TARGET_SERVICE = "bench-target"
+TARGET_INSTANCE = "bench-target-instance"
+TARGET_APP = "bench-app"
+TARGET_CREDENTIALS = { "url": "https://bench.example.com", "username": "bench", "password": "p\"w" }
+KEY_NAME = "pipeline_service_key"
+
+# the columns of the services table, wide enough for the generated names
+NAME_WIDTH = 32
+SERVICE_WIDTH = 24
+PLAN_WIDTH = 12
+BOUND_WIDTH = 40
+
+
+def services_count ():
+    return int(os.getenv('FAKE_CF_SERVICES', "100"))
+
+def vcap_kb ():
+    return int(os.getenv('FAKE_CF_VCAP_KB', "16"))
+
+def services_row (name, service, plan, bound, operation):
+    return name.ljust(NAME_WIDTH) + service.ljust(SERVICE_WIDTH) + plan.ljust(PLAN_WIDTH) + bound.ljust(BOUND_WIDTH) + operation
+
+def render_services (count):
+    lines = [
+        "Getting services in org bench / space bench as bench@example.com...",
+        "OK",
+        "",
+        services_row("name", "service", "plan", "bound apps", "last operation")
+    ]
+    for i in range(count - 1):
+        lines.append(services_row("instance-%05i" % i, "service-%03i" % (i % 200), "free", "app-%05i" % i, "create succeeded"))
+    lines.append(services_row(TARGET_INSTANCE, TARGET_SERVICE, "free", "app-other, " + TARGET_APP, "create succeeded"))
+    return "\n".join(lines) + "\n"
+
+def render_apps (count):
+    lines = [
+        "Getting apps in org bench / space bench as bench@example.com...",
+        "OK",
+        "",
+        "name".ljust(NAME_WIDTH) + "requested state   instances   memory   disk   urls"
+    ]
+    for i in range(count):
+        lines.append(("app-%05i" % i).ljust(NAME_WIDTH) + "stopped           0/1         64M      1G")
+    lines.append(TARGET_APP.ljust(NAME_WIDTH) + "stopped           0/1         64M      1G")
+    return "\n".join(lines) + "\n"
+
+# VCAP_SERVICES for the target app, padded out with other bound services to
+# about size_kb
+def vcap_services (size_kb):
+    services = { TARGET_SERVICE: [{ "name": TARGET_INSTANCE, "label": TARGET_SERVICE, "plan": "free", "credentials": TARGET_CREDENTIALS }] }
+    padding = "x" * 1000
+    total = 0
+    i = 0
+    while total < size_kb * 1024:
+        services.setdefault("service-%03i" % (i % 200), []).append({
+            "name": "instance-%05i" % i,
+            "label": "service-%03i" % (i % 200),
+            "plan": "free",
+            "credentials": { "url": "https://instance-%05i.example.com" % i, "padding": padding }
+        })
+        total += len(padding) + 120
+        i += 1
+    return services
+
+def render_env (size_kb):
+    system = json.dumps({ "VCAP_SERVICES": vcap_services(size_kb) }, indent=1, sort_keys=True)
+    application = json.dumps({ "VCAP_APPLICATION": { "name": TARGET_APP } }, indent=1)
+    return "\n".join([
+        "Getting env variables for app " + TARGET_APP + " in org bench / space bench as bench@example.com...",
+        "OK",
+        "",
+        "System-Provided:",
+        system,
+        "",
+        application,
+        "",
+        "No user-defined env variables have been set",
+        ""
+    ])
+
+def render_service_keys (name):
+    return "\n".join([
+        "Getting keys for service instance " + name + " as bench@example.com...",
+        "",
+        "name",
+        KEY_NAME,
+        ""
+    ])
+
+def render_service_key (name, key):
+    return "Getting key " + key + " for service instance " + name + " as bench@example.com...\n\n" + json.dumps(TARGET_CREDENTIALS, indent=1) + "\n"
+
+# the rc and output of "cf <args>"
+def render (args):
+    command = args[0] if args else ""
+    if command == "services":
+        return 0, render_services(services_count())
+    if command == "apps":
+        return 0, render_apps(services_count())
+    if command == "env":
+        return 0, render_env(vcap_kb())
+    if command == "service-keys":
+        return 0, render_service_keys(args[1])
+    if command == "service-key":
+        return 0, render_service_key(args[1], args[2])
+    if command == "api":
+        return 0, "API endpoint: https://api.bench.example.com (API version: 2.23.0)\n"
+    if command in ("create-service", "bind-service", "csk", "push"):
+        return 0, "OK\n"
+    return 1, "'" + command + "' is not a registered command. See 'cf help'\n"
+
+
+def main (argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    rc, out = render(argv)
+    sys.stdout.write(out)
+    return rc
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+#!/usr/bin/python
+
+#***************************************************************************
+# Copyright 2015 IBM
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#***************************************************************************
+
+# Fingerprint of a docker build context, for ice_build_image to tell when
+# an image of the same context has been built already:
+#
+#    python build_fingerprint.py CONTEXT [--extra TEXT] [--jobs N]
+#
+# prints a sha256 of the files docker would send for CONTEXT (everything
+# not excluded by its .dockerignore, and always the Dockerfile), their
+# paths and permissions, and --extra (the build options, and the ids of
+# the base images).  With --base-images it prints the images the
+# Dockerfile builds FROM instead, one a line.
+#
+# Files are hashed --jobs at a time (default BUILD_FINGERPRINT_JOBS, or 8)
+# in chunks, so big contexts aren't read into memory.  The hash of each
+# file is kept in a local index (EXT_DIR/.build_fingerprint_index.json) by
+# size and modification time, so files that haven't changed since the
+# last fingerprint aren't read again.
+
+import argparse
+import hashlib
+import json
+import os
+import os.path
+import python_utils
+import re
+import stat
+import sys
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+INDEX_FILE = os.path.join(python_utils.EXT_DIR, ".build_fingerprint_index.json")
+CHUNK_SIZE = 1024 * 1024
+try:
+    DEFAULT_JOBS = max(1, int(os.getenv('BUILD_FINGERPRINT_JOBS', "8")))
+except ValueError:
+    DEFAULT_JOBS = 8
+
+
+# a .dockerignore pattern as a regular expression for the path of a file
+# relative to the context, with "/" separators
+def compile_pattern (pattern):
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            # any number of directories, including none
+            regex += "(?:.*/)?"
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+            continue
+        if c == "*":
+            regex += "[^/]*"
+        elif c == "?":
+            regex += "[^/]"
+        elif c == "[" and pattern.find("]", i + 1) != -1:
+            end = pattern.find("]", i + 1)
+            chars = pattern[i + 1:end]
+            if chars.startswith("^") or chars.startswith("!"):
+                chars = "^" + chars[1:]
+            regex += "[" + chars.replace("\\", "\\\\") + "]"
+            i = end + 1
+            continue
+        elif c == "\\" and i + 1 < len(pattern):
+            regex += re.escape(pattern[i + 1])
+            i += 2
+            continue
+        else:
+            regex += re.escape(c)
+        i += 1
+    return re.compile(regex + "$")
+
+# the patterns of the context's .dockerignore, as (exception, regex) in
+# order
+def read_dockerignore (context):
+    patterns = []
+    try:
+        with open(os.path.join(context, ".dockerignore")) as ignoreFile:
+            lines = ignoreFile.read().splitlines()
+    except (IOError, OSError):
+        return patterns
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        exception = line.startswith("!")
+        if exception:
+            line = line[1:].strip()
+        line = os.path.normpath(line).replace(os.sep, "/").lstrip("/")
+        if line in ("", "."):
+            continue
+        patterns.append((exception, compile_pattern(line)))
+    return patterns
+
+# whether docker leaves a path out of the context: the last pattern that
+# matches it, or a directory it's in, decides
+def is_excluded (path, patterns):
+    parents = []
+    parent = path
+    while "/" in parent:
+        parent = parent.rsplit("/", 1)[0]
+        parents.append(parent)
+    excluded = False
+    for exception, regex in patterns:
+        if regex.match(path) or any(regex.match(parent) for parent in parents):
+            excluded = not exception
+    return excluded
+
+# the files of the context docker would send, as sorted relative paths
+def list_context (context, dockerfile="Dockerfile"):
+    patterns = read_dockerignore(context)
+    # a directory can only be skipped whole if nothing in it can be let back in
+    canPrune = not any(exception for exception, regex in patterns)
+    files = []
+    for root, dirs, names in os.walk(context):
+        prefix = os.path.relpath(root, context).replace(os.sep, "/") + "/"
+        if prefix == "./":
+            prefix = ""
+        if canPrune:
+            dirs[:] = [name for name in dirs if not is_excluded(prefix + name, patterns)]
+        # links to directories are sent as links, and not followed
+        for name in dirs:
+            if os.path.islink(os.path.join(root, name)) and not is_excluded(prefix + name, patterns):
+                files.append(prefix + name)
+        for name in names:
+            path = prefix + name
+            if path in (dockerfile, ".dockerignore") or not is_excluded(path, patterns):
+                files.append(path)
+    return sorted(files)
+
+def hash_file (filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as hashedFile:
+        while True:
+            chunk = hashedFile.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_index (index_file):
+    try:
+        with open(index_file) as indexFile:
+            return json.load(indexFile)
+    except (IOError, OSError, ValueError):
+        return {}
+
+# the hash of each file, jobs at a time, reusing the hashes in cached (a
+# dict of path -> [size, mtime, hash]) for files whose size and mtime are
+# the same.  Returns a dict of path -> (mode, hash) and the updated cache
+def hash_context (context, files, cached, jobs=DEFAULT_JOBS):
+    hashes = {}
+    updated = {}
+    pending = queue.Queue()
+    for path in files:
+        fullPath = os.path.join(context, path)
+        info = os.lstat(fullPath)
+        mode = stat.S_IMODE(info.st_mode)
+        if stat.S_ISLNK(info.st_mode):
+            hashes[path] = (mode, "link:" + os.readlink(fullPath))
+            continue
+        mtime = getattr(info, "st_mtime_ns", int(info.st_mtime * 1e9))
+        entry = cached.get(path)
+        if entry and entry[0] == info.st_size and entry[1] == mtime:
+            hashes[path] = (mode, entry[2])
+            updated[path] = entry
+        else:
+            pending.put((path, mode, info.st_size, mtime))
+
+    lock = threading.Lock()
+    errors = []
+    def worker ():
+        while True:
+            try:
+                path, mode, size, mtime = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                digest = hash_file(os.path.join(context, path))
+            except (IOError, OSError) as e:
+                with lock:
+                    errors.append(e)
+                continue
+            with lock:
+                hashes[path] = (mode, digest)
+                updated[path] = [size, mtime, digest]
+
+    threads = [threading.Thread(target=worker) for i in range(min(jobs, pending.qsize()))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return hashes, updated
+
+# the images the Dockerfile builds FROM, in order, leaving out scratch and
+# earlier stages of the same Dockerfile.  An image that's only known once
+# the build runs (set with ARG) can't be listed, that's an Exception
+def list_base_images (context, dockerfile="Dockerfile"):
+    filename = os.path.join(context, dockerfile)
+    if not os.path.isfile(filename):
+        raise Exception("No " + dockerfile + " in the build context " + context)
+    lines = []
+    with open(filename) as f:
+        line = ""
+        for part in f:
+            part = part.rstrip("\r\n")
+            # instructions continue on the next line after a \
+            if part.endswith("\\"):
+                line += part[:-1] + " "
+                continue
+            lines.append(line + part)
+            line = ""
+        lines.append(line)
+
+    images = []
+    stages = set()
+    for line in lines:
+        words = line.split()
+        if len(words) < 2 or words[0].upper() != "FROM":
+            continue
+        words = [word for word in words[1:] if not word.startswith("--")]
+        if not words:
+            continue
+        image = words[0]
+        if len(words) >= 3 and words[1].upper() == "AS":
+            stages.add(words[2].lower())
+        if image.lower() == "scratch" or image.lower() in stages:
+            continue
+        if "$" in image:
+            raise Exception("The base image " + image + " is set when building")
+        if image not in images:
+            images.append(image)
+    return images
+
+# the fingerprint of a build context, and extra text such as the build
+# options
+def get_fingerprint (context, extra="", dockerfile="Dockerfile", jobs=DEFAULT_JOBS, index_file=INDEX_FILE):
+    context = os.path.abspath(context)
+    if not os.path.isfile(os.path.join(context, dockerfile)):
+        raise Exception("No " + dockerfile + " in the build context " + context)
+    files = list_context(context, dockerfile)
+
+    index = load_index(index_file)
+    hashes, updated = hash_context(context, files, index.get(context, {}), jobs)
+    index[context] = updated
+    try:
+        python_utils.write_private_json(os.path.dirname(os.path.abspath(index_file)), os.path.basename(index_file), index)
+    except (IOError, OSError) as e:
+        python_utils.debug("Could not save the fingerprint index: " + str(e))
+
+    digest = hashlib.sha256()
+    digest.update(("build context v1\n" + extra.strip() + "\n").encode("utf-8"))
+    for path in files:
+        mode, fileHash = hashes[path]
+        digest.update(("%s\0%o\0%s\n" % (path, mode, fileHash)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def main (argv=None):
+    parser = argparse.ArgumentParser(prog="build_fingerprint.py")
+    parser.add_argument("context", help="the build context directory")
+    parser.add_argument("--extra", default="", help="more to fingerprint, such as the build options")
+    parser.add_argument("--dockerfile", default="Dockerfile", help="the Dockerfile, relative to the context")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help="files to hash at a time")
+    parser.add_argument("--base-images", action="store_true", help="list the images the Dockerfile builds from instead")
+    args = parser.parse_args(argv)
+
+    if args.base_images:
+        try:
+            images = list_base_images(os.path.abspath(args.context), args.dockerfile)
+        except Exception as e:
+            sys.stderr.write("Unable to list the base images: " + str(e) + "\n")
+            return 1
+        for image in images:
+            print(image)
+        return 0
+
+    try:
+        fingerprint = get_fingerprint(args.context, args.extra, args.dockerfile, max(1, args.jobs))
+    except Exception as e:
+        sys.stderr.write("Unable to fingerprint the build context: " + str(e) + "\n")
+        return 1
+    print(fingerprint)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
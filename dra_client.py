@@ -0,0 +1,349 @@
+#!/usr/bin/python
+
+#***************************************************************************
+# Copyright 2015 IBM
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#***************************************************************************
+
+# Deployment Risk Analytics (DRA) client for dra_utils.sh:
+#
+#    python dra_client.py project-key [--refresh]
+#    python dra_client.py events [--criteria FILE]... [--result EVENT_TYPE:FILE]...
+#        [--drilldown-url URL] [--replace]
+#    python dra_client.py decision CRITERIA_NAME [--exports]
+#
+# project-key prints the DRA project key of IDS_PROJECT_NAME.  Keys are
+# kept on disk (in DRA_CACHE_DIR, default EXT_DIR/.dra_cache), so a project
+# is only registered once.
+#
+# events sends criteria files and result files in one step, and prints
+# what happened to each as json.  Criteria go to the DRA api over one
+# pooled session (--replace deletes the criteria of the same name first),
+# with the key in DRA_PROJECT_KEY if it's set.  If DRA turns the key down
+# (401 or 404), it's fetched again, once, and the criteria sent again.
+# The api for result events isn't published, so results still go through
+# grunt-idra, but the grunt runs happen DRA_GRUNT_JOBS (default 4) at a
+# time instead of one after another.
+#
+# decision runs the grunt-idra decision and prints it, and the report url,
+# as json, or with --exports as DRA_DECISION, DRA_REPORT_URL and
+# DRA_DECISION_JSON exports for the shell to eval.  Exits like
+# dra_grunt_decision: 0 Proceed, 1 Stop - Advisory, 2 Stop, 3 some other
+# decision, 4 and 5 no decision, 6 no response.
+#
+# DRA_SERVER (default http://da.oneibmcloud.com) points the api calls
+# somewhere else, such as a local stand in.
+
+import argparse
+import collections
+import hashlib
+import json
+import logging
+import os
+import os.path
+import python_utils
+import re
+import sys
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+DRA_SERVER = os.getenv('DRA_SERVER', "http://da.oneibmcloud.com").rstrip("/")
+DRA_CACHE_DIR = os.getenv('DRA_CACHE_DIR', os.path.join(python_utils.EXT_DIR, ".dra_cache"))
+GRUNT_FILE = "node_modules/grunt-idra/idra.js"
+try:
+    GRUNT_JOBS = max(1, int(os.getenv('DRA_GRUNT_JOBS', "4")))
+except ValueError:
+    GRUNT_JOBS = 4
+TIMEOUT = 60
+# what DRA answers a project key it doesn't know (any more) with
+KEY_REJECTED_STATUS = (401, 404)
+
+# decision -> exit code, as dra_grunt_decision returns
+DECISION_RC = { "Proceed": 0, "Stop - Advisory": 1, "Stop": 2 }
+RC_OTHER_DECISION = 3
+RC_NO_DECISION = 4
+RC_NO_DECISION_IN_RESPONSE = 5
+RC_EMPTY_RESPONSE = 6
+
+LOGGER = None
+
+
+def debug (message):
+    if LOGGER:
+        LOGGER.debug(message)
+
+# a session for the DRA api, keeping its connection between calls
+def new_session (pool_size=1):
+    session = python_utils.new_http_session(pool_size=pool_size)
+    session.headers.update({ "Content-Type": "application/json" })
+    return session
+
+# the cached project key of a project, or None
+def get_cached_project_key (project_name):
+    filename = os.path.join(DRA_CACHE_DIR, get_cache_name(project_name))
+    try:
+        with open(filename) as cacheFile:
+            entry = json.load(cacheFile)
+    except (IOError, OSError, ValueError):
+        return None
+    if entry.get("project") != project_name or entry.get("server") != DRA_SERVER:
+        return None
+    return entry.get("projectkey")
+
+def get_cache_name (project_name):
+    return hashlib.sha256((DRA_SERVER + "\n" + project_name).encode("utf-8")).hexdigest() + ".json"
+
+# the DRA project key of a project, from the cache or by registering the
+# project with DRA.  Raises an exception if DRA doesn't give one
+def get_project_key (project_name, session, refresh=False):
+    if not refresh:
+        projectKey = get_cached_project_key(project_name)
+        if projectKey:
+            debug("Using the cached DRA project key for " + project_name)
+            return projectKey
+
+    debug("Fetching DRA project key for " + project_name)
+    response = session.post(DRA_SERVER + "/api/v1/project", data=json.dumps({ "projectName": project_name }), timeout=TIMEOUT)
+    debug("DRA project response (%i): %s" % (response.status_code, response.text))
+    try:
+        projectKey = response.json().get("projectkey")
+    except (ValueError, AttributeError):
+        projectKey = None
+    if not projectKey:
+        raise Exception("Could not get the DRA project key for " + project_name + ", response code " + str(response.status_code))
+    python_utils.write_private_json(DRA_CACHE_DIR, get_cache_name(project_name),
+                                    { "project": project_name, "server": DRA_SERVER, "projectkey": projectKey })
+    return projectKey
+
+# the project key events are sent with.  A key DRA turns down (such as a
+# cached one for a project that's been registered again) is replaced by
+# asking DRA again, once, for every thread sending with it
+class ProjectKey (object):
+
+    def __init__ (self, project_key, project_name=None, session=None):
+        self.key = project_key
+        self.project_name = project_name
+        self.session = session
+        self.refreshed = False
+        self.lock = threading.Lock()
+
+    # the key to use after rejected was turned down, or None if there's no
+    # other key to try
+    def refresh (self, rejected):
+        with self.lock:
+            if self.key != rejected:
+                return self.key
+            if self.refreshed or not self.project_name:
+                return None
+            self.refreshed = True
+            debug("DRA turned down the project key of " + self.project_name + ", fetching it again")
+            self.key = get_project_key(self.project_name, self.session, refresh=True)
+            return self.key
+
+# whether a DRA or grunt-idra response says the rule was rejected
+def is_rejected (response):
+    response = response.lower()
+    return "syntaxerror" in response or "invalid" in response
+
+# send a criteria file, replacing the criteria of the same name if asked.
+# project_key is a key, or a ProjectKey to refresh it from if DRA turns it
+# down.  Returns None if it was accepted, or the reason it wasn't
+def add_criteria (filename, session, project_key, replace=False):
+    if not isinstance(project_key, ProjectKey):
+        project_key = ProjectKey(project_key)
+    with open(filename) as criteriaFile:
+        body = criteriaFile.read()
+    key = project_key.key
+    while True:
+        headers = { "projectKey": key }
+        if replace:
+            # the criteria's name, or as dra_utils.sh names the file, NAME.json
+            name = json.loads(body).get("name") or os.path.splitext(os.path.basename(filename))[0]
+            session.delete(DRA_SERVER + "/api/v1/criteria", params={ "name": name }, headers=headers, timeout=TIMEOUT)
+        response = session.post(DRA_SERVER + "/api/v1/criteria", data=body, headers=headers, timeout=TIMEOUT)
+        debug("DRA criteria response for %s (%i): %s" % (filename, response.status_code, response.text))
+        if response.status_code not in KEY_REJECTED_STATUS:
+            break
+        key = project_key.refresh(key)
+        if key is None:
+            break
+    if response.status_code >= 400:
+        return "response code " + str(response.status_code)
+    if is_rejected(response.text):
+        return response.text.strip()
+    return None
+
+# run a grunt-idra command, return its exit code and output.  It's stopped
+# if it runs past python_utils.get_command_deadline()
+def run_grunt (args):
+    command = ["grunt", "--gruntfile=" + GRUNT_FILE] + args
+    debug("grunt CMD: " + " ".join(command))
+    rc, out, err = python_utils.run_command(command, merge_stderr=True)
+    out += err
+    debug(out)
+    return rc, out
+
+# send a result file with grunt-idra.  Returns None if it was accepted, or
+# the reason it wasn't
+def add_result (event_type, filename, drilldown_url=None):
+    args = ["-eventType=" + event_type, "-file=" + filename]
+    if drilldown_url:
+        args.append("-drilldownUrl=" + drilldown_url)
+    rc, out = run_grunt(args)
+    if rc != 0:
+        return "grunt exited with " + str(rc)
+    if is_rejected(out):
+        return out.strip()
+    return None
+
+# send criteria and result files in one go: the criteria over the session,
+# and the results GRUNT_JOBS grunt runs at a time.  With project_name, a
+# project key DRA turns down is fetched again and the criteria sent with
+# the new one.  Returns a list of {"kind", "file", "ok", "error"} in the
+# order given
+def send_events (criteria, results, session, project_key, drilldown_url=None, replace=False, project_name=None):
+    project_key = ProjectKey(project_key, project_name, session)
+    outcome = []
+    for filename in criteria:
+        outcome.append({ "kind": "criteria", "file": filename })
+    for eventType, filename in results:
+        outcome.append({ "kind": "result", "event_type": eventType, "file": filename })
+
+    pending = queue.Queue()
+    for item in outcome:
+        pending.put(item)
+
+    def worker ():
+        while True:
+            try:
+                item = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                if item["kind"] == "criteria":
+                    error = add_criteria(item["file"], session, project_key, replace)
+                else:
+                    error = add_result(item["event_type"], item["file"], drilldown_url)
+            except Exception as e:
+                error = str(e)
+            item["ok"] = error is None
+            item["error"] = error
+
+    threads = [threading.Thread(target=worker) for i in range(min(GRUNT_JOBS, len(outcome)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcome
+
+# the decision and report url in grunt-idra's decision output.  Returns a
+# dict of "decision", "report_url" and "rc"
+def parse_decision (output):
+    result = collections.OrderedDict([("decision", None), ("report_url", None), ("rc", RC_EMPTY_RESPONSE)])
+    if not output.strip():
+        return result
+    if "decision" not in output:
+        result["rc"] = RC_NO_DECISION_IN_RESPONSE
+        return result
+    match = re.search(r'"decision":"([^"]*)"', output)
+    if match:
+        result["decision"] = match.group(1)
+    # the url is followed by the color escape codes of the grunt output
+    match = re.search(r"Check the report at - ([^\s\x1b\[]+)", output)
+    if match:
+        result["report_url"] = match.group(1)
+    if not result["decision"]:
+        result["rc"] = RC_NO_DECISION
+    else:
+        result["rc"] = DECISION_RC.get(result["decision"], RC_OTHER_DECISION)
+    return result
+
+def get_decision (criteria_name):
+    rc, out = run_grunt(["-decision=" + criteria_name])
+    if rc != 0:
+        raise Exception("grunt decision for " + criteria_name + " exited with " + str(rc))
+    result = parse_decision(out)
+    result["criteria"] = criteria_name
+    return result
+
+
+def main (argv=None):
+    global LOGGER
+
+    # stdout is the result for the shell, log to stderr
+    LOGGER = logging.getLogger('pipeline')
+    LOGGER.addHandler(logging.StreamHandler(sys.stderr))
+    LOGGER.setLevel(logging.DEBUG if python_utils.DEBUG else logging.WARNING)
+    python_utils.LOGGER = LOGGER
+
+    parser = argparse.ArgumentParser(prog="dra_client.py")
+    subparsers = parser.add_subparsers(dest="command")
+    keyParser = subparsers.add_parser("project-key", help="print the DRA project key of IDS_PROJECT_NAME")
+    keyParser.add_argument("--refresh", action="store_true", help="ask DRA again rather than use the cached key")
+    eventsParser = subparsers.add_parser("events", help="send criteria and result files")
+    eventsParser.add_argument("--criteria", action="append", default=[], metavar="FILE")
+    eventsParser.add_argument("--result", action="append", default=[], metavar="EVENT_TYPE:FILE")
+    eventsParser.add_argument("--drilldown-url", help="drilldown url for the results")
+    eventsParser.add_argument("--replace", action="store_true", help="delete criteria of the same name first")
+    decisionParser = subparsers.add_parser("decision", help="get the decision for a criteria")
+    decisionParser.add_argument("criteria_name")
+    decisionParser.add_argument("--exports", action="store_true", help="print shell exports instead of json")
+    args = parser.parse_args(argv)
+
+    if args.command is None:
+        parser.print_help()
+        return 1
+
+    try:
+        if args.command == "decision":
+            result = get_decision(args.criteria_name)
+            if args.exports:
+                print("export DRA_DECISION=" + python_utils.shell_quote(result["decision"] or ""))
+                print("export DRA_REPORT_URL=" + python_utils.shell_quote(result["report_url"] or ""))
+                print("export DRA_DECISION_JSON=" + python_utils.shell_quote(json.dumps(result)))
+            else:
+                print(json.dumps(result))
+            return result["rc"]
+
+        projectName = os.getenv('IDS_PROJECT_NAME')
+        if not projectName:
+            raise Exception("IDS_PROJECT_NAME is not set")
+        session = new_session(pool_size=GRUNT_JOBS)
+        if args.command == "project-key":
+            print(get_project_key(projectName, session, args.refresh))
+            return 0
+
+        # the key dra_utils.sh got already, if it did.  Only the criteria
+        # need one, results go through grunt-idra
+        projectKey = os.getenv('DRA_PROJECT_KEY')
+        if not projectKey and args.criteria:
+            projectKey = get_project_key(projectName, session)
+
+        results = []
+        for result in args.result:
+            eventType, sep, filename = result.partition(":")
+            if not sep or not eventType or not filename:
+                parser.error("--result must be EVENT_TYPE:FILE, not " + result)
+            results.append((eventType, filename))
+        outcome = send_events(args.criteria, results, session, projectKey, args.drilldown_url, args.replace, projectName)
+        print(json.dumps(outcome))
+        return 0 if all(item["ok"] for item in outcome) else 1
+    except Exception as e:
+        LOGGER.error(str(e))
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -22,6 +22,16 @@ debugme() {
   [[ $DEBUG = 1 ]] && "$@" || :
 }
 
+###############################
+# check for the DRA client    #
+###############################
+# dra_client.py keeps the project key on disk, talks to DRA over one
+# connection and sends a batch of events in one step.  Set USE_DRA_CLIENT
+# to false to use curl and grunt for everything
+use_dra_client() {
+    [ "${USE_DRA_CLIENT}" != "false" ] && command -v python > /dev/null && [ -f "${EXT_DIR}/utilities/dra_client.py" ]
+}
+
 ###############################
 # get project key             #
 ###############################
@@ -34,6 +44,16 @@ get_dra_prject_key() {
         return 1
     fi 
 
+    if use_dra_client; then
+        local CACHED_PROJECT_KEY=""
+        if CACHED_PROJECT_KEY=$(python "${EXT_DIR}/utilities/dra_client.py" project-key) && [ -n "$CACHED_PROJECT_KEY" ]; then
+            export DRA_PROJECT_KEY="$CACHED_PROJECT_KEY"
+            debugme echo -e "Successfully get the project key ${DRA_PROJECT_KEY}"
+            return 0
+        fi
+        debugme echo -e "dra_client.py could not get the project key, asking DRA with curl"
+    fi
+
     # set project.json and dra-response.info files
     local PROJECT_FILE="project.json"
     local RESPONSE_FILE="dra-response.info"
@@ -86,6 +106,11 @@ add_criterial_rule_to_dra() {
         return 1
     fi 
 
+    if use_dra_client; then
+        python "${EXT_DIR}/utilities/dra_client.py" events --criteria "${EXT_DIR}/${CRITERIAL_FILE}" > /dev/null
+        return $?
+    fi
+
     # set the criterial file
     local RESPONSE_FILE="dra-response.info"
     if [ -e "$RESPONSE_FILE" ]; then
@@ -132,6 +157,11 @@ add_result_rule_to_dra() {
     fi 
     debugme echo -e "Set result rule with eventType '${EVENT_TYPE}' to DRA in file '${RESULT_FILE}'"
 
+    if use_dra_client; then
+        add_results_to_dra "${EVENT_TYPE}:${RESULT_FILE}"
+        return $?
+    fi
+
     DRILL_DOWN_URL_FILE="result_url"
     if [ -e "$DRILL_DOWN_URL_FILE" ]; then
         local DRILL_DOWN_URL=$(cat $DRILL_DOWN_URL_FILE)
@@ -161,6 +191,42 @@ add_result_rule_to_dra() {
     return 0
 }
 
+###############################
+# add results to DRA          #
+###############################
+# Send several result files in one step, each argument is EVENT_TYPE:FILE.
+# add_result_rule_to_dra sends its file through here when dra_client.py
+# can be used
+add_results_to_dra() {
+    if [ $# -eq 0 ]; then
+        debugme echo -e "Set results to DRA failed. No result files given."
+        return 1
+    fi
+
+    if use_dra_client; then
+        local CMD=""
+        local RESULT
+        for RESULT in "$@"; do
+            CMD="$CMD --result $RESULT"
+        done
+        if [ -e "result_url" ]; then
+            CMD="$CMD --drilldown-url $(cat result_url)"
+        fi
+        local RESPONSE=""
+        RESPONSE=$(python "${EXT_DIR}/utilities/dra_client.py" events $CMD)
+        local RC=$?
+        debugme echo -e "$RESPONSE"
+        return $RC
+    fi
+
+    local FAILED=0
+    local RESULT
+    for RESULT in "$@"; do
+        add_result_rule_to_dra "${RESULT#*:}" "${RESULT%%:*}" || FAILED=1
+    done
+    return $FAILED
+}
+
 ###############################
 # Setup grunt idra            #
 ###############################
@@ -329,6 +395,28 @@ set_event_type(){
      return 0
 }
 
+########################################
+# send the DRA decision notification   #
+########################################
+# Send DRA_DECISION and DRA_REPORT_URL for the criterial name, and return
+# 0 for Proceed, 1 for Stop - Advisory, 2 for Stop, 3 for anything else
+notify_dra_decision(){
+    local CRITERIAL_NAME=$1
+    if [ "$DRA_DECISION" == "Proceed" ]; then
+        ${EXT_DIR}/utilities/sendMessage.sh -l good -m "Check the <${DRA_REPORT_URL}|'${CRITERIAL_NAME} Deployment Risk Analytics Decision'> report with decision: '${DRA_DECISION}'."
+        return 0
+    elif [ "$DRA_DECISION" == "Stop - Advisory" ]; then
+        ${EXT_DIR}/utilities/sendMessage.sh -l good -m "Check the <${DRA_REPORT_URL}|'${CRITERIAL_NAME} Deployment Risk Analytics Decision'> report with decision: '${DRA_DECISION}'."
+        return 1
+    elif [ "$DRA_DECISION" == "Stop" ]; then
+        ${EXT_DIR}/utilities/sendMessage.sh -l bad -m "Check the <${DRA_REPORT_URL}|'${CRITERIAL_NAME} Deployment Risk Analytics Decision'> report with decision: '${DRA_DECISION}'."
+        return 2
+    else
+        debugme echo -e "Failed to get correct decision result. The DRA_DECISION is ${DRA_DECISION}"
+        return 3
+    fi
+}
+
 ########################################
 # run DRA grunt decision command       #
 ########################################
@@ -341,6 +429,30 @@ dra_grunt_decision(){
         return 1
     fi     
 
+    if use_dra_client; then
+        local DECISION_EXPORTS=""
+        # don't let a decision from an earlier call stand in for this one
+        unset DRA_DECISION DRA_REPORT_URL DRA_DECISION_JSON
+        DECISION_EXPORTS=$(python "${EXT_DIR}/utilities/dra_client.py" decision "${CRITERIAL_NAME}" --exports)
+        local RC=$?
+        # 0-3 are the rcs of an actual decision, anything else is a failure
+        # and its output isn't trusted
+        if [ $RC -gt 3 ]; then
+            debugme echo -e "Failed to get decision result, dra_client.py exited with ${RC}"
+            return $RC
+        fi
+        eval "$DECISION_EXPORTS"
+        if [ -z "$DRA_DECISION" ] || [ -z "$DRA_DECISION_JSON" ]; then
+            debugme echo -e "Failed to get decision result"
+            if [ $RC -eq 0 ]; then
+                RC=1
+            fi
+            return $RC
+        fi
+        notify_dra_decision "${CRITERIAL_NAME}"
+        return $?
+    fi
+
     local CMD="-decision=${CRITERIAL_NAME}"
     debugme echo -e "grunt CMD: grunt --gruntfile=node_modules/grunt-idra/idra.js $CMD"
     local RESPONSE="$(grunt --gruntfile=node_modules/grunt-idra/idra.js $CMD)"
@@ -358,19 +470,8 @@ dra_grunt_decision(){
             export DRA_DECISION=$(echo $RESPONSE | sed 's/.*"decision":"//' | awk -F "\"" '{print $1}')
             export DRA_REPORT_URL=$(echo $RESPONSE | sed 's/.*Check the report at - //' | awk -F "[" '{print $1}')
             if [ -n "$DRA_DECISION" ]; then
-                if [ "$DRA_DECISION" == "Proceed" ]; then
-                    ${EXT_DIR}/utilities/sendMessage.sh -l good -m "Check the <${DRA_REPORT_URL}|'${CRITERIAL_NAME} Deployment Risk Analytics Decision'> report with decision: '${DRA_DECISION}'."
-                    return 0
-                elif [ "$DRA_DECISION" == "Stop - Advisory" ]; then
-                    ${EXT_DIR}/utilities/sendMessage.sh -l good -m "Check the <${DRA_REPORT_URL}|'${CRITERIAL_NAME} Deployment Risk Analytics Decision'> report with decision: '${DRA_DECISION}'."
-                    return 1
-                elif [ "$DRA_DECISION" == "Stop" ]; then
-                    ${EXT_DIR}/utilities/sendMessage.sh -l bad -m "Check the <${DRA_REPORT_URL}|'${CRITERIAL_NAME} Deployment Risk Analytics Decision'> report with decision: '${DRA_DECISION}'."
-                    return 2
-                else
-                    debugme echo -e "Failed to get correct decision result. The DRA_DECISION is ${DRA_DECISION}"
-                    return 3
-                fi
+                notify_dra_decision "${CRITERIAL_NAME}"
+                return $?
             else
                 debugme echo -e "Failed to get decision result"
                 return 4
@@ -414,11 +515,17 @@ setup_dra(){
                 if [ $RESULT -eq 0 ]; then
                     # delete criterial rule
                     debugme echo -e "Checking and deleting the previous criterial rule"
-                    local DRA_ADD_CRITERIAL_URL="http://da.oneibmcloud.com/api/v1/criteria"
-                    curl -k -H projectKey:$DRA_PROJECT_KEY -X DELETE $DRA_ADD_CRITERIAL_URL?name=$CRITERIAL_NAME
-                    # add criterial for DRA
-                    add_criterial_rule_to_dra "${CRITERIAL_NAME}.json"
-                    RESULT=$?
+                    if use_dra_client; then
+                        # replace the criterial rule in one go
+                        python "${EXT_DIR}/utilities/dra_client.py" events --replace --criteria "${EXT_DIR}/${CRITERIAL_NAME}.json" > /dev/null
+                        RESULT=$?
+                    else
+                        local DRA_ADD_CRITERIAL_URL="http://da.oneibmcloud.com/api/v1/criteria"
+                        curl -k -H projectKey:$DRA_PROJECT_KEY -X DELETE $DRA_ADD_CRITERIAL_URL?name=$CRITERIAL_NAME
+                        # add criterial for DRA
+                        add_criterial_rule_to_dra "${CRITERIAL_NAME}.json"
+                        RESULT=$?
+                    fi
                     if [ $RESULT -eq 0 ]; then
                         log_and_echo "DRA project key for projectName '${IDS_PROJECT_NAME}' is '${DRA_PROJECT_KEY}"
                         export DRA_ENABLED=0
@@ -445,6 +552,7 @@ setup_dra(){
     fi
 }
 
+export -f use_dra_client
 export -f get_dra_prject_key
 export -f add_criterial_rule_to_dra
 export -f setup_grunt_idra
@@ -452,9 +560,11 @@ export -f init_dra
 export -f check_dra_enabled
 export -f setup_dra_build
 export -f setup_dra_deploy
+export -f notify_dra_decision
 export -f dra_grunt_decision
 export -f setup_dra
 export -f add_result_rule_to_dra
+export -f add_results_to_dra
 export -f set_event_type
 
 export DRA_PROJECT_KEY
@@ -0,0 +1,275 @@
+#!/usr/bin/python
+
+#***************************************************************************
+# Copyright 2015 IBM
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#***************************************************************************
+
+# Journal of the errors recorded with log_and_echo, behind print_errors and
+# get_error_info in logging_utils.sh:
+#
+#    python error_journal.py print ERROR_LOG_FILE     what print_errors shows
+#    python error_journal.py info ERROR_LOG_FILE      what get_error_info echoes
+#    python error_journal.py summary ERROR_LOG_FILE   the journal as json
+#
+# Rather than every occurrence of every error, the journal (ERROR_LOG_FILE
+# + ".journal") keeps each distinct error once, with how many times it
+# happened and when it first and last did, in the words of its first
+# occurrence.  Errors that differ only in their timestamps, times and
+# attempt counters ("attempt 3", "try 2 of 5", "retry #4") count as the same
+# error; any other difference, a port or an exit code, makes a different
+# one.  Lines without a timestamp, such as command output tee'd into the
+# log, are kept and shown as they are, each one on its own.  At most
+# ERROR_JOURNAL_MAX_DISTINCT (default 100) distinct errors are kept, the
+# oldest make way for new ones.
+#
+# log_and_echo and the log agent append every error to ERROR_LOG_FILE as
+# before.  The journal folds in what was appended since it was last read,
+# and remembers how far it got, so reading it costs the new lines only
+# however long the file grows.  The file itself is never changed; removing
+# or truncating it starts the journal over.
+
+import argparse
+import fcntl
+import json
+import os
+import os.path
+import re
+import sys
+import tempfile
+
+try:
+    MAX_DISTINCT = max(1, int(os.getenv('ERROR_JOURNAL_MAX_DISTINCT', "100")))
+except ValueError:
+    MAX_DISTINCT = 100
+# longest error message kept
+MAX_MESSAGE = 2000
+
+COLOR_CODE = re.compile(r"\x1b\[[0-9;]*[mK]")
+# "2015-06-01 10:11:12 UTC : message", as log_and_echo writes them
+TIMESTAMPED_LINE = re.compile(r"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?: \S+)?) : (.*)$")
+# the parts of a message that change between occurrences of one error
+VOLATILE = [
+    # dates and times
+    (re.compile(r"\d{4}-\d\d-\d\d[ T]\d\d:\d\d:\d\d(?:[.,]\d+)?(?:Z|[+-]\d\d:?\d\d| [A-Z]{2,5}\b)?"), "<time>"),
+    (re.compile(r"\b\d{4}-\d\d-\d\d\b"), "<date>"),
+    (re.compile(r"\b\d\d?:\d\d:\d\d(?:[.,]\d+)?\b"), "<time>"),
+    # attempt counters: "attempt 3", "retry #2", "try 2 of 5", "(3/10)"
+    (re.compile(r"\b(attempts?|retry|retries|retrying|try|tries)\s*(?:number\s*|no\.\s*)?#?\d+(?:\s*(of|/)\s*\d+)?", re.IGNORECASE),
+        lambda match: match.group(1) + " #" + (" " + match.group(2) + " #" if match.group(2) else "")),
+    (re.compile(r"\(\d+/\d+\)"), "(#/#)"),
+]
+
+
+# the timestamp and message of a line of the error log, without colors.
+# Lines without a timestamp (output tee'd into the log) have None for it,
+# and the line as it is for the message
+def parse_line (line):
+    plain = COLOR_CODE.sub("", line).strip()
+    match = TIMESTAMPED_LINE.match(plain)
+    if match:
+        return match.group(1), match.group(2)
+    return None, line.rstrip("\r\n")
+
+# errors are the same error if they only differ in their volatile parts
+def error_key (message):
+    for pattern, replacement in VOLATILE:
+        message = pattern.sub(replacement, message)
+    return message
+
+
+class ErrorJournal (object):
+
+    def __init__ (self, error_log_file):
+        self.error_log_file = error_log_file
+        self.journal_file = error_log_file + ".journal"
+        # (timestamp, message) recorded here and not yet in the journal file
+        self.pending = []
+
+    def new_index (self):
+        return { "version": 1, "inode": None, "offset": 0, "total": 0, "dropped": 0, "entries": [] }
+
+    def load (self):
+        try:
+            with open(self.journal_file) as journal:
+                index = json.load(journal)
+        except (IOError, OSError, ValueError):
+            return self.new_index()
+        if index.get("version") != 1:
+            return self.new_index()
+        return index
+
+    def save (self, index):
+        directory = os.path.dirname(os.path.abspath(self.journal_file))
+        fd, tempName = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as journal:
+            json.dump(index, journal, separators=(",", ":"))
+        os.rename(tempName, self.journal_file)
+
+    # count an occurrence of an error in the index.  Entries are
+    # [key, count, first, last, message], oldest first, with the message
+    # of the first occurrence.  Only timestamped errors are merged, a line
+    # without a timestamp is an entry of its own, with a None key and times
+    def add (self, index, timestamp, message):
+        message = message[:MAX_MESSAGE]
+        key = None
+        if timestamp is not None:
+            key = error_key(message)
+        index["total"] += 1
+        for entry in index["entries"]:
+            if key is not None and entry[0] == key:
+                entry[1] += 1
+                entry[3] = timestamp
+                return
+        index["entries"].append([key, 1, timestamp, timestamp, message])
+        if len(index["entries"]) > MAX_DISTINCT:
+            index["entries"].pop(0)
+            index["dropped"] += 1
+
+    # add the lines appended to the error log since the last fold
+    def fold_error_log (self, index):
+        try:
+            stat = os.stat(self.error_log_file)
+        except OSError:
+            if index["inode"] is not None:
+                # removed since, start over
+                index.update(self.new_index())
+            return
+        if index["inode"] is not None and (stat.st_ino != index["inode"] or stat.st_size < index["offset"]):
+            # replaced or truncated since, start over
+            index.update(self.new_index())
+        if index["inode"] is None:
+            index["inode"] = stat.st_ino
+            index["offset"] = 0
+        if stat.st_size == index["offset"]:
+            return
+
+        with open(self.error_log_file, "rb") as errors:
+            errors.seek(index["offset"])
+            data = errors.read()
+        # leave a partly written last line for next time
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].decode("utf-8", "replace").splitlines():
+            if line.strip():
+                self.add(index, *parse_line(line))
+        index["offset"] += end
+
+    # note an error line, for the next sync to write to the journal
+    def record (self, line):
+        self.pending.append(parse_line(line))
+
+    # bring the journal file up to date with the error log and what's been
+    # recorded here.  Returns the index
+    def sync (self):
+        directory = os.path.dirname(os.path.abspath(self.journal_file))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.journal_file + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                index = self.load()
+                before = (index["inode"], index["offset"], index["total"])
+                self.fold_error_log(index)
+                for timestamp, message in self.pending:
+                    self.add(index, timestamp, message)
+                self.pending = []
+                if (index["inode"], index["offset"], index["total"]) != before:
+                    self.save(index)
+                return index
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+# the journal of an error log as a dict: total, dropped and the entries,
+# oldest first, each a dict of count, first, last and message
+def summary (error_log_file):
+    index = ErrorJournal(error_log_file).sync()
+    return {
+        "total": index["total"],
+        "distinct": len(index["entries"]) + index["dropped"],
+        "dropped": index["dropped"],
+        "entries": [{ "count": count, "first": first, "last": last, "message": message }
+                    for key, count, first, last, message in index["entries"]]
+    }
+
+# the lines print_errors shows for the errors, one per distinct error,
+# in the colorless form get_error_info uses
+def format_entries (journal):
+    lines = []
+    if journal["dropped"]:
+        lines.append("(%i earlier distinct error messages not shown)" % journal["dropped"])
+    for entry in journal["entries"]:
+        if entry["first"] is None:
+            lines.append(entry["message"])
+            continue
+        line = entry["first"] + " : " + entry["message"]
+        if entry["count"] > 1:
+            line += " (repeated %i times, last at %s)" % (entry["count"], entry["last"])
+        lines.append(line)
+    return lines
+
+# the entries in the order format_entries has them, None for the line
+# about dropped entries
+def get_shown_entries (journal):
+    return ([None] if journal["dropped"] else []) + journal["entries"]
+
+def format_title (journal):
+    if journal["total"] == 1:
+        return "There was 1 error message recorded during execution:"
+    return "There were %i error messages recorded during execution:" % journal["total"]
+
+# what print_errors prints: nothing if there's no error log, as before,
+# otherwise the title (even for no errors) and the errors.  In the colors
+# the scripts have set, as log_and_echo and print_errors use them; lines
+# that weren't timestamped are printed as they were logged
+def format_print (journal, exists=True):
+    if not exists:
+        return ""
+    red = os.getenv('red', "").replace("\\e", "\033")
+    labelColor = os.getenv('label_color', "").replace("\\e", "\033")
+    noColor = os.getenv('no_color', "").replace("\\e", "\033")
+    lines = [labelColor + format_title(journal) + noColor]
+    for entry, line in zip(get_shown_entries(journal), format_entries(journal)):
+        if entry is None or entry["first"] is not None:
+            line = red + line + noColor
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+# what get_error_info echoes: a line with "\n" (backslash n) between the
+# title and each error, for notification messages.  An empty line if
+# there's no error log, as before
+def format_info (journal, exists=True):
+    if not exists:
+        return ""
+    text = "\\n" + format_title(journal) + " " + "".join("\\n " + COLOR_CODE.sub("", line) for line in format_entries(journal))
+    return " ".join(text.split())
+
+
+def main (argv=None):
+    parser = argparse.ArgumentParser(prog="error_journal.py")
+    parser.add_argument("command", choices=["print", "info", "summary"])
+    parser.add_argument("error_log_file")
+    args = parser.parse_args(argv)
+
+    exists = os.path.exists(args.error_log_file)
+    journal = summary(args.error_log_file) if exists or os.path.exists(args.error_log_file + ".journal") else { "total": 0, "distinct": 0, "dropped": 0, "entries": [] }
+    if args.command == "print":
+        sys.stdout.write(format_print(journal, exists))
+    elif args.command == "info":
+        print(format_info(journal, exists))
+    else:
+        print(json.dumps(journal))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -23,10 +23,20 @@ import os.path
 import python_utils
 import sys
 import argparse
+import threading
+import time
+import timeit
 import requests
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
-
-python_utils.LOGGER = python_utils.setup_logging()
+# the same logger python_utils.setup_logging configures, so this module
+# logs quietly when imported and through the pipeline handlers when run
+LOGGER = logging.getLogger('pipeline')
+# seconds a watched group can go on not being found before it's given up on
+NOT_FOUND_GRACE = 60
 
 def valid_size(string):
     sizes = [ 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384 ]
@@ -94,7 +104,353 @@ def build_data(args):
         output["NumberInstances"][arg]=str(output["NumberInstances"][arg])
     return output
 
-parser = argparse.ArgumentParser()
+def to_string(value):
+    if isinstance(value, (bool, dict, list)):
+        raise ValueError("%r is not a string" % value)
+    return str(value)
+
+def to_int(value):
+    if isinstance(value, bool):
+        raise ValueError("%r is not a number" % value)
+    return int(value)
+
+def to_bool(value):
+    if isinstance(value, bool):
+        return value
+    return parse_bool(str(value))
+
+def to_string_list(value):
+    if isinstance(value, list):
+        return [to_string(item) for item in value]
+    return [to_string(value)]
+
+def to_size(value):
+    if isinstance(value, bool):
+        raise ValueError("%r is not a valid memory size" % value)
+    return valid_size(str(value))
+
+# the settings of a group spec dict: name -> (check, default), the same
+# names, values and defaults the command line gives.  The check returns
+# the value as the command line would have it, or raises ValueError (or
+# argparse.ArgumentTypeError)
+GROUP_SETTINGS = {
+    "Name": (to_string, None),
+    "Image": (to_string, None),
+    "Memory": (to_size, 256),
+    "host": (to_string, None),
+    "domain": (to_string, None),
+    "Env": (to_string_list, None),
+    "env_file": (to_string, None),
+    "Port": (to_int, None),
+    "PublishAllPorts": (to_bool, False),
+    "Volumes": (to_string_list, None),
+    "Min": (to_int, None),
+    "Max": (to_int, None),
+    "Desired": (to_int, None),
+    "Autorecovery": (to_bool, False),
+    "AntiAffinity": (to_bool, False),
+    "SessionAffinity": (to_bool, False),
+    "HTTP_MONITOR": (to_bool, True),
+    "HTTP_MONITOR_PATH": (to_string, ""),
+    "HTTP_MONITOR_RC_LIST": (to_string, ""),
+    "FloatingIpAddress": (to_string, None),
+    "Cmd": (to_string_list, []),
+}
+
+# turn a group spec into the same args the command line produces.  A spec
+# is either a list of gp_create.py arguments, or a dict of values keyed by
+# the names used in the args (Name, Image, Memory, Port, ...), which is
+# checked setting by setting.  Raises ValueError for a spec that isn't
+# valid
+def spec_to_args(spec, defaults=None):
+    if isinstance(spec, list):
+        return group_args(spec_parser.parse_args([str(arg) for arg in spec]))
+    if not isinstance(spec, dict):
+        raise ValueError("Group spec %r must be a list of arguments or a dict" % (spec,))
+    values = dict(defaults or {})
+    values.update(spec)
+    if values.get("Name") is None or values.get("Image") is None:
+        raise ValueError("Group spec %r must have a Name and an Image" % (spec,))
+    args = {}
+    for key in values:
+        if not key in GROUP_SETTINGS:
+            raise ValueError("Unknown setting %r in group spec for %s" % (key, values["Name"]))
+    for key in GROUP_SETTINGS:
+        check, default = GROUP_SETTINGS[key]
+        value = values.get(key)
+        if value is None:
+            args[key] = default
+            continue
+        try:
+            args[key] = check(value)
+        except (TypeError, ValueError, argparse.ArgumentTypeError) as e:
+            raise ValueError("Invalid %s in group spec for %s: %s" % (key, values["Name"], e))
+    if args["Port"] is not None and args["PublishAllPorts"]:
+        raise ValueError("Group spec for %s can't have both a Port and PublishAllPorts" % args["Name"])
+    return args
+
+# the name in a group spec that spec_to_args turned down, for reporting
+# it, or the spec itself if it has none
+def spec_name(spec):
+    if isinstance(spec, dict) and spec.get("Name") is not None:
+        return str(spec["Name"])
+    if isinstance(spec, list):
+        for index, arg in enumerate(spec[:-1]):
+            if arg == "--name":
+                return str(spec[index + 1])
+    return str(spec)
+
+# strip the batch options out of parsed args, leaving what build_data needs
+def group_args(namespace):
+    args = vars(namespace)
+    for arg in ("manifest", "parallel", "retries", "wait"):
+        args.pop(arg, None)
+    return args
+
+# load the group specs from a json or yaml manifest.  The manifest is either
+# a list of specs, or a dict with the list under "groups" and optional
+# "defaults" applied to every dict spec
+def load_manifest(filename):
+    with open(filename) as manifest_file:
+        if filename.endswith(".yml") or filename.endswith(".yaml"):
+            import yaml
+            manifest = yaml.safe_load(manifest_file)
+        else:
+            manifest = json.load(manifest_file)
+    defaults = None
+    if isinstance(manifest, dict):
+        defaults = manifest.get("defaults")
+        manifest = manifest.get("groups", [])
+    return [spec_to_args(spec, defaults) for spec in manifest]
+
+# look up what we need to talk to the containers api: the bearer token,
+# space guid and ccs api server of the logged in cf cli (or of a
+# python_utils.CFTarget), as a dict (see python_utils.load_cf_targeting).
+# CCS_API_SERVER overrides the ccs api server, to use a local stand in like
+# bench/ccs_server.py
+def load_auth(target=None):
+    auth = python_utils.load_cf_targeting(python_utils.get_target_cf_home(target))
+    if os.getenv('CCS_API_SERVER'):
+        auth = dict(auth, ccs_api_server=os.getenv('CCS_API_SERVER'))
+    LOGGER.debug("Servers cf: %s, ccs: %s" %(auth["cf_api_server"], auth["ccs_api_server"]))
+    return auth
+
+# the groups endpoint of the ccs api server, on the default api port unless
+# the server names its own
+def groups_url(ccs_api_server):
+    if ccs_api_server.count(":") < 2:
+        ccs_api_server = ccs_api_server + ":8443"
+    return ccs_api_server + "/v3/containers/groups"
+
+# a keep-alive session for the containers api, carrying the auth headers,
+# with room for pool_size concurrent connections.  Without auth, it uses
+# the cf login (of target if given), and its token is refreshed when it's
+# about to expire, so long waits don't outlive it
+def new_session(auth=None, pool_size=1, target=None):
+    token = None
+    if auth is None:
+        auth = load_auth(target)
+        token = python_utils.get_cf_token(target)
+    session = python_utils.new_http_session(pool_size=pool_size)
+    session.headers.update({ 
+        "Content-Type": "application/json",
+        "Accept": "application/json",
+        "X-Auth-Project-Id": auth["space_guid"]
+    })
+    if token is not None:
+        session.auth = python_utils.CFTokenAuth(token, "X-Auth-Token", prefix="")
+    else:
+        session.headers["X-Auth-Token"] = auth["token"]
+    session.groups_url = groups_url(auth["ccs_api_server"])
+    return session
+
+# send the create request for group args (from spec_to_args or the command
+# line), return the response.  It has until python_utils.get_command_deadline
+# to connect and answer
+def post_group(args, session):
+    data = build_data(args)
+    LOGGER.debug("Request body: %s" %(json.dumps(data, separators=(',', ':'), sort_keys=True)))
+    with python_utils.trace_span("POST /v3/containers/groups", "http", group=data.get("Name")) as span:
+        response = session.post(session.groups_url, data=json.dumps(data), timeout=python_utils.get_request_timeout())
+        span.set("status", response.status_code)
+    return response
+
+# create a container group from a spec (see spec_to_args), reusing session
+# if given, and otherwise auth (from load_auth, of target if given) to set
+# one up.  Returns the decoded response, raises Exception if the api server
+# refused it
+def create_group(spec, session=None, auth=None, target=None):
+    if session is None:
+        session = new_session(auth, target=target)
+    response = post_group(spec_to_args(spec), session)
+    if response.status_code >= 400:
+        raise Exception("Received %i status code from api server: %s" %(response.status_code, response.text))
+    LOGGER.debug("Received %i status code from api server" %(response.status_code))
+    try:
+        return response.json()
+    except ValueError:
+        return response.text
+
+# create all the groups in specs, up to parallel at a time over one pooled
+# session, retrying each up to retries times on connection errors and
+# server side failures.  Without a session, one is set up for auth or
+# target.  Returns a report entry per group, in spec order
+def create_groups(specs, session=None, auth=None, parallel=4, retries=3, target=None):
+    if session is None:
+        session = new_session(auth, pool_size=parallel, target=target)
+
+    report = [None] * len(specs)
+    pending = queue.Queue()
+    for index, spec in enumerate(specs):
+        pending.put((index, spec))
+
+    def create_one(spec):
+        try:
+            args = spec_to_args(spec)
+        except ValueError as e:
+            return { "name": spec_name(spec), "attempts": 0, "status": "failed", "status_code": None, "response": str(e) }
+        name = args["Name"]
+        entry = { "name": name, "attempts": 0 }
+        while True:
+            entry["attempts"] += 1
+            try:
+                response = post_group(args, session)
+                entry["status_code"] = response.status_code
+                entry["response"] = response.text
+                if response.status_code < 400:
+                    entry["status"] = "created"
+                    return entry
+                retryable = response.status_code >= 500 or response.status_code == 429
+            except requests.exceptions.RequestException as e:
+                entry["status_code"] = None
+                entry["response"] = str(e)
+                retryable = True
+            if not retryable or entry["attempts"] > retries:
+                entry["status"] = "failed"
+                return entry
+            LOGGER.info("Creating group %s failed, retrying" %(name))
+            with python_utils.trace_span("create group backoff", "wait", group=name, attempt=entry["attempts"]):
+                time.sleep(2 ** (entry["attempts"] - 1))
+
+    def worker():
+        while True:
+            try:
+                index, spec = pending.get_nowait()
+            except queue.Empty:
+                return
+            report[index] = create_one(spec)
+
+    workers = []
+    for i in range(min(parallel, len(specs))):
+        thread = threading.Thread(target=worker)
+        thread.start()
+        workers.append(thread)
+    for thread in workers:
+        thread.join()
+
+    return report
+
+# inspect a group on the containers api, return its status and info.  A
+# group the api server doesn't know (yet) has the status NOT_FOUND, and one
+# that couldn't be read (or didn't answer by get_command_deadline) keeps the
+# status it was last seen with
+def inspect_group(name, session, last_status=None):
+    try:
+        with python_utils.trace_span("GET /v3/containers/groups/{name}", "http", group=name) as span:
+            response = session.get(session.groups_url + "/" + name, timeout=python_utils.get_request_timeout())
+            span.set("status", response.status_code)
+    except requests.exceptions.RequestException as e:
+        LOGGER.debug("Unable to inspect group %s: %s" %(name, e))
+        return last_status, None
+    if response.status_code == 404:
+        return "NOT_FOUND", None
+    if response.status_code >= 400:
+        LOGGER.debug("Received %i status code inspecting group %s" %(response.status_code, name))
+        return last_status, None
+    info = response.json()
+    return info.get("Status"), info
+
+# watch groups until the api server is done with them, yielding
+# (name, status, info) as each one changes status.  Each group is polled on
+# its own schedule, starting every min_interval seconds and backing off to
+# max_interval, and all the groups due are polled at once.  A group that
+# isn't found yet is taken to still be on its way for not_found_grace
+# seconds, after that NOT_FOUND is its last status.  Groups still in
+# progress at the deadline (on the timeit clock, by default the one from
+# python_utils.get_wait_deadline) are yielded with the status TIMED_OUT
+def watch_groups(names, session=None, auth=None, deadline=None, min_interval=1, max_interval=15, backoff=1.5, target=None, not_found_grace=NOT_FOUND_GRACE):
+    if session is None:
+        session = new_session(auth, pool_size=min(max(len(names), 1), 10), target=target)
+    if deadline is None:
+        deadline = python_utils.get_wait_deadline()
+
+    now = timeit.default_timer()
+    watching = {}
+    for name in names:
+        watching[name] = { "status": None, "info": None, "interval": min_interval, "next": now, "since": now }
+
+    while watching:
+        now = timeit.default_timer()
+        if deadline is not None and now >= deadline:
+            for name in sorted(watching):
+                yield name, "TIMED_OUT", watching[name]["info"]
+            return
+
+        due = [name for name in watching if watching[name]["next"] <= now]
+        results = {}
+        def poll(name):
+            results[name] = inspect_group(name, session, watching[name]["status"])
+        threads = [threading.Thread(target=poll, args=(name,)) for name in due]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for name in due:
+            state = watching[name]
+            status, info = results[name]
+            if info is not None:
+                state["info"] = info
+            if status != state["status"]:
+                state["status"] = status
+                yield name, status, state["info"]
+            if status == "NOT_FOUND":
+                if timeit.default_timer() - state["since"] >= not_found_grace:
+                    del watching[name]
+                    continue
+            elif status is not None and not status.endswith("_IN_PROGRESS"):
+                del watching[name]
+                continue
+            state["interval"] = min(state["interval"] * backoff, max_interval)
+            state["next"] = timeit.default_timer() + state["interval"]
+
+        if watching:
+            wake = min(state["next"] for state in watching.values())
+            if deadline is not None:
+                wake = min(wake, deadline)
+            with python_utils.trace_span("watch groups poll wait", "wait", groups=sorted(watching)):
+                time.sleep(max(wake - timeit.default_timer(), 0))
+
+# wait for the named groups to be ready, logging their progress.  Returns
+# True if they all got there
+def wait_for_groups(names, session=None, auth=None, deadline=None, target=None):
+    last = {}
+    for name, status, info in watch_groups(names, session, auth, deadline, target=target):
+        LOGGER.info("Group %s is %s" %(name, status))
+        last[name] = status
+    for name in names:
+        status = last.get(name) or ""
+        if status in ("TIMED_OUT", "NOT_FOUND") or status.endswith("_FAILED"):
+            return False
+    return True
+
+batch_parser = argparse.ArgumentParser(add_help=False)
+batch_parser.add_argument("--manifest", metavar="MANIFEST_FILE", help="create every group in a json or yaml manifest instead")
+batch_parser.add_argument("--parallel", metavar="COUNT", type=int, default=4, help="groups to create at once from a manifest")
+batch_parser.add_argument("--retries", metavar="COUNT", type=int, default=3, help="retries per group from a manifest")
+batch_parser.add_argument("--wait", action="store_true", help="wait until the groups are created, up to the pipeline WAIT_TIME")
+
+parser = argparse.ArgumentParser(parents=[batch_parser])
 parser.add_argument("--name", metavar="GROUP_NAME", required=True, dest="Name")
 parser.add_argument("-m", "--memory", metavar="MEMORY_SIZE", type=valid_size, default=256, dest="Memory")
 parser.add_argument("-n", "--hostname", metavar="HOSTNAME", dest="host")
@@ -118,37 +474,55 @@ parser.add_argument("--ip", metavar="IP_ADDRESS", dest="FloatingIpAddress")
 parser.add_argument("Image", metavar="IMAGE_NAME")
 parser.add_argument("Cmd", metavar="COMMAND", nargs="*")
 
-args = vars(parser.parse_args())
-
-BEARER_TOKEN, SPACE_GUID = python_utils.load_cf_auth_info()
-CF_API_SERVER, CCS_API_SERVER = python_utils.find_api_servers()
+# parses the argument list group specs, raising ValueError for a bad one
+# rather than exiting like the command line does
+class SpecParser(argparse.ArgumentParser):
+    def error(self, message):
+        raise ValueError("Invalid group spec: " + message)
 
-python_utils.LOGGER.info("Starting python create group")
+spec_parser = SpecParser(prog="group spec", parents=[parser], add_help=False)
 
-python_utils.LOGGER.debug("Servers cf: %s, ccs: %s" %(CF_API_SERVER, CCS_API_SERVER))
+def main(argv=None):
+    python_utils.LOGGER = python_utils.setup_logging()
 
-data = build_data(args)
-
-python_utils.LOGGER.debug("Request body: %s" %(json.dumps(data, separators=(',', ':'), sort_keys=True)))
-url = CCS_API_SERVER+":8443/v3/containers/groups"
-headers = { 
-    "Content-Type": "application/json",
-    "Accept": "application/json",
-    "X-Auth-Token": BEARER_TOKEN,
-    "X-Auth-Project-Id": SPACE_GUID
-}
-
-response = requests.post(url, data=json.dumps(data), headers=headers)
+    batch_args, remaining_args = batch_parser.parse_known_args(argv)
+    if batch_args.wait:
+        python_utils.WAIT_TIME = python_utils.get_remaining_wait_time(first=True)
+    if batch_args.manifest:
+        specs = load_manifest(batch_args.manifest)
+    else:
+        args = group_args(parser.parse_args(argv))
 
-if response.status_code >= 400:
-    python_utils.LOGGER.error("Received %i status code from api server" %(response.status_code))
-    python_utils.LOGGER.error(response.text)
-    exit(1)
-else:
-    python_utils.LOGGER.debug("Received %i status code from api server" %(response.status_code))
-    print response.text
+    session = new_session(pool_size=max(batch_args.parallel, 1))
 
+    if batch_args.manifest:
+        LOGGER.info("Starting python create of %i groups" %(len(specs)))
+        report = create_groups(specs, session, parallel=max(batch_args.parallel, 1), retries=batch_args.retries)
+        failed = [entry["name"] for entry in report if entry["status"] != "created"]
+        print(json.dumps(report, indent=2))
+        if failed:
+            LOGGER.error("Failed to create groups: %s" %(", ".join(failed)))
+            return 1
+        if batch_args.wait:
+            if not wait_for_groups([entry["name"] for entry in report], session):
+                return 1
+        return 0
 
+    LOGGER.info("Starting python create group")
 
+    response = post_group(args, session)
 
+    if response.status_code >= 400:
+        LOGGER.error("Received %i status code from api server" %(response.status_code))
+        LOGGER.error(response.text)
+        return 1
+    else:
+        LOGGER.debug("Received %i status code from api server" %(response.status_code))
+        print(response.text)
+        if batch_args.wait:
+            if not wait_for_groups([args["Name"]], session):
+                return 1
+        return 0
 
+if __name__ == "__main__":
+    sys.exit(main())
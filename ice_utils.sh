@@ -248,9 +248,95 @@ ice_images() {
     return $RC
 }
 
+###########################################################
+# Check if an image is in the registry
+# Using ice images command
+###########################################################
+ice_image_exists() {
+    local IMAGE=$1
+    local REPOSITORY="${IMAGE%:*}"
+    local TAG="${IMAGE##*:}"
+    # ice lists repository:tag, cf ic lists the repository and tag as columns
+    $IC_COMMAND $ICE_ARGS images 2> /dev/null | awk -v image="${IMAGE}" -v repository="${REPOSITORY}" -v tag="${TAG}" '
+        { for (i = 1; i <= NF; i++) if ($i == image || ($i == repository && $(i+1) == tag)) found = 1 }
+        END { exit !found }'
+}
+
+###########################################################
+# Tag a Container image in the registry
+# Using ice cpi command, which copies the image within the
+# registry, so nothing is built or uploaded
+###########################################################
+ice_tag_image() {
+    local IMAGE=$1
+    local NEW_IMAGE=$2
+    ice_retry $ICE_ARGS cpi ${IMAGE} ${NEW_IMAGE}
+}
+
+###########################################################
+# Local index of the images built from each build context
+# fingerprint, "FINGERPRINT IMAGE" lines, newest last
+###########################################################
+export BUILD_IMAGES_INDEX="${EXT_DIR}/.build_fingerprint_images"
+export BUILD_IMAGES_INDEX_MAX=100
+
+# the last image built from a fingerprint
+get_fingerprint_image() {
+    local FINGERPRINT=$1
+    [ -f "${BUILD_IMAGES_INDEX}" ] || return 1
+    awk -v fingerprint="${FINGERPRINT}" '$1 == fingerprint { image = $2 } END { if (image == "") exit 1; print image }' "${BUILD_IMAGES_INDEX}"
+}
+
+# note an image was built from a fingerprint, in place of what was built
+# from it, or under the same name, before.  Keeps the newest
+# BUILD_IMAGES_INDEX_MAX
+record_fingerprint_image() {
+    local FINGERPRINT=$1
+    local IMAGE=$2
+    local INDEX_TEMP="${BUILD_IMAGES_INDEX}.$$"
+    {
+        if [ -f "${BUILD_IMAGES_INDEX}" ]; then
+            awk -v fingerprint="${FINGERPRINT}" -v image="${IMAGE}" '$1 != fingerprint && $2 != image' "${BUILD_IMAGES_INDEX}"
+        fi
+        echo "${FINGERPRINT} ${IMAGE}"
+    } | tail -n ${BUILD_IMAGES_INDEX_MAX} > "${INDEX_TEMP}" && mv -f "${INDEX_TEMP}" "${BUILD_IMAGES_INDEX}"
+}
+
+###########################################################
+# The ids of the images a build context builds FROM, as
+# "IMAGE ID" lines, from ice inspect.  Fails if an image
+# can't be listed or inspected
+###########################################################
+ice_base_image_ids() {
+    local WORKSPACE=$1
+    local BASE_IMAGES=""
+    local BASE_IMAGE=""
+    local BASE_ID=""
+    BASE_IMAGES=$(python "${EXT_DIR}/utilities/build_fingerprint.py" "${WORKSPACE}" --base-images) || return 1
+    for BASE_IMAGE in ${BASE_IMAGES}; do
+        BASE_ID=$($IC_COMMAND $ICE_ARGS inspect "${BASE_IMAGE}" 2> /dev/null | awk -F'"' '$2 == "Id" || $2 == "id" { print $4; exit }')
+        if [ -z "${BASE_ID}" ]; then
+            debugme echo "Could not inspect the base image ${BASE_IMAGE}"
+            return 1
+        fi
+        echo "${BASE_IMAGE} ${BASE_ID}"
+    done
+}
+
 ###########################################################
 # build the Container image             
 # Using ice build command
+#
+#       The fingerprint of the build context (see
+# build_fingerprint.py) of each image built is kept in a
+# local index, and when the image last built from the same
+# fingerprint is still in the registry it is tagged instead
+# of building again.  Only builds that use the cached
+# layers are skipped, a --no-cache build always builds.  As
+# those builds --pull, the ids of the base images are part
+# of the fingerprint, and the build isn't skipped when they
+# can't be inspected.  Set USE_BUILD_FINGERPRINT=false to
+# always build
 ###########################################################
 ice_build_image() {
     local USE_CACHED_LAYERS=$1
@@ -275,13 +361,85 @@ ice_build_image() {
         CHACHE_OPTION="--no-cache"
     fi
 
+    local FINGERPRINT=""
+    local BUILT_IMAGE=""
+    local BASE_IDS=""
+    if [ "${USE_CACHED_LAYERS}" == "true" ] && [ "${USE_BUILD_FINGERPRINT}" != "false" ] && use_python_utils && [ -f "${EXT_DIR}/utilities/build_fingerprint.py" ]; then
+        # --pull picks up new versions of the base images, which the
+        # build context alone doesn't show
+        if ! BASE_IDS=$(ice_base_image_ids "${WORKSPACE}"); then
+            echo "Could not inspect the base images, building the image"
+        elif ! FINGERPRINT=$(python "${EXT_DIR}/utilities/build_fingerprint.py" "${WORKSPACE}" --extra "${CHACHE_OPTION} ${PULL_OPTION} ${BASE_IDS}"); then
+            FINGERPRINT=""
+        fi
+    fi
+    if [ -n "${FINGERPRINT}" ] && BUILT_IMAGE=$(get_fingerprint_image "${FINGERPRINT}"); then
+        if [ "${BUILT_IMAGE}" == "${FULL_REPOSITORY_NAME}" ] && ice_image_exists "${BUILT_IMAGE}"; then
+            echo "The build context has not changed since ${BUILT_IMAGE} was built"
+            return 0
+        fi
+        if ice_image_exists "${BUILT_IMAGE}"; then
+            echo "The build context has not changed since ${BUILT_IMAGE} was built, tagging it as ${FULL_REPOSITORY_NAME}"
+            if ice_tag_image "${BUILT_IMAGE}" "${FULL_REPOSITORY_NAME}"; then
+                return 0
+            fi
+            echo -e "${label_color}Could not tag ${BUILT_IMAGE}, building the image instead${no_color}"
+        fi
+    fi
+
     BUILD_COMMAND="$ICE_ARGS build ${CHACHE_OPTION} ${PULL_OPTION} --tag ${FULL_REPOSITORY_NAME} ${WORKSPACE}"
     echo "Build command: ${BUILD_COMMAND}"
     ice_retry ${BUILD_COMMAND}
     RC=$?
+    if [ ${RC} -eq 0 ] && [ -n "${FINGERPRINT}" ]; then
+        # for the next build of the same context to find
+        record_fingerprint_image "${FINGERPRINT}" "${FULL_REPOSITORY_NAME}" || debugme echo "Could not record ${FULL_REPOSITORY_NAME} in ${BUILD_IMAGES_INDEX}"
+    fi
     return $RC
 }
 
+#############################################################
+# Check if python_utils.py can be run
+#############################################################
+use_python_utils(){
+    command -v python > /dev/null && [ -f "${EXT_DIR}/utilities/python_utils.py" ]
+}
+
+#############################################################
+# Check if the python retry runner can be used
+#
+#       It makes up to 5 attempts like the shell loops, but
+# backs off from sub-second delays (at most 20 sec) instead
+# of always sleeping 20 sec, stops retrying once what's left
+# of the pipeline's WAIT_TIME runs out, and gives up early
+# on errors that retrying can't fix
+#############################################################
+use_python_retry(){
+    if [ "$USE_PYTHON_RETRY" == "false" ]; then
+        return 1
+    fi
+    use_python_utils
+}
+
+#############################################################
+# Run a python_utils lookup through the warm helper daemon
+#
+#       utils_call find-service SERVICE
+#       utils_call credentials SERVICE [--app APP] [--plan PLAN]
+#       utils_call targeting-exports
+#       ... see utils_client.py for the rest, and "utils_call
+#       stop" to stop the daemon
+#
+# With USE_UTILS_DAEMON=true the daemon (utils_daemon.py) is
+# started on first use and keeps the cf targeting, services
+# list and sessions between calls, stopping after
+# UTILS_DAEMON_IDLE_TIMEOUT seconds idle.  Otherwise, or if
+# the daemon can't be used, the lookup runs directly
+#############################################################
+utils_call(){
+    python "${EXT_DIR}/utilities/utils_client.py" "$@"
+}
+
 #############################################################
 # Ice or (cf ic) command retry function with output to stdout
 # 
@@ -294,6 +452,10 @@ ice_retry(){
     local iceparms="$*"
     local COMMAND=""
     debugme echo "Command: ${IC_COMMAND} ${iceparms}"
+    if use_python_retry; then
+        python ${EXT_DIR}/utilities/python_utils.py retry -- $IC_COMMAND $iceparms
+        return $?
+    fi
     while [ $retries -lt 5 ]; do
         $IC_COMMAND $iceparms | grep -v -f ${EXT_DIR}/utilities/rmVersionMsg.txt
         RC=${PIPESTATUS[0]}
@@ -311,6 +473,10 @@ ice_retry(){
 # Ice or (cf ic) command retry function with save output
 # in iceretry.log file
 #
+#       The output has to go to the file rather than stdout,
+# ice_login_check and the ice info check in logging_utils.sh
+# read iceretry.log after the command to report on it
+#
 #       Hides messages about out of date version
 # Pipeline limitations reqiure using an out of date version
 ###########################################################
@@ -319,6 +485,14 @@ ice_retry_save_output(){
     local retries=0
     local iceparms="$*"
     debugme echo "Command: ${IC_COMMAND} ${iceparms}"
+    if use_python_retry; then
+        python ${EXT_DIR}/utilities/python_utils.py retry --output iceretry.log -- $IC_COMMAND $iceparms
+        RC=$?
+        if [ ${RC} -ne 0 ]; then
+            debugme cat iceretry.log
+        fi
+        return $RC
+    fi
     while [ $retries -lt 5 ]; do
         $IC_COMMAND $iceparms | grep -v -f ${EXT_DIR}/utilities/rmVersionMsg.txt > iceretry.log
         RC=${PIPESTATUS[0]}
@@ -376,6 +550,20 @@ ice_login_check() {
 #####################################################
 get_targeting_info() {
     local local_val=""
+    # parse config.json once in python if we can (through the helper
+    # daemon if it's turned on), the awk below is the fallback
+    local TARGETING_EXPORTS=""
+    local TARGETING_COMMAND="python ${EXT_DIR}/utilities/python_utils.py targeting-exports"
+    if [ "${USE_UTILS_DAEMON}" == "true" ]; then
+        TARGETING_COMMAND="utils_call targeting-exports"
+    fi
+    if use_python_utils && TARGETING_EXPORTS=$(${TARGETING_COMMAND}); then
+        eval "$TARGETING_EXPORTS"
+        if [ -z "$BLUEMIX_USER" ]; then
+            debugme echo "failed to get BLUEMIX_USER"
+        fi
+        return 0
+    fi
     local CONFIG_JSON_DATA=$(cat ~/.cf/config.json)
     # get BLUEMIX_ACCESS_TOKEN
     local_val=$(echo $CONFIG_JSON_DATA | awk -F'"AccessToken":' '{print $2;}' | awk -F'"' '{print $2;}')
@@ -551,8 +739,16 @@ export -f install_cf_ic
 export -f ice_login_with_api_key
 export -f ice_login_with_bluemix_user
 export -f ice_login_check
+export -f ice_image_exists
+export -f ice_tag_image
+export -f ice_base_image_ids
+export -f get_fingerprint_image
+export -f record_fingerprint_image
 export -f ice_build_image
 
+export -f use_python_utils
+export -f use_python_retry
+export -f utils_call
 export -f ice_retry
 export -f ice_retry_save_output
 export -f printEnablementInfo
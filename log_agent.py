@@ -0,0 +1,200 @@
+#!/usr/bin/python
+
+#***************************************************************************
+# Copyright 2015 IBM
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#***************************************************************************
+
+# Long lived log writer for log_and_echo in logging_utils.sh.  Started with
+# start_log_agent, it reads messages from a named pipe in EXT_DIR, which the
+# shell can write to without forking, and does the timestamping, formatting
+# and writing for them in one process:
+#  - every message goes to the pipeline log file (in batches) or to syslog
+#  - ERROR messages are also appended to the error log file, as
+#    log_and_echo does, for print_errors (and error_journal.py) to read
+#
+# Each message is one line of fields separated by \x1f:
+#    type level module phase logfile errorfile message
+# and a line "flush TOKEN" writes out everything received so far, then
+# writes TOKEN to the pipe's name + ".flushed"
+
+import argparse
+import errno
+import logging
+import logging.handlers
+import os
+import os.path
+import python_utils
+import select
+import signal
+import sys
+import time
+from subprocess import call
+
+FIELD_SEPARATOR = "\x1f"
+ERROR_TYPE = "ERROR_LEVEL"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S %Z"
+
+
+class LogAgent(object):
+
+    def __init__(self, fifo):
+        self.fifo = fifo
+        # pipeline log file name -> handler writing to it
+        self.file_handlers = {}
+        self.syslog_handler = None
+
+    # the handler for the pipeline log file, or syslog if there isn't one
+    def get_handler(self, logfile):
+        if logfile and os.path.exists(logfile):
+            handler = self.file_handlers.get(logfile)
+            if handler is None:
+                try:
+                    handler = python_utils.BatchingFileHandler(logfile)
+                    handler.setFormatter(python_utils.JSONLineFormatter())
+                    self.file_handlers[logfile] = handler
+                except (IOError, OSError):
+                    handler = None
+            if handler is not None:
+                return handler
+        if self.syslog_handler is None:
+            try:
+                self.syslog_handler = logging.handlers.SysLogHandler(address="/dev/log")
+                self.syslog_handler.setFormatter(logging.Formatter("pipeline: %(message)s"))
+            except (IOError, OSError):
+                self.syslog_handler = False
+        return self.syslog_handler
+
+    def handle_message(self, fields):
+        msg_type, msg_level, module, phase, logfile, errorfile, message = fields
+        timestamp = time.strftime(TIMESTAMP_FORMAT)
+        # same clean up log_and_echo does, the logged message is a single
+        # line without double quotes
+        message = "%s : %s" % (timestamp, " ".join(message.split()).replace("\"", "'"))
+
+        if msg_type == ERROR_TYPE and errorfile:
+            # in the error colors, like log_and_echo stores it
+            red = os.getenv('red', "").replace("\\e", "\033")
+            noColor = os.getenv('no_color', "").replace("\\e", "\033")
+            try:
+                with open(errorfile, "a") as errors:
+                    errors.write(red + message + noColor + "\n")
+            except (IOError, OSError):
+                pass
+
+        handler = self.get_handler(logfile)
+        if handler:
+            record = logging.LogRecord("pipeline", logging.INFO, __file__, 0, message, None, None)
+            record.log_timestamp = timestamp
+            record.log_level = msg_level
+            record.log_module = module
+            record.log_phase = phase
+            handler.handle(record)
+        else:
+            call(["logger", "-t", "pipeline", message])
+
+    def flush(self, token):
+        for handler in self.file_handlers.values():
+            handler.flush()
+        with open(self.fifo + ".flushed", "w") as flushed:
+            flushed.write(token + "\n")
+
+    def handle_line(self, line):
+        fields = line.split(FIELD_SEPARATOR)
+        if len(fields) == 2 and fields[0] == "flush":
+            self.flush(fields[1])
+        elif len(fields) == 7:
+            self.handle_message(fields)
+
+    # read messages until nothing arrives for idle_timeout seconds (0 to wait
+    # forever), but never while the parent process (the shell that started
+    # us and is writing to the pipe) is still there
+    def serve(self, idle_timeout, parent=None):
+        # opened read/write so there's always a writer, and reads block
+        # instead of hitting end of file between shell writes
+        fd = os.open(self.fifo, os.O_RDWR)
+        pending = b""
+        try:
+            while True:
+                try:
+                    ready, unused, unused = select.select([fd], [], [], idle_timeout or None)
+                except (select.error, OSError) as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                if not ready:
+                    if parent and process_exists(parent):
+                        continue
+                    # take the pipe away so writers fall back to doing the
+                    # work themselves, then take in anything that got in
+                    # just before
+                    if os.path.exists(self.fifo):
+                        os.remove(self.fifo)
+                    while select.select([fd], [], [], 0)[0]:
+                        pending += os.read(fd, 65536)
+                    for line in pending.split(b"\n"):
+                        if line:
+                            self.handle_line(line.decode("utf-8", "replace"))
+                    break
+                pending += os.read(fd, 65536)
+                lines = pending.split(b"\n")
+                pending = lines.pop()
+                for line in lines:
+                    self.handle_line(line.decode("utf-8", "replace"))
+        finally:
+            os.close(fd)
+
+    def close(self):
+        for handler in self.file_handlers.values():
+            handler.close()
+        if self.syslog_handler:
+            self.syslog_handler.close()
+        for name in (self.fifo, self.fifo + ".flushed"):
+            if os.path.exists(name):
+                os.remove(name)
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fifo", metavar="PATH", default=os.path.join(python_utils.EXT_DIR, ".log_agent.fifo"))
+    parser.add_argument("--idle-timeout", metavar="SECONDS", type=float, default=1800)
+    parser.add_argument("--parent", metavar="PID", type=int, help="don't stop for being idle while this process is running")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.fifo):
+        os.mkfifo(args.fifo, 0o600)
+
+    agent = LogAgent(args.fifo)
+
+    # python 3 restarts the select when interrupted, so stop by unwinding
+    def stop(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    try:
+        agent.serve(args.idle_timeout, args.parent)
+    finally:
+        agent.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
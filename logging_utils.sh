@@ -436,6 +436,100 @@ if [ -z "$ERROR_LOG_FILE" ]; then
 fi
 
 
+###################################################################
+# log agent - a long lived python process (log_agent.py) that does the
+# formatting and writing for log_and_echo, so logging a message doesn't
+# fork date, sed and logger each time.  Messages are written to a named
+# pipe in EXT_DIR with builtins only.  log_and_echo falls back to doing
+# the work itself whenever the agent isn't running.  The agent stays up
+# as long as the shell that started it, unless stopped with stop_log_agent.
+###################################################################
+log_agent_running() {
+    # printf %(...)T needs bash 4.2
+    if [ ${BASH_VERSINFO[0]} -lt 4 ] || ([ ${BASH_VERSINFO[0]} -eq 4 ] && [ ${BASH_VERSINFO[1]} -lt 2 ]); then
+        return 1
+    fi
+    [ -n "$LOG_AGENT_PID" ] && [ -p "$LOG_AGENT_FIFO" ] && kill -0 "$LOG_AGENT_PID" 2> /dev/null
+}
+
+start_log_agent() {
+    if [ "$USE_LOG_AGENT" == "false" ]; then
+        return 1
+    fi
+    if log_agent_running; then
+        return 0
+    fi
+    if ! command -v python > /dev/null || [ ! -f "${EXT_DIR}/utilities/log_agent.py" ]; then
+        return 1
+    fi
+    export LOG_AGENT_FIFO="${EXT_DIR}/.log_agent.fifo"
+    rm -f "$LOG_AGENT_FIFO"
+    python "${EXT_DIR}/utilities/log_agent.py" --fifo "$LOG_AGENT_FIFO" --parent $$ > /dev/null 2>&1 &
+    export LOG_AGENT_PID=$!
+    local tries=0
+    while [ ! -p "$LOG_AGENT_FIFO" ] && [ $tries -lt 50 ]; do
+        sleep 0.1
+        tries=$((tries+1))
+    done
+    if ! log_agent_running; then
+        unset LOG_AGENT_PID
+        return 1
+    fi
+    return 0
+}
+
+# write a record to the agent.  The pipe is opened read/write, which
+# never waits for a reader, so this can't hang if the agent has gone since
+# log_agent_running.  Fails if the agent is gone by the time it's written,
+# for the caller to do the work itself
+write_log_agent() {
+    if [ ! -p "$LOG_AGENT_FIFO" ]; then
+        return 1
+    fi
+    printf '%s' "$1" 1<> "$LOG_AGENT_FIFO"
+    if [ -p "$LOG_AGENT_FIFO" ] && kill -0 "$LOG_AGENT_PID" 2> /dev/null; then
+        return 0
+    fi
+    # the pipe went just before the write, which made a plain file of it
+    if [ -e "$LOG_AGENT_FIFO" ] && [ ! -p "$LOG_AGENT_FIFO" ]; then
+        rm -f "$LOG_AGENT_FIFO"
+    fi
+    return 1
+}
+
+# wait until the agent has written out everything sent to it so far
+flush_log_agent() {
+    if ! log_agent_running; then
+        return 0
+    fi
+    local token="${BASHPID}-${RANDOM}"
+    local line=""
+    local tries=0
+    local record=""
+    printf -v record 'flush\x1f%s\n' "$token"
+    write_log_agent "$record" || return 1
+    while [ $tries -lt 100 ] && kill -0 "$LOG_AGENT_PID" 2> /dev/null; do
+        if [ -f "${LOG_AGENT_FIFO}.flushed" ]; then
+            read -r line < "${LOG_AGENT_FIFO}.flushed"
+            if [ "$line" == "$token" ]; then
+                return 0
+            fi
+        fi
+        sleep 0.1
+        tries=$((tries+1))
+    done
+    return 1
+}
+
+stop_log_agent() {
+    if log_agent_running; then
+        flush_log_agent
+        kill -TERM "$LOG_AGENT_PID" 2> /dev/null
+        wait "$LOG_AGENT_PID" 2> /dev/null
+    fi
+    unset LOG_AGENT_PID
+}
+
 log_and_echo() {
     if [ -z "$LOGGER_LEVEL" ]; then
         if [[ $DEBUG = 1 ]]; then
@@ -492,6 +586,27 @@ log_and_echo() {
         local post=""
         local MSG_LEVEL=$INFO_LEVEL
     fi
+    if log_agent_running; then
+        local timestamp
+        local A_MSG
+        local A_TYPE=""
+        local A_RECORD
+        printf -v timestamp '%(%F %T %Z)T' -1
+        printf -v A_MSG '%b' "$*"
+        A_MSG="${A_MSG//$'\n'/ }"
+        if [ "$ERROR" == "$MSG_TYPE" ]; then
+            A_TYPE="$ERROR"
+        fi
+        printf -v A_RECORD '%s\x1f%s\x1f%s\x1f%s\x1f%s\x1f%s\x1f%s\n' "$A_TYPE" "$MSG_LEVEL" "$LOGGER_MODULE" "$LOGGER_PHASE" "$PIPELINE_LOGGING_FILE" "$ERROR_LOG_FILE" "$A_MSG"
+        # writes to the pipe up to 4k can't interleave, longer messages
+        # take the slow path below
+        if [ ${#A_RECORD} -lt 4000 ] && write_log_agent "$A_RECORD"; then
+            if [ $LOGGER_LEVEL -ge $MSG_LEVEL ]; then
+                printf '%b%s%b\n' "$pre" "${timestamp} : ${A_MSG//\"/\'}" "$post"
+            fi
+            return
+        fi
+    fi
     local timestamp=`date +"%F %T %Z"`
     local L_MSG=`echo -e "${timestamp} : $*"`
     L_MSG=`echo $L_MSG | sed "s/\"/'/g"`
@@ -517,7 +632,21 @@ log_and_echo() {
     fi
 }
 
+###################################################################
+# error journal - error_journal.py keeps each distinct error once with
+# its count and first and last times, so errors repeated by retries
+# don't flood the output and notifications.  Without python the error
+# log is read as it is.
+###################################################################
+use_error_journal() {
+    [ "${USE_ERROR_JOURNAL}" != "false" ] && command -v python > /dev/null && [ -f "${EXT_DIR}/utilities/error_journal.py" ]
+}
+
 print_errors() {
+    flush_log_agent
+    if use_error_journal; then
+        python "${EXT_DIR}/utilities/error_journal.py" print "${ERROR_LOG_FILE}" && return
+    fi
     if [ -e "${ERROR_LOG_FILE}" ]; then
         local ERROR_COUNT=`wc "${ERROR_LOG_FILE}" | awk '{print $1}'` 
         if [ ${ERROR_COUNT} -eq 1 ]; then
@@ -554,6 +683,10 @@ get_error_info() {
     local ERROR_LOG_INFO=""
     local ERROR_LOG_FILE="${EXT_DIR}/errors.log"
     local ERROR_LOG_TITLE=""
+    flush_log_agent
+    if use_error_journal; then
+        python "${EXT_DIR}/utilities/error_journal.py" info "${ERROR_LOG_FILE}" && return
+    fi
     if [ -f "$ERROR_LOG_FILE" ]; then
         ERROR_COUNT=`wc "${ERROR_LOG_FILE}" | awk '{print $1}'` 
         if [ ${ERROR_COUNT} -eq 1 ]; then
@@ -571,7 +704,13 @@ get_error_info() {
 export -f setup_logstash_forwarder
 export -f setup_logstash_agent
 export -f setup_met_logging
+export -f log_agent_running
+export -f start_log_agent
+export -f write_log_agent
+export -f flush_log_agent
+export -f stop_log_agent
 export -f log_and_echo
+export -f use_error_journal
 export -f print_errors
 export -f remove_red_color_code
 export -f get_error_info
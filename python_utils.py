@@ -19,14 +19,35 @@
 #    export PYTHONPATH=$EXT_DIR/utilities:$PYTHONPATH
 
 
+import hashlib
+import argparse
+import base64
+import atexit
+import collections
+import fcntl
 import json
 import logging
 import logging.handlers
+import multiprocessing
 import os
 import os.path
+import random
+import re
+import signal
 import sys
+try:
+    from shlex import quote as shell_quote
+except ImportError:
+    from pipes import quote as shell_quote
+import tempfile
+import threading
+import time
 import timeit
-from subprocess import call, Popen, PIPE
+from subprocess import call, Popen, PIPE, STDOUT
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 # ascii color codes for output
 LABEL_GREEN='\033[0;32m'
@@ -50,15 +71,233 @@ if DEBUG:
 
 SCRIPT_START_TIME = timeit.default_timer()
 LOGGER = None
+LOGGING_SET_UP = False
 
 
 FULL_WAIT_TIME = 5
 WAIT_TIME = 0
 
-
-# setup logmet logging connection if it's available
+# snapshot of the parsed "cf services" table, shared by all the lookups in
+# this process.  It is refreshed once it is older than SERVICES_CACHE_TTL
+# seconds (0 disables the cache), and dropped whenever we create or bind
+# a service through this module
+try:
+    SERVICES_CACHE_TTL = int(os.getenv('CF_SERVICES_CACHE_TTL', "60"))
+except ValueError:
+    SERVICES_CACHE_TTL = 60
+SERVICES_SNAPSHOT = None
+SERVICES_SNAPSHOT_TIME = 0
+SERVICES_SNAPSHOT_LOCK = threading.Lock()
+
+# backend used to talk to cloud foundry, see get_cf_backend
+CF_BACKEND = None
+
+# targeting info read from each cf config.json, see load_cf_targeting
+CF_TARGETING = {}
+
+# connection pools shared by the http sessions of this process, one per api
+# host (see get_http_adapter), and the access token of each cf config.json
+# (see get_cf_token)
+HTTP_ADAPTERS = {}
+HTTP_ADAPTERS_PID = None
+HTTP_LOCK = threading.Lock()
+try:
+    HTTP_POOL_SIZE = max(1, int(os.getenv('HTTP_POOL_SIZE', "10")))
+except ValueError:
+    HTTP_POOL_SIZE = 10
+CF_TOKENS = {}
+# access tokens are refreshed when they have less than this many seconds left
+try:
+    TOKEN_REFRESH_MARGIN = int(os.getenv('CF_TOKEN_REFRESH_MARGIN', "300"))
+except ValueError:
+    TOKEN_REFRESH_MARGIN = 300
+
+# commands run by run_command and CommandStream are stopped after
+# COMMAND_TIMEOUT seconds (0 for no limit), or once the wait time runs out
+# (see get_command_deadline), and once run_command has MAX_COMMAND_OUTPUT
+# characters of their output
+try:
+    COMMAND_TIMEOUT = float(os.getenv('PIPELINE_COMMAND_TIMEOUT', "600"))
+except ValueError:
+    COMMAND_TIMEOUT = 600
+COMMAND_MIN_TIMEOUT = 30
+try:
+    MAX_COMMAND_OUTPUT = int(os.getenv('PIPELINE_COMMAND_MAX_OUTPUT', str(64 * 1024 * 1024)))
+except ValueError:
+    MAX_COMMAND_OUTPUT = 64 * 1024 * 1024
+RC_TIMED_OUT = 124
+RC_OUTPUT_TOO_LARGE = 125
+# the status of a cf api request that got no answer, a server error to the
+# callers of CFRestBackend.request
+NO_RESPONSE_STATUS = 599
+# commands are started in a session of their own, so they can be killed
+# along with anything they start
+if sys.version_info[0] >= 3:
+    NEW_SESSION = {"start_new_session": True}
+elif hasattr(os, "setsid"):
+    NEW_SESSION = {"preexec_fn": os.setsid}
+else:
+    NEW_SESSION = {}
+
+# command output lines run_with_retry drops, the cf ic messages about the
+# plugin version.  Loaded from rmVersionMsg.txt on first use
+OUTPUT_FILTERS = None
+
+# failures of commands run by run_with_retry are retried unless their
+# output looks like something retrying can't fix, however transient the
+# rest of it looks
+FATAL_OUTPUT = re.compile(r"Incorrect Usage|unknown (shorthand )?flag|unknown command|is not a registered command|Not logged in|not authorized|Unauthorized|Invalid (auth )?token", re.IGNORECASE)
+
+# credentials looked up by get_credentials_* can be kept on disk so later
+# pipeline stages don't have to discover them again.  Off unless
+# CF_CREDENTIALS_CACHE is "true"
+CREDENTIALS_CACHE_DIR = os.getenv('CF_CREDENTIALS_CACHE_DIR', os.path.join(EXT_DIR, ".credentials_cache"))
+try:
+    CREDENTIALS_CACHE_TTL = int(os.getenv('CF_CREDENTIALS_CACHE_TTL', "3600"))
+except ValueError:
+    CREDENTIALS_CACHE_TTL = 3600
+
+# user names looked up from uaa for targeting-exports, by access token
+USERINFO_CACHE_DIR = os.getenv('CF_USERINFO_CACHE_DIR', os.path.join(EXT_DIR, ".userinfo_cache"))
+
+
+# span tracing, off unless PIPELINE_TRACE_FILE names the chrome trace-event
+# file to add this process's spans to (see trace_span)
+TRACE_FILE = os.getenv('PIPELINE_TRACE_FILE')
+TRACE_SPANS = []
+TRACE_LOCK = threading.Lock()
+
+
+# formats log records as one json object per line for the pipeline log.
+# Records can override the standard fields by carrying log_timestamp,
+# log_level or log_module attributes, and add a log_phase
+class JSONLineFormatter (logging.Formatter):
+
+    def format (self, record):
+        entry = collections.OrderedDict()
+        entry["@timestamp"] = getattr(record, "log_timestamp", None) or self.formatTime(record)
+        entry["loglevel"] = getattr(record, "log_level", None) or record.levelname
+        entry["module"] = getattr(record, "log_module", None) or record.name
+        phase = getattr(record, "log_phase", None)
+        if phase is not None:
+            entry["phase"] = phase
+        entry["message"] = record.getMessage()
+        return json.dumps(entry)
+
+
+# hands formatted records to a background thread that appends them to
+# filename in batches, so logging never waits on the disk.  At most
+# capacity records are queued; past that, records are dropped and counted
+# in dropped.  Closing (which logging does at exit) writes out everything
+# still queued.  A forked child (see run_for_targets) starts a writer of
+# its own on its first record
+class BatchingFileHandler (logging.Handler):
+
+    # longest flush and close wait for the writer, in seconds
+    WAIT_TIMEOUT = 10
+
+    def __init__ (self, filename, capacity=10000, batch_size=500):
+        logging.Handler.__init__(self)
+        self.filename = filename
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.closed = False
+        # opened here, like FileHandler, so a file that can't be written
+        # fails the setup rather than the writer thread
+        self.stream = open(filename, "a")
+        self.start_writer()
+
+    def start_writer (self):
+        self.pid = os.getpid()
+        self.records = queue.Queue(self.capacity)
+        self.dropped = 0
+        self.writer = threading.Thread(target=self.write_batches)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def emit (self, record):
+        if self.pid != os.getpid():
+            # the writer thread didn't come along through the fork
+            self.start_writer()
+        try:
+            line = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        try:
+            self.records.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+
+    def write_batches (self):
+        done = False
+        while not done:
+            batch = [self.records.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.records.get_nowait())
+                    except queue.Empty:
+                        break
+                # None is the signal to stop
+                if None in batch:
+                    done = True
+                lines = [line for line in batch if line is not None]
+                if lines:
+                    try:
+                        self.stream.write("\n".join(lines) + "\n")
+                        self.stream.flush()
+                    except (IOError, OSError, ValueError) as e:
+                        self.dropped += len(lines)
+                        sys.stderr.write("Unable to write to the log file " + self.filename + ": " + str(e) + "\n")
+            finally:
+                for line in batch:
+                    self.records.task_done()
+
+    # wait (up to WAIT_TIMEOUT seconds) for everything queued so far to be
+    # written
+    def flush (self):
+        if not self.writer.is_alive():
+            return
+        deadline = timeit.default_timer() + self.WAIT_TIMEOUT
+        with self.records.all_tasks_done:
+            while self.records.unfinished_tasks and self.writer.is_alive():
+                remaining = deadline - timeit.default_timer()
+                if remaining <= 0:
+                    return
+                self.records.all_tasks_done.wait(min(remaining, 0.5))
+
+    def close (self):
+        if not self.closed:
+            self.closed = True
+            if self.dropped:
+                record = logging.LogRecord("pipeline", logging.WARNING, __file__, 0,
+                                           "%i log messages were dropped, the log writer fell behind", (self.dropped,), None)
+                try:
+                    self.records.put_nowait(self.format(record))
+                except queue.Full:
+                    pass
+            if self.writer.is_alive():
+                try:
+                    self.records.put(None, timeout=self.WAIT_TIMEOUT)
+                except queue.Full:
+                    pass
+                self.writer.join(self.WAIT_TIMEOUT)
+            if not self.writer.is_alive():
+                self.stream.close()
+        logging.Handler.close(self)
+
+
+# setup logmet logging connection if it's available.  Safe to call more
+# than once, the handlers are only added the first time
 def setup_logging ():
+    global LOGGING_SET_UP
+
     logger = logging.getLogger('pipeline')
+    if LOGGING_SET_UP:
+        return logger
+    LOGGING_SET_UP = True
+
     if DEBUG:
         logger.setLevel(logging.DEBUG)
     else:
@@ -68,13 +307,16 @@ def setup_logging ():
     if os.environ.get('LOGMET_LOGGING_ENABLED'):
         pipeline_logfile = os.environ.get('PIPELINE_LOGGING_FILE')
         if pipeline_logfile:
-            handler = logging.FileHandler(pipeline_logfile)
+            # written from a background thread unless asked not to
+            if os.environ.get('PIPELINE_LOGGING_MODE', "async").lower() == "sync":
+                handler = logging.FileHandler(pipeline_logfile)
+            else:
+                handler = BatchingFileHandler(pipeline_logfile)
             logger.addHandler(handler)
             # don't send debug info through syslog
             handler.setLevel(logging.INFO)
             # set formatting on this to be json style
-            formatter = logging.Formatter('{\"@timestamp\": \"%(asctime)s\", \"loglevel\": \"%(levelname)s\", \"module\": \"%(name)s\", \"message\": \"%(message)s\"}\n')
-            handler.setFormatter(formatter)
+            handler.setFormatter(JSONLineFormatter())
 
     # in any case, dump logging to the screen
     handler = logging.StreamHandler(sys.stdout)
@@ -89,42 +331,599 @@ def setup_logging ():
     return logger
 
 
-# load bearer token and space guid from ~/.cf/config.json
-# used for a variety of things, including calls to the CCS server
-def load_cf_auth_info ():
+# a timed section of work, recorded when it ends.  args are shown with the
+# span in the trace viewer, more can be added with set() along the way
+# (the exit code of a command, the status of a request)
+class TraceSpan (object):
+    __slots__ = ("name", "category", "args", "thread", "wall_start", "start", "duration")
+
+    def __init__ (self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.thread = threading.current_thread().ident
+        self.wall_start = None
+        self.start = None
+        self.duration = None
+
+    def set (self, key, value):
+        self.args[key] = value
+
+    def __enter__ (self):
+        self.wall_start = time.time()
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__ (self, exc_type, exc_value, tb):
+        self.duration = timeit.default_timer() - self.start
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        with TRACE_LOCK:
+            TRACE_SPANS.append(self)
+        return False
 
-    bearer_token = None
-    space_guid = None
+# stands in for a span when tracing is off
+class NullSpan (object):
 
-    cf_filename = "%s/.cf/config.json" % os.path.expanduser("~")
+    def set (self, key, value):
+        pass
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, exc_type, exc_value, tb):
+        return False
+
+NULL_SPAN = NullSpan()
+
+# time the work in a with block as a span named name.  Spans are grouped
+# by category ("cli", "http", "wait") in the trace.  Costs a call and a
+# test when tracing is off
+def trace_span (name, category="cli", **args):
+    if not TRACE_FILE:
+        return NULL_SPAN
+    return TraceSpan(name, category, args)
+
+# the span name for running argv, the command without its arguments
+# ("cf services", "cf ic group create") so calls group together
+def command_span_name (argv):
+    if isinstance(argv, str):
+        argv = argv.split()
+    if len(argv) > 2 and argv[1] == "ic":
+        return " ".join(argv[:3])
+    return " ".join(argv[:2])
+
+# append the spans recorded by this process to the trace file, in the
+# chrome trace-event array format.  The closing ] is optional in that
+# format, so every process can append its events to the same file for the
+# whole job.  Then rewrite the summary next to it
+def write_trace (filename=None):
+    filename = filename or TRACE_FILE
+    with TRACE_LOCK:
+        spans = list(TRACE_SPANS)
+        del TRACE_SPANS[:]
+    if not filename or not spans:
+        return
+
+    pid = os.getpid()
+    lines = []
+    for span in spans:
+        event = collections.OrderedDict()
+        event["name"] = span.name
+        event["cat"] = span.category
+        event["ph"] = "X"
+        event["ts"] = int(span.wall_start * 1000000)
+        event["dur"] = int(span.duration * 1000000)
+        event["pid"] = pid
+        event["tid"] = span.thread
+        event["args"] = span.args
+        lines.append(json.dumps(event, default=str) + ",\n")
+
+    fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        # held while checking for and writing the "[", so only the first
+        # process to write to a new file adds it
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        if os.fstat(fd).st_size == 0:
+            lines.insert(0, "[\n")
+        os.write(fd, "".join(lines).encode("utf-8"))
+    finally:
+        os.close(fd)
+
+    with open(filename + ".summary", "w") as summaryFile:
+        summaryFile.write(format_trace_summary(load_trace(filename)))
+
+# read the events back out of a trace file written by write_trace
+def load_trace (filename):
+    events = []
+    with open(filename) as traceFile:
+        for line in traceFile:
+            line = line.strip().rstrip(",")
+            if line.startswith("{"):
+                events.append(json.loads(line))
+    return events
+
+# a table of the time spent in each kind of span, most expensive first
+def format_trace_summary (events):
+    totals = {}
+    for event in events:
+        key = (event["cat"], event["name"])
+        count, total, longest = totals.get(key, (0, 0, 0))
+        dur = event["dur"] / 1000000.0
+        totals[key] = (count + 1, total + dur, max(longest, dur))
+
+    rows = sorted(totals.items(), key=lambda item: item[1][1], reverse=True)
+    width = max([len(name) for (cat, name) in totals] + [4])
+    lines = ["%-5s %-*s %6s %10s %9s %9s" % ("cat", width, "span", "count", "total(s)", "mean(s)", "max(s)")]
+    for (cat, name), (count, total, longest) in rows:
+        lines.append("%-5s %-*s %6i %10.3f %9.3f %9.3f" % (cat, width, name, count, total, total / count, longest))
+    return "\n".join(lines) + "\n"
+
+if TRACE_FILE:
+    atexit.register(write_trace)
+
+
+# return the cf config.json in use, under cf_home if given, otherwise
+# under $CF_HOME or the home directory like the cf cli does
+def get_cf_config_file (cf_home=None):
+    if cf_home is None:
+        cf_home = os.getenv('CF_HOME') or os.path.expanduser("~")
+    return os.path.join(cf_home, ".cf", "config.json")
+
+# read everything needed to talk to the targeted cf from config.json in one
+# go, and return it as a dict with the bearer token ("token"), "space_guid",
+# "space", "org", and the "cf_api_server" and "ccs_api_server".  Only runs
+# "cf api" if the file doesn't record the target.  The result is remembered
+# per config file, unless refresh is set
+def load_cf_targeting (cf_home=None, refresh=False):
+    cf_filename = get_cf_config_file(cf_home)
+    if (not refresh) and (cf_filename in CF_TARGETING):
+        return CF_TARGETING[cf_filename]
 
     with open( cf_filename ) as cf_config_file:
         config_info = json.load(cf_config_file)
-        bearer_token = config_info["AccessToken"]
-        if bearer_token.lower().startswith("bearer "):
-            bearer_token=bearer_token[7:]
-        if "Guid" in config_info["SpaceFields"]:
-            space_guid = config_info["SpaceFields"]["Guid"]
-        elif "GUID" in config_info["SpaceFields"]:
-            space_guid = config_info["SpaceFields"]["GUID"]
 
-    return bearer_token, space_guid
+    bearer_token = config_info["AccessToken"]
+    if bearer_token.lower().startswith("bearer "):
+        bearer_token=bearer_token[7:]
+    space_fields = config_info.get("SpaceFields") or {}
+    space_guid = space_fields.get("Guid", space_fields.get("GUID"))
+    org_fields = config_info.get("OrganizationFields") or {}
+
+    cf_api_server = config_info.get("Target")
+    if not cf_api_server:
+        cf_api_server, ice_api_server = find_api_servers_with_cli(cf_home)
+
+    targeting = {
+        "token": bearer_token,
+        "access_token": config_info["AccessToken"],
+        "uaa_endpoint": config_info.get("UaaEndpoint"),
+        "space_guid": space_guid,
+        "space": space_fields.get("Name"),
+        "org": org_fields.get("Name"),
+        "cf_api_server": cf_api_server,
+        # get ice server as well by adjusting cf server
+        "ccs_api_server": cf_api_server.replace( 'api.', 'containers-api.')
+    }
+    if DEBUG:
+        if LOGGER:
+            LOGGER.debug("cf_api_server set to " + str(targeting["cf_api_server"]))
+            LOGGER.debug("ice_api_server set to " + str(targeting["ccs_api_server"]))
+
+    CF_TARGETING[cf_filename] = targeting
+    return targeting
+
+
+# load bearer token and space guid from ~/.cf/config.json, or the
+# config.json of target if given
+# used for a variety of things, including calls to the CCS server
+def load_cf_auth_info (target=None):
+    targeting = load_cf_targeting(get_target_cf_home(target))
+    return targeting["token"], targeting["space_guid"]
+
+
+# a cloud foundry org and space to work in, as logged into and targeted by
+# "cf login" with its own CF_HOME.  Every python_utils operation takes one
+# as target; without it they work on the target of the environment's
+# CF_HOME (or the home directory) like the cf cli.  The token, space guid
+# and api servers are read from the target's config.json (see
+# load_cf_targeting), and each target has its own backend and services
+# snapshot, so several can be worked on at once, from threads or from
+# the processes of run_for_targets.  Only cf_home is pickled, a target
+# passed to another process loads the rest again there
+class CFTarget (object):
+
+    def __init__ (self, cf_home=None, name=None):
+        if cf_home is not None:
+            cf_home = os.path.abspath(os.path.expanduser(cf_home))
+        self.cf_home = cf_home
+        self.name = name or cf_home or "default"
+        self.backend = None
+        self.snapshot = None
+        self.snapshot_time = 0
+        self.snapshot_lock = threading.Lock()
+
+    def __getstate__ (self):
+        return {"cf_home": self.cf_home, "name": self.name}
+
+    def __setstate__ (self, state):
+        self.__init__(state["cf_home"], state["name"])
+
+    def __repr__ (self):
+        return "CFTarget(%r)" % self.name
+
+    # the targeting dict of load_cf_targeting for this target
+    def load (self, refresh=False):
+        return load_cf_targeting(self.cf_home, refresh)
+
+    # the access token, refreshed if it's about to expire
+    @property
+    def token (self):
+        return get_cf_token(self).get()
+
+    @property
+    def space_guid (self):
+        return self.load()["space_guid"]
+
+    @property
+    def cf_api_server (self):
+        return self.load()["cf_api_server"]
+
+    @property
+    def ccs_api_server (self):
+        return self.load()["ccs_api_server"]
+
+    # the environment to run the cf cli in for this target, None for our own
+    def get_env (self):
+        if self.cf_home is None:
+            return None
+        return dict(os.environ, CF_HOME=self.cf_home)
+
+# the CF_HOME of target, None for the environment's
+def get_target_cf_home (target):
+    if target is None:
+        return None
+    return target.cf_home
+
+# the environment to run the cf cli in for target, None for our own
+def get_target_env (target):
+    if target is None:
+        return None
+    return target.get_env()
+
+# write data as json to filename in directory, only readable by the owner.
+# It's written to a temp file first and renamed in place so readers never
+# see a partial file
+def write_private_json (directory, filename, data):
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    # mkstemp creates the file with owner only permissions
+    fd, tempName = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+    os.rename(tempName, os.path.join(directory, filename))
+
+# the pooled keep-alive connections to the host of url, shared by every
+# session from new_http_session in this process, with room for at least
+# pool_size at once.  A forked child starts pools of its own rather than
+# using its parent's connections
+def get_http_adapter (url, pool_size=None):
+    global HTTP_ADAPTERS_PID
+    import requests
+
+    scheme, sep, rest = url.partition("://")
+    host = scheme.lower() + "://" + rest.split("/", 1)[0].split("?", 1)[0].lower()
+    size = max(pool_size or 0, HTTP_POOL_SIZE)
+    with HTTP_LOCK:
+        if HTTP_ADAPTERS_PID != os.getpid():
+            HTTP_ADAPTERS.clear()
+            HTTP_ADAPTERS_PID = os.getpid()
+        adapter = HTTP_ADAPTERS.get(host)
+        if (adapter is None) or (adapter.pool_size < size):
+            # a smaller pool is left to the requests still using it
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=size)
+            adapter.pool_size = size
+            HTTP_ADAPTERS[host] = adapter
+        return adapter
+
+# sends each request over the shared pool of its host, see new_http_session
+class SharedPoolAdapter (object):
+
+    def __init__ (self, pool_size=None):
+        self.pool_size = pool_size
+
+    def send (self, request, **kwargs):
+        return get_http_adapter(request.url, self.pool_size).send(request, **kwargs)
+
+    def close (self):
+        # the pools outlive the sessions
+        pass
+
+# a requests session whose connections come from the shared per host pools
+# (see get_http_adapter), so the cf rest backend, gp_create, uaa lookups,
+# send_message and dra_client all reuse the same keep-alive connections.
+# Sessions are cheap, each caller keeps its own headers and auth (such as a
+# CFTokenAuth) on one.  pool_size is how many requests it makes at once
+def new_http_session (auth=None, pool_size=None):
+    import requests
+    session = requests.Session()
+    adapter = SharedPoolAdapter(pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.auth = auth
+    return session
+
+# the time (in seconds since the epoch) a jwt access token expires, or
+# None if it doesn't say
+def get_token_expiry (token):
+    if token.lower().startswith("bearer "):
+        token = token[7:]
+    parts = token.split(".")
+    if len(parts) != 3:
+        return None
+    payload = parts[1] + "=" * (-len(parts[1]) % 4)
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(payload.encode("ascii")).decode("utf-8"))
+        return float(claims["exp"])
+    except (ValueError, TypeError, KeyError, UnicodeError):
+        return None
+
+# rewrite a cf config.json in place, keeping its permissions
+def write_cf_config (cf_filename, config_info):
+    directory = os.path.dirname(os.path.abspath(cf_filename))
+    mode = os.stat(cf_filename).st_mode & 0o777
+    fd, tempName = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(config_info, f, indent=2)
+    os.chmod(tempName, mode)
+    os.rename(tempName, cf_filename)
+
+
+# the access token of the cf login in the config.json under cf_home (see
+# get_cf_config_file).  It's refreshed through uaa, with the refresh token
+# of the login, once it's within TOKEN_REFRESH_MARGIN seconds of expiring
+# or has been turned down, and the new one is written back to config.json
+# for the cf cli and later steps.  Shared by the threads of a process, see
+# get_cf_token
+class CFToken (object):
+
+    def __init__ (self, cf_home=None):
+        self.cf_home = cf_home
+        self.lock = threading.Lock()
+        self.token = load_cf_targeting(cf_home)["token"]
+        self.expires = get_token_expiry(self.token)
+
+    # the token to use now, without "bearer "
+    def get (self):
+        with self.lock:
+            if (self.expires is not None) and (time.time() > self.expires - TOKEN_REFRESH_MARGIN):
+                self.refresh_locked()
+            return self.token
+
+    # get a new token since rejected was turned down, unless another thread
+    # got one already.  Returns True if there's a new token to try
+    def refresh (self, rejected=None):
+        with self.lock:
+            if (rejected is not None) and (rejected != self.token):
+                return True
+            return self.refresh_locked()
+
+    def refresh_locked (self):
+        cf_filename = get_cf_config_file(self.cf_home)
+        try:
+            with open(cf_filename) as cf_config_file:
+                config_info = json.load(cf_config_file)
+        except (IOError, OSError, ValueError) as e:
+            debug("Unable to read " + cf_filename + " to refresh the token: " + str(e))
+            return False
+
+        token = config_info.get("AccessToken") or ""
+        if token.lower().startswith("bearer "):
+            token = token[7:]
+        if token and token != self.token:
+            expires = get_token_expiry(token)
+            if (expires is None) or (time.time() < expires - TOKEN_REFRESH_MARGIN):
+                # cf logged in or refreshed it since
+                self.set_token(token, expires)
+                return True
+
+        refreshToken = config_info.get("RefreshToken")
+        uaaEndpoint = config_info.get("UaaEndpoint")
+        if not refreshToken or not uaaEndpoint:
+            debug("No refresh token or uaa endpoint in " + cf_filename + ", unable to refresh the token")
+            return False
+
+        import requests
+        url = uaaEndpoint.rstrip("/") + "/oauth/token"
+        try:
+            with trace_span("POST /oauth/token", "http", url=url) as span:
+                # the cf cli's own client
+                response = new_http_session().post(url, data={"grant_type": "refresh_token", "refresh_token": refreshToken},
+                                                   auth=("cf", ""), headers={"Accept": "application/json"},
+                                                   verify=not config_info.get("SSLDisabled", False), timeout=30)
+                span.set("status", response.status_code)
+        except requests.exceptions.RequestException as e:
+            if LOGGER:
+                LOGGER.warning("Unable to refresh the cf token: " + str(e))
+            return False
+        try:
+            grant = response.json()
+            token = grant["access_token"]
+        except (ValueError, KeyError, TypeError):
+            grant = None
+        if (response.status_code != 200) or (grant is None):
+            if LOGGER:
+                LOGGER.warning("Unable to refresh the cf token, uaa returned " + str(response.status_code))
+            return False
+
+        expires = get_token_expiry(token)
+        if (expires is None) and grant.get("expires_in"):
+            expires = time.time() + float(grant["expires_in"])
+        config_info["AccessToken"] = "bearer " + token
+        if grant.get("refresh_token"):
+            config_info["RefreshToken"] = grant["refresh_token"]
+        try:
+            write_cf_config(cf_filename, config_info)
+        except (IOError, OSError) as e:
+            if LOGGER:
+                LOGGER.warning("Unable to save the refreshed cf token: " + str(e))
+        debug("Refreshed the cf token in " + cf_filename)
+        self.set_token(token, expires)
+        return True
+
+    def set_token (self, token, expires):
+        self.token = token
+        self.expires = expires
+        # keep what load_cf_targeting returns in step
+        targeting = CF_TARGETING.get(get_cf_config_file(self.cf_home))
+        if targeting is not None:
+            targeting["token"] = token
+            targeting["access_token"] = "bearer " + token
+
+# the CFToken of target, or of the environment's cf login
+def get_cf_token (target=None):
+    cf_filename = get_cf_config_file(get_target_cf_home(target))
+    with HTTP_LOCK:
+        token = CF_TOKENS.get(cf_filename)
+    if token is None:
+        token = CFToken(get_target_cf_home(target))
+        with HTTP_LOCK:
+            token = CF_TOKENS.setdefault(cf_filename, token)
+    return token
+
+# requests auth sending a CFToken in header, after prefix.  A request
+# that's turned down with a 401 is sent once more with a new token
+class CFTokenAuth (object):
+
+    def __init__ (self, token, header="Authorization", prefix="bearer "):
+        self.token = token
+        self.header = header
+        self.prefix = prefix
+
+    def __call__ (self, request):
+        request.headers[self.header] = self.prefix + self.token.get()
+        request.register_hook("response", self.handle_401)
+        return request
+
+    def handle_401 (self, response, **kwargs):
+        if response.status_code != 401:
+            return response
+        rejected = response.request.headers.get(self.header, "")[len(self.prefix):]
+        if not self.token.refresh(rejected):
+            return response
+
+        # read the rest of the response so the connection can be reused
+        response.content
+        response.close()
+        retry = response.request.copy()
+        retry.headers[self.header] = self.prefix + self.token.get()
+        newResponse = response.connection.send(retry, **kwargs)
+        newResponse.history.append(response)
+        newResponse.request = retry
+        return newResponse
+
+
+# look up the user name for an access token ("bearer ...") from uaa, or
+# None if uaa won't say.  Answers are kept on disk by token, so each login
+# is only looked up once
+def get_user_name (access_token, uaa_endpoint):
+    cacheName = hashlib.sha256(access_token.encode("utf-8")).hexdigest() + ".json"
+    try:
+        with open(os.path.join(USERINFO_CACHE_DIR, cacheName)) as f:
+            return json.load(f)["user_name"]
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    import requests
+    try:
+        response = new_http_session().get(uaa_endpoint.rstrip("/") + "/userinfo", headers={"Authorization": access_token}, verify=False, timeout=30)
+    except requests.exceptions.RequestException as e:
+        debug("Unable to get user info from " + uaa_endpoint + ": " + str(e))
+        return None
+    if response.status_code != 200:
+        debug("failed to get user info. invalid token or url, status was " + str(response.status_code))
+        return None
+    try:
+        userName = response.json().get("user_name")
+    except ValueError:
+        return None
+    if userName:
+        try:
+            write_private_json(USERINFO_CACHE_DIR, cacheName, {"user_name": userName})
+        except (IOError, OSError) as e:
+            debug("Unable to cache user info: " + str(e))
+    return userName
+
+# work out the targeting environment variables from the cf config.json:
+# BLUEMIX_ACCESS_TOKEN, UAA_END_POINT_URL, BLUEMIX_ORG, BLUEMIX_SPACE and
+# BLUEMIX_USER.  Variables already set in environ are left alone.  Returns
+# an OrderedDict of the ones to export
+def get_targeting_exports (environ=None, cf_home=None):
+    if environ is None:
+        environ = os.environ
+    targeting = load_cf_targeting(cf_home)
+
+    accessToken = environ.get('BLUEMIX_ACCESS_TOKEN') or targeting["access_token"]
+    uaaEndpoint = environ.get('UAA_END_POINT_URL')
+    if not uaaEndpoint:
+        # as the scripts always have: http and the api host with uaa in
+        # place of its first part.  config.json's UaaEndpoint only if
+        # there's no api host to go on
+        apiHost = environ.get('BLUEMIX_API_HOST') or (targeting["cf_api_server"] or "").split("://")[-1].split("/")[0]
+        if apiHost:
+            uaaEndpoint = "http://uaa" + (apiHost[apiHost.find("."):] if "." in apiHost else "")
+        else:
+            uaaEndpoint = targeting["uaa_endpoint"]
+
+    values = [
+        ('BLUEMIX_ACCESS_TOKEN', accessToken),
+        ('UAA_END_POINT_URL', uaaEndpoint),
+        ('BLUEMIX_ORG', targeting["org"]),
+        ('BLUEMIX_SPACE', targeting["space"])
+    ]
+    exports = collections.OrderedDict()
+    for name, value in values:
+        if value and not environ.get(name):
+            exports[name] = value
+    if not environ.get('BLUEMIX_USER') and accessToken:
+        userName = get_user_name(accessToken, uaaEndpoint)
+        if userName:
+            exports['BLUEMIX_USER'] = userName
+    return exports
+
+# the variables as export commands, one per line, for the shell to eval
+def format_exports (exports):
+    return "".join("export " + name + "=" + shell_quote(exports[name]) + "\n" for name in exports)
+
+
+# find the cf api server and the ICE api server, from config.json if it
+# has them, otherwise by asking cf
+# return both
+def find_api_servers (target=None):
+    try:
+        targeting = load_cf_targeting(get_target_cf_home(target))
+    except (IOError, OSError, ValueError, KeyError):
+        return find_api_servers_with_cli(get_target_cf_home(target))
+
+    return targeting["cf_api_server"], targeting["ccs_api_server"]
 
 
 # check with cf to find the api server
 # adjust to find the ICE api server
 # return both
-def find_api_servers ():
+def find_api_servers_with_cli (cf_home=None):
 
     cf_api_server = None
     ice_api_server = None
 
-    command = "cf api"
-    proc = Popen([command], shell=True, stdout=PIPE, stderr=PIPE)
-    out, err = proc.communicate();
+    env = None
+    if cf_home is not None:
+        env = dict(os.environ, CF_HOME=cf_home)
+
+    rc, out, err = run_command(["cf", "api"], env)
 
-    if proc.returncode != 0:
-        msg = "Error: Unable to find api server, rc was " + str(proc.returncode)
+    if rc != 0:
+        msg = "Error: Unable to find api server, rc was " + str(rc)
         if LOGGER:
             LOGGER.error(msg)
         raise Exception(msg)
@@ -136,6 +935,11 @@ def find_api_servers ():
     for word in words:
         if word.startswith("https://"):
             cf_api_server=word
+    if cf_api_server is None:
+        msg = "Error: Unable to find api server in \"" + out.strip() + "\""
+        if LOGGER:
+            LOGGER.error(msg)
+        raise Exception(msg)
     # get ice server as well by adjusting cf server
     ice_api_server = cf_api_server
     ice_api_server = ice_api_server.replace ( 'api.', 'containers-api.')
@@ -187,119 +991,799 @@ def get_remaining_wait_time (first = False):
 
     return time_to_wait
 
-# find the given service in our space, get its service name, or None
-# if it's not there yet
-def find_service_name_in_space (service):
-    command = "cf services"
-    proc = Popen([command], shell=True, stdout=PIPE, stderr=PIPE)
-    out, err = proc.communicate();
-
-    if proc.returncode != 0:
-        LOGGER.info("Unable to lookup services, error was: " + out)
+# return the point (on the timeit.default_timer clock) by which pending
+# work has to be done according to get_remaining_wait_time, or None if
+# no wait time has been set up
+def get_wait_deadline ():
+    if WAIT_TIME <= 0:
+        return None
+    return timeit.default_timer() + get_remaining_wait_time()
+
+# the point (on the timeit.default_timer clock) a command started now has
+# to be done by: COMMAND_TIMEOUT seconds (timeout if given) from now, or
+# when the wait time of get_remaining_wait_time runs out if that's sooner.
+# A command always gets COMMAND_MIN_TIMEOUT seconds though, so the ones run
+# after the wait time is used up still get a chance.  None for no limit
+def get_command_deadline (timeout=None):
+    if timeout is None:
+        timeout = COMMAND_TIMEOUT
+    now = timeit.default_timer()
+    deadline = None
+    if timeout > 0:
+        deadline = now + timeout
+    waitDeadline = get_wait_deadline()
+    if waitDeadline is not None:
+        waitDeadline = max(waitDeadline, now + COMMAND_MIN_TIMEOUT)
+        if (deadline is None) or (waitDeadline < deadline):
+            deadline = waitDeadline
+    return deadline
+
+# the timeout for an http request started now, to connect and to answer
+# by get_command_deadline, as the (connect, read) timeout requests takes.
+# None for no limit
+def get_request_timeout ():
+    deadline = get_command_deadline()
+    if deadline is None:
         return None
+    remaining = max(deadline - timeit.default_timer(), 1)
+    return (remaining, remaining)
+
+# a command running from an argv list (never through the shell), whose
+# stdout lines are read as they arrive by iterating over it.  A caller that
+# has what it needs can stop reading: close() stops the command if it's
+# still going, and returns its rc.  The command (and anything it started)
+# is killed at the deadline, and then has the rc RC_TIMED_OUT.  stderr is
+# read alongside, its last lines are kept (see get_stderr) and handed to
+# on_stderr as they arrive if it's given.  With merge_stderr, stderr comes
+# along with stdout instead
+class CommandStream (object):
+
+    def __init__ (self, argv, env=None, deadline=None, merge_stderr=False, on_stderr=None):
+        self.argv = list(argv)
+        self.returncode = None
+        self.timed_out = False
+        self.eof = False
+        self.message = None
+        self.stderr_lines = collections.deque(maxlen=200)
+        self.stderr_thread = None
+        self.watchdog = None
+        try:
+            self.proc = Popen(self.argv, stdout=PIPE, stderr=STDOUT if merge_stderr else PIPE,
+                              universal_newlines=True, env=env, **NEW_SESSION)
+        except OSError as e:
+            self.proc = None
+            self.returncode = 127
+            self.message = "Unable to run " + self.argv[0] + ": " + str(e)
+            return
+
+        if not merge_stderr:
+            def pump_stderr ():
+                for line in iter(self.proc.stderr.readline, ""):
+                    self.stderr_lines.append(line)
+                    if on_stderr is not None:
+                        on_stderr(line)
+            self.stderr_thread = threading.Thread(target=pump_stderr)
+            self.stderr_thread.daemon = True
+            self.stderr_thread.start()
+
+        if deadline is not None:
+            self.watchdog = threading.Timer(max(deadline - timeit.default_timer(), 0), self.time_out)
+            self.watchdog.daemon = True
+            self.watchdog.start()
+
+    def __iter__ (self):
+        if self.proc is None:
+            return
+        for line in iter(self.proc.stdout.readline, ""):
+            yield line
+        self.eof = True
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def time_out (self):
+        if self.proc.poll() is None:
+            self.timed_out = True
+            self.kill()
+
+    # kill the command and whatever it started, such as cf plugins
+    def kill (self):
+        try:
+            if NEW_SESSION:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            else:
+                self.proc.kill()
+        except OSError:
+            pass
 
+    # stop the command if it hasn't finished its output, and return its rc
+    def close (self):
+        if self.returncode is not None:
+            return self.returncode
+
+        if (not self.eof) and (self.proc.poll() is None):
+            self.kill()
+        self.proc.stdout.close()
+        rc = self.proc.wait()
+        if self.watchdog is not None:
+            self.watchdog.cancel()
+        if self.stderr_thread is not None:
+            # anything the command started could still hold stderr open
+            self.stderr_thread.join(5)
+
+        if self.timed_out:
+            rc = RC_TIMED_OUT
+            self.message = "Timed out running \"" + " ".join(self.argv) + "\""
+        elif rc < 0:
+            # killed by a signal, report it the way the shell does
+            rc = 128 - rc
+        self.returncode = rc
+        return rc
+
+    # the last lines of stderr, and why the command failed if it's known
+    def get_stderr (self):
+        err = "".join(self.stderr_lines)
+        if self.message:
+            err += self.message + "\n"
+        return err
+
+# run argv to the end, and return its rc, stdout and stderr.  The command
+# is stopped at the deadline (by default get_command_deadline()), and
+# when its output passes max_output characters (MAX_COMMAND_OUTPUT by
+# default), which gives the rc RC_OUTPUT_TOO_LARGE
+def run_command (argv, env=None, deadline=None, max_output=None, merge_stderr=False):
+    if deadline is None:
+        deadline = get_command_deadline()
+    if max_output is None:
+        max_output = MAX_COMMAND_OUTPUT
+
+    with trace_span(command_span_name(argv), command=" ".join(argv)) as span:
+        stream = CommandStream(argv, env, deadline, merge_stderr)
+        lines = []
+        size = 0
+        for line in stream:
+            size += len(line)
+            if size > max_output:
+                break
+            lines.append(line)
+        rc = stream.close()
+        if size > max_output:
+            rc = RC_OUTPUT_TOO_LARGE
+            stream.message = "Stopped \"" + " ".join(argv) + "\", its output passed " + str(max_output) + " characters"
+        span.set("rc", rc)
+
+    return rc, "".join(lines), stream.get_stderr()
+
+# one service instance in the space, as listed by "cf services"
+class ServiceInstance (object):
+    __slots__ = ("name", "service", "plan", "bound_apps", "last_operation", "dashboard_url")
+
+    def __init__ (self, name, service, plan, bound_apps, last_operation, dashboard_url=None):
+        self.name = name
+        self.service = service
+        self.plan = plan
+        self.bound_apps = bound_apps
+        self.last_operation = last_operation
+        self.dashboard_url = dashboard_url
+
+
+# the service instances in a space, in listing order, indexed by instance
+# name (by_name), by service label (by_service, a list per label) and by
+# bound app (by_app, a list per app)
+class ServicesTable (object):
+    __slots__ = ("instances", "by_name", "by_service", "by_app")
+
+    def __init__ (self, instances):
+        self.instances = instances
+        self.by_name = {}
+        self.by_service = {}
+        self.by_app = {}
+        for instance in instances:
+            self.by_name[instance.name] = instance
+            self.by_service.setdefault(instance.service, []).append(instance)
+            for app in instance.bound_apps:
+                self.by_app.setdefault(app, []).append(instance)
+
+    # return the instances of the given service label, in listing order
+    def find_by_service (self, service):
+        return self.by_service.get(service, [])
+
+
+# parse the output of "cf services" into a ServicesTable
+def parse_services_table (out):
+    return ServicesTable(list(iter_service_instances(out.splitlines())))
+
+# the ServiceInstances in the lines of "cf services" output, as each row is
+# read, so a caller can stop at the one it's looking for
+def iter_service_instances (lines):
     foundHeader = False
     serviceStart = -1
-    serviceEnd = -1
-    serviceName = None
-    for line in out.splitlines():
+    planStart = -1
+    boundStart = -1
+    boundEnd = -1
+    for line in lines:
         if (foundHeader == False) and (line.startswith("name")):
             # this is the header bar, find out the spacing to parse later
             # header is of the format:
             #name          service      plan   bound apps    last operation
             # and the spacing is maintained for following lines
             serviceStart = line.find("service")
-            serviceEnd = line.find("plan")-1
+            planStart = line.find("plan")
+            boundStart = line.find("bound apps")
+            boundEnd = line.find("last operation")
             foundHeader = True
-        elif foundHeader:
-            # have found the headers, looking for our service
-            if service in line:
-                # maybe found it, double check by making
-                # sure the service is in the right place,
-                # assuming we can check it
-                if (serviceStart > 0) and (serviceEnd > 0):
-                    if service in line[serviceStart:serviceEnd]:
-                        # this is the correct line - find the bound app(s)
-                        # if there are any
-                        serviceName = line[:serviceStart]
-                        serviceName = serviceName.strip()
+        elif foundHeader and line.strip():
+            if (serviceStart <= 0) or (planStart <= 0) or (boundStart <= 0):
+                # can't tell the columns apart, nothing sensible to return
+                return
+            line = line.rstrip("\n")
+            if boundEnd > 0:
+                boundApps = line[boundStart:boundEnd]
+                lastOperation = line[boundEnd:].strip()
+            else:
+                boundApps = line[boundStart:]
+                lastOperation = ""
+            yield ServiceInstance(
+                line[:serviceStart].strip(),
+                line[serviceStart:planStart].strip(),
+                line[planStart:boundStart].strip(),
+                [app.strip() for app in boundApps.split(",") if app.strip()],
+                lastOperation)
+
+
+# talks to cloud foundry by running the cf command line, one process per
+# operation.  This is the default backend, and the fallback if the rest
+# backend can't be set up.  The commands run with CF_HOME set to cf_home
+# if it's given
+class CFCliBackend (object):
+
+    def __init__ (self, cf_home=None):
+        self.env = None
+        if cf_home is not None:
+            self.env = dict(os.environ, CF_HOME=cf_home)
+
+    # run a cf command (an argv list), return the rc and its output.  Read
+    # only commands can set retry to have transient failures retried
+    def run (self, argv, retry=False):
+        command = " ".join(argv)
+        if retry:
+            rc, out = run_with_retry(argv, attempts=3, env=self.env)
+            if DEBUG:
+                LOGGER.debug("command \"" + command + "\" returned with rc=" + str(rc))
+                LOGGER.debug("\toutput was " + out)
+            return rc, out, ""
+
+        rc, out, err = run_command(argv, self.env)
+
+        if DEBUG:
+            LOGGER.debug("command \"" + command + "\" returned with rc=" + str(rc))
+            LOGGER.debug("\tstdout was " + out)
+            LOGGER.debug("\tstderr was " + err)
+
+        return rc, out, err
+
+    # list the services in the space as a ServicesTable, None on error
+    def list_services (self):
+        rc, out, err = self.run(["cf", "services"], retry=True)
+        if rc != 0:
+            if LOGGER:
+                LOGGER.info("Unable to lookup services, error was: " + out)
+            return None
+
+        return parse_services_table(out)
+
+    # the first instance of service that "cf services" lists, or None if
+    # there's none or the services can't be listed.  cf is stopped as soon
+    # as that row has been read.  Transient failures are retried
+    def find_service_instance (self, service, attempts=3):
+        global OUTPUT_FILTERS
+
+        if OUTPUT_FILTERS is None:
+            OUTPUT_FILTERS = load_output_filters()
+        for attempt in range(1, attempts + 1):
+            found = None
+            with trace_span("cf services", command="cf services", service=service) as span:
+                with CommandStream(["cf", "services"], self.env, get_command_deadline()) as stream:
+                    lines = (line for line in stream if not any(f.search(line) for f in OUTPUT_FILTERS))
+                    for instance in iter_service_instances(lines):
+                        if instance.service == service:
+                            found = instance
+                            break
+                span.set("rc", stream.returncode)
+            if found is not None:
+                return found
+            if stream.returncode == 0:
+                return None
+            if (attempt == attempts) or not is_retryable_failure(stream.returncode, stream.get_stderr()):
+                break
+            time.sleep(0.5 * (2 ** (attempt - 1)) * random.uniform(0.5, 1.0))
+
+        if LOGGER:
+            LOGGER.info("Unable to lookup services, error was: " + stream.get_stderr())
+        return None
+
+    # get the dashboard url of the named service instance, None if there
+    # is none or it can't be read
+    def get_service_dashboard (self, serviceName):
+        rc, out, err = self.run(["cf", "service", serviceName], retry=True)
+        if rc != 0:
+            return None
+
+        serviceURL = None
+        for line in out.splitlines():
+            if line.startswith("Dashboard: "):
+                serviceURL = line[11:]
+
+        return serviceURL
+
+    # return True if the app is in the space, False if not, None on error
+    def app_exists (self, app):
+        rc, out, err = self.run(["cf", "apps"], retry=True)
+        if rc != 0:
+            return None
+
+        for line in out.splitlines():
+            if line.startswith(app + " "):
+                return True
+
+        return False
+
+    # push an empty, stopped app to bind services to, returns True if it worked
+    def create_bridge_app (self):
+        if os.environ.get('OLDCF_LOCATION'):
+            command = os.environ.get('OLDCF_LOCATION')
+            if not os.path.isfile(command):
+                command = 'cf'
         else:
-            continue
+            command = 'cf'
+        argv = [command, "push", DEFAULT_BRIDGEAPP_NAME, "-i", "1", "-d", "mybluemix.net", "-k", "1M", "-m", "64M", "--no-hostname", "--no-manifest", "--no-route", "--no-start"]
+        LOGGER.debug("Executing command \"" + " ".join(argv) + "\"")
+        rc, out, err = self.run(argv)
 
-    return serviceName
+        if rc != 0:
+            LOGGER.info("Unable to create bridge app, error was: " + out)
+            return False
+
+        return True
+
+    # create an instance of service under plan named serviceName, returns
+    # True if it worked
+    def create_service (self, service, plan, serviceName):
+        argv = ["cf", "create-service", service, plan, serviceName]
+        LOGGER.debug("Executing command \"" + " ".join(argv) + "\"")
+        rc, out, err = self.run(argv)
+
+        if rc != 0:
+            LOGGER.info("Unable to create service in this space, error was: " + out)
+            return False
+
+        return True
+
+    # bind the named service instance to app.  Binding an already bound
+    # service is a no-op.  Returns True if it worked
+    def bind_service (self, app, serviceName):
+        rc, out, err = self.run(["cf", "bind-service", app, serviceName])
+
+        if rc != 0:
+            LOGGER.info("Unable to bind service to the app, error was: " + out)
+            return False
+
+        return True
+
+    # read the env vars of app and return its VCAP_SERVICES as a dict ({} if
+    # it has none), or None if they can't be read.  The output is read as it
+    # arrives and cf is stopped once VCAP_SERVICES has been decoded
+    def get_vcap_services (self, app):
+        argv = ["cf", "env", app]
+        with trace_span("cf env", command=" ".join(argv)) as span:
+            vcapServices = self.read_vcap_services(argv)
+            span.set("found", vcapServices is not None)
+        return vcapServices
+
+    def read_vcap_services (self, argv):
+        stream = CommandStream(argv, self.env, get_command_deadline(), merge_stderr=True)
+
+        decoder = json.JSONDecoder()
+        vcapServices = None
+        block = None
+        # the cf env var data comes back in the form
+        # blah blah blah
+        # {
+        #    <some json data for a var>
+        # }
+        # ... repeat, possibly including blah blah blah
+        #
+        # only the block whose first key is VCAP_SERVICES is decoded, the
+        # others are skipped over
+        with stream:
+            for line in stream:
+                if block is not None:
+                    block.append(line)
+                    if line.startswith("}"):
+                        # block end
+                        if "\"VCAP_SERVICES\"" in block[1]:
+                            envVars, end = decoder.raw_decode("".join(block))
+                            vcapServices = envVars.get("VCAP_SERVICES") or {}
+                            break
+                        block = None
+                elif line.startswith("{"): 
+                    # starting a block
+                    block = [line]
+
+        # got what we came for if it's there, don't wait for the rest
+        rc = stream.close()
+        if vcapServices is not None:
+            return vcapServices
+
+        if rc != 0:
+            debug("\"" + " ".join(argv) + "\" returned with rc=" + str(rc) + "\n" + stream.get_stderr())
+            return None
+
+        return {}
+
+    # list the names of the keys of a service instance, None on error
+    def list_service_keys (self, serviceName):
+        result = execute_cf_cmd(["cf", "service-keys", serviceName], self.env)
+        if result is None:
+            return None
+        debug("Raw result: \n" + str(result))
+        # ignore the header, the rest are the key names
+        return [line.strip() for line in result.splitlines()[3:] if line.strip()]
+
+    # create a key for a service instance, returns True if it worked
+    def create_service_key (self, serviceName, keyName):
+        return execute_cf_cmd(["cf", "csk", serviceName, keyName], self.env) is not None
+
+    # get the credentials of a service key as a dict, None on error
+    def get_service_key (self, serviceName, keyName):
+        result = execute_cf_cmd(["cf", "service-key", serviceName, keyName], self.env)
+        if result is None:
+            return None
+        debug("Raw result: \n" + str(result))
+        # extract out only the json portion of the command result
+        result = '\n'.join(result.split('\n')[1:-1])
+        debug("Raw filtered result: \n" + str(result))
+
+        return json.loads(result)
+
+
+# talks to the cloud foundry v2 api directly over keep-alive connections,
+# using the bearer token and space of the logged in cf cli.  With a
+# CFToken as token, it's sent in place of bearer_token and refreshed as
+# needed.  Same methods and return values as CFCliBackend
+class CFRestBackend (object):
+
+    def __init__ (self, api_server, bearer_token, space_guid, session=None, token=None):
+        if session is None:
+            session = new_http_session()
+        self.api_server = api_server.rstrip("/")
+        self.space_guid = space_guid
+        self.session = session
+        self.session.headers["Accept"] = "application/json"
+        if token is not None:
+            self.session.auth = CFTokenAuth(token)
+        else:
+            self.session.headers["Authorization"] = "bearer " + bearer_token
+
+    # make a request against the api, return the status code and the
+    # decoded json body (None if there isn't one).  Like a cf command, the
+    # request has until get_command_deadline to connect and answer; if it
+    # gets no answer (timed out, connection failed) the status is
+    # NO_RESPONSE_STATUS
+    def request (self, method, path, params=None, body=None):
+        import requests
+        url = path
+        if not url.startswith("http"):
+            url = self.api_server + path
+        if body is not None:
+            body = json.dumps(body)
+        with trace_span(method + " " + path.split("?")[0], "http", url=url, params=params) as span:
+            try:
+                response = self.session.request(method, url, params=params, data=body, timeout=get_request_timeout())
+            except requests.exceptions.RequestException as e:
+                span.set("error", str(e))
+                debug("%s %s failed: %s" % (method, url, e))
+                return NO_RESPONSE_STATUS, None
+            span.set("status", response.status_code)
+        debug("%s %s returned %i" % (method, url, response.status_code))
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        if response.status_code >= 400:
+            debug("\tresponse was " + response.text)
+
+        return response.status_code, data
+
+    # get all the resources of a (paged) list call, None on error
+    def list_resources (self, path, params=None):
+        resources = []
+        while path:
+            status, data = self.request("GET", path, params=params)
+            if status >= 400 or data is None:
+                return None
+            resources.extend(data.get("resources", []))
+            path = data.get("next_url")
+            # next_url already carries the query
+            params = None
+
+        return resources
+
+    def find_resource (self, path, name, field="name"):
+        resources = self.list_resources(path, params={"q": field + ":" + name})
+        if not resources:
+            return None
+        return resources[0]
+
+    def list_services (self):
+        status, summary = self.request("GET", "/v2/spaces/" + self.space_guid + "/summary")
+        if status >= 400 or summary is None:
+            if LOGGER:
+                LOGGER.info("Unable to lookup services, status was " + str(status))
+            return None
+
+        boundApps = {}
+        for app in summary.get("apps", []):
+            for serviceName in app.get("service_names", []):
+                boundApps.setdefault(serviceName, []).append(app["name"])
+
+        instances = []
+        for instance in summary.get("services", []):
+            # user provided services have no plan
+            plan = instance.get("service_plan") or {}
+            lastOperation = instance.get("last_operation") or {}
+            instances.append(ServiceInstance(
+                instance["name"],
+                plan.get("service", {}).get("label", "user-provided"),
+                plan.get("name", ""),
+                boundApps.get(instance["name"], []),
+                (lastOperation.get("type", "") + " " + lastOperation.get("state", "")).strip(),
+                instance.get("dashboard_url")))
+
+        return ServicesTable(instances)
+
+    def find_service_instance (self, service):
+        table = self.list_services()
+        if table is None:
+            return None
+        instances = table.find_by_service(service)
+        if not instances:
+            return None
+        return instances[0]
+
+    def get_service_dashboard (self, serviceName):
+        instance = self.find_resource("/v2/spaces/" + self.space_guid + "/service_instances", serviceName)
+        if instance is None:
+            return None
+        return instance["entity"].get("dashboard_url")
+
+    def app_exists (self, app):
+        apps = self.list_resources("/v2/spaces/" + self.space_guid + "/apps", params={"q": "name:" + app})
+        if apps is None:
+            return None
+        return len(apps) > 0
+
+    def create_bridge_app (self):
+        status, data = self.request("POST", "/v2/apps", body={
+            "name": DEFAULT_BRIDGEAPP_NAME,
+            "space_guid": self.space_guid,
+            "instances": 1,
+            "memory": 64,
+            "disk_quota": 1
+        })
+        if status >= 400:
+            LOGGER.info("Unable to create bridge app, error was: " + str(data))
+            return False
+
+        return True
+
+    def create_service (self, service, plan, serviceName):
+        offering = self.find_resource("/v2/spaces/" + self.space_guid + "/services", service, field="label")
+        if offering is None:
+            LOGGER.info("Unable to create service in this space, service \"" + service + "\" was not found")
+            return False
+
+        planGuid = None
+        for servicePlan in self.list_resources(offering["entity"]["service_plans_url"]) or []:
+            if servicePlan["entity"]["name"] == plan:
+                planGuid = servicePlan["metadata"]["guid"]
+        if planGuid is None:
+            LOGGER.info("Unable to create service in this space, plan \"" + plan + "\" was not found")
+            return False
+
+        status, data = self.request("POST", "/v2/service_instances", params={"accepts_incomplete": "true"}, body={
+            "name": serviceName,
+            "space_guid": self.space_guid,
+            "service_plan_guid": planGuid
+        })
+        if status >= 400:
+            LOGGER.info("Unable to create service in this space, error was: " + str(data))
+            return False
+
+        return True
+
+    def bind_service (self, app, serviceName):
+        appResource = self.find_resource("/v2/spaces/" + self.space_guid + "/apps", app)
+        instance = self.find_resource("/v2/spaces/" + self.space_guid + "/service_instances", serviceName)
+        if appResource is None or instance is None:
+            LOGGER.info("Unable to bind service to the app, app or service not found")
+            return False
+
+        status, data = self.request("POST", "/v2/service_bindings", body={
+            "app_guid": appResource["metadata"]["guid"],
+            "service_instance_guid": instance["metadata"]["guid"]
+        })
+        # like the cli, binding an already bound service is not an error
+        if status >= 400 and (data or {}).get("error_code") != "CF-ServiceBindingAppServiceTaken":
+            LOGGER.info("Unable to bind service to the app, error was: " + str(data))
+            return False
+
+        return True
+
+    def get_vcap_services (self, app):
+        appResource = self.find_resource("/v2/spaces/" + self.space_guid + "/apps", app)
+        if appResource is None:
+            return None
+
+        status, data = self.request("GET", "/v2/apps/" + appResource["metadata"]["guid"] + "/env")
+        if status >= 400 or data is None:
+            return None
+
+        return data.get("system_env_json", {}).get("VCAP_SERVICES") or {}
+
+    def list_service_keys (self, serviceName):
+        instance = self.find_resource("/v2/spaces/" + self.space_guid + "/service_instances", serviceName)
+        if instance is None:
+            return None
+        keys = self.list_resources("/v2/service_instances/" + instance["metadata"]["guid"] + "/service_keys")
+        if keys is None:
+            return None
+        return [key["entity"]["name"] for key in keys]
+
+    def create_service_key (self, serviceName, keyName):
+        instance = self.find_resource("/v2/spaces/" + self.space_guid + "/service_instances", serviceName)
+        if instance is None:
+            return False
+        status, data = self.request("POST", "/v2/service_keys", body={
+            "service_instance_guid": instance["metadata"]["guid"],
+            "name": keyName
+        })
+        return status < 400
+
+    def get_service_key (self, serviceName, keyName):
+        instance = self.find_resource("/v2/spaces/" + self.space_guid + "/service_instances", serviceName)
+        if instance is None:
+            return None
+        keys = self.list_resources("/v2/service_instances/" + instance["metadata"]["guid"] + "/service_keys",
+                                   params={"q": "name:" + keyName})
+        if not keys:
+            return None
+        return keys[0]["entity"]["credentials"]
+
+
+# return the backend used to talk to cloud foundry, chosen by the CF_BACKEND
+# env var: "cli" (the default) runs the cf command, "rest" calls the api
+# directly.  Falls back to the cli if the rest backend can't be set up.
+# Each target has a backend of its own
+def get_cf_backend (target=None):
+    global CF_BACKEND
+
+    if target is not None:
+        if target.backend is None:
+            target.backend = new_cf_backend(target)
+        return target.backend
+
+    if CF_BACKEND is None:
+        CF_BACKEND = new_cf_backend()
+
+    return CF_BACKEND
+
+def new_cf_backend (target=None):
+    if os.getenv('CF_BACKEND', "cli").lower() == "rest":
+        try:
+            bearer_token, space_guid = load_cf_auth_info(target)
+            cf_api_server, ice_api_server = find_api_servers(target)
+            return CFRestBackend(cf_api_server, bearer_token, space_guid, token=get_cf_token(target))
+        except Exception as e:
+            if LOGGER:
+                LOGGER.warning("Unable to use the cf rest api, falling back to the cf cli: " + str(e))
+    return CFCliBackend(get_target_cf_home(target))
+
+# return the ServicesTable for our space (target's if given), or None if it
+# could not be listed.  A previously fetched snapshot is reused until it is
+# older than SERVICES_CACHE_TTL, unless refresh is set
+def get_services_snapshot (refresh=False, target=None):
+    global SERVICES_SNAPSHOT, SERVICES_SNAPSHOT_TIME
+
+    if target is not None:
+        with target.snapshot_lock:
+            age = timeit.default_timer() - target.snapshot_time
+            if (not refresh) and (target.snapshot is not None) and (age < SERVICES_CACHE_TTL):
+                return target.snapshot
+
+            target.snapshot = get_cf_backend(target).list_services()
+            target.snapshot_time = timeit.default_timer()
+            return target.snapshot
+
+    with SERVICES_SNAPSHOT_LOCK:
+        age = timeit.default_timer() - SERVICES_SNAPSHOT_TIME
+        if (not refresh) and (SERVICES_SNAPSHOT is not None) and (age < SERVICES_CACHE_TTL):
+            return SERVICES_SNAPSHOT
+
+        SERVICES_SNAPSHOT = get_cf_backend().list_services()
+        SERVICES_SNAPSHOT_TIME = timeit.default_timer()
+        return SERVICES_SNAPSHOT
+
+# throw away the services snapshot (of target if given), the next lookup
+# will list them again.  called whenever we change the services in the space
+def invalidate_services_snapshot (target=None):
+    global SERVICES_SNAPSHOT
+
+    if target is not None:
+        with target.snapshot_lock:
+            target.snapshot = None
+        return
+
+    with SERVICES_SNAPSHOT_LOCK:
+        SERVICES_SNAPSHOT = None
+
+# find the given service in our space, get its service name, or None
+# if it's not there yet.  If there are several instances of the service,
+# the first one listed is used
+def find_service_name_in_space (service, target=None):
+    if SERVICES_CACHE_TTL <= 0:
+        # no snapshot to keep, read only as far as the service
+        instance = get_cf_backend(target).find_service_instance(service)
+        if instance is None:
+            return None
+        return instance.name
+
+    table = get_services_snapshot(target=target)
+    if table is None:
+        return None
+
+    instances = table.find_by_service(service)
+    if not instances:
+        return None
+
+    return instances[0].name
 
 # find a service in our space, and if it's there, get the dashboard
 # url for user info on it
-def find_service_dashboard (service):
+def find_service_dashboard (service, target=None):
 
-    serviceName = find_service_name_in_space(service)
-    if serviceName == None:
+    table = get_services_snapshot(target=target)
+    if table is None:
         return None
 
-    command = "cf service \"" + serviceName + "\""
-    proc = Popen([command], shell=True, stdout=PIPE, stderr=PIPE)
-    out, err = proc.communicate();
-
-    if proc.returncode != 0:
+    instances = table.find_by_service(service)
+    if not instances:
         return None
 
-    serviceURL = None
-    for line in out.splitlines():
-        if line.startswith("Dashboard: "):
-            serviceURL = line[11:]
-        else:
-            continue
+    # the rest backend lists the dashboard along with the service
+    if instances[0].dashboard_url:
+        return instances[0].dashboard_url
 
-    return serviceURL
+    return get_cf_backend(target).get_service_dashboard(instances[0].name)
 
 # search cf, find an app in our space bound to the given service, and return
 # the app name if found, or None if not
-def find_bound_app_for_service (service):
-
-    proc = Popen(["cf services"], shell=True, stdout=PIPE, stderr=PIPE)
-    out, err = proc.communicate();
+def find_bound_app_for_service (service, target=None):
 
-    if proc.returncode != 0:
+    table = get_services_snapshot(target=target)
+    if table is None:
         return None
 
-    foundHeader = False
-    serviceStart = -1
-    serviceEnd = -1
-    boundStart = -1
-    boundEnd = -1
     boundApp = None
-    for line in out.splitlines():
-        if (foundHeader == False) and (line.startswith("name")):
-            # this is the header bar, find out the spacing to parse later
-            # header is of the format:
-            #name          service      plan   bound apps    last operation
-            # and the spacing is maintained for following lines
-            serviceStart = line.find("service")
-            serviceEnd = line.find("plan")-1
-            boundStart = line.find("bound apps")
-            boundEnd = line.find("last operation")
-            foundHeader = True
-        elif foundHeader:
-            # have found the headers, looking for our service
-            if service in line:
-                # maybe found it, double check by making
-                # sure the service is in the right place,
-                # assuming we can check it
-                if (serviceStart > 0) and (serviceEnd > 0) and (boundStart > 0) and (boundEnd > 0):
-                    if service in line[serviceStart:serviceEnd]:
-                        # this is the correct line - find the bound app(s)
-                        # if there are any
-                        boundApp = line[boundStart:boundEnd]
-        else:
-            continue
-
-    # if we found a binding, make sure we only care about the first one
-    if boundApp != None:
-        if boundApp.find(",") >=0 :
-            boundApp = boundApp[:boundApp.find(",")]
-        boundApp = boundApp.strip()
-        if boundApp=="":
-            boundApp = None
+    for instance in table.find_by_service(service):
+        # if we found a binding, make sure we only care about the first one
+        if instance.bound_apps:
+            boundApp = instance.bound_apps[0]
+            break
 
     if DEBUG:
         if boundApp == None:
@@ -310,82 +1794,51 @@ def find_bound_app_for_service (service):
     return boundApp
 
 # look for our default bridge app.  if it's not there, create it
-def check_and_create_bridge_app ():
-    # first look to see if the bridge app already exists
-    command = "cf apps"
-    LOGGER.debug("Executing command \"" + command + "\"")
-    proc = Popen([command], shell=True, stdout=PIPE, stderr=PIPE)
-    out, err = proc.communicate();
+def check_and_create_bridge_app (target=None):
+    backend = get_cf_backend(target)
 
-    if DEBUG:
-        LOGGER.debug("command \"" + command + "\" returned with rc=" + str(proc.returncode))
-        LOGGER.debug("\tstdout was " + out)
-        LOGGER.debug("\tstderr was " + err)
-
-    if proc.returncode != 0:
+    # first look to see if the bridge app already exists
+    exists = backend.app_exists(DEFAULT_BRIDGEAPP_NAME)
+    if exists is None:
         return None
-
-    for line in out.splitlines():
-        if line.startswith(DEFAULT_BRIDGEAPP_NAME + " "):
-            # found it!
-            return True
+    if exists:
+        # found it!
+        return True
 
     # our bridge app isn't around, create it
     LOGGER.info("Bridge app does not exist, attempting to create it")
-    if os.environ.get('OLDCF_LOCATION'):
-        command = os.environ.get('OLDCF_LOCATION')
-        if not os.path.isfile(command):
-            command = 'cf'
-    else:
-        command = 'cf'
-    command = command +" push " + DEFAULT_BRIDGEAPP_NAME + " -i 1 -d mybluemix.net -k 1M -m 64M --no-hostname --no-manifest --no-route --no-start"
-    LOGGER.debug("Executing command \"" + command + "\"")
-    proc = Popen([command], shell=True, stdout=PIPE, stderr=PIPE)
-    out, err = proc.communicate();
-
-    if DEBUG:
-        LOGGER.debug("command \"" + command + "\" returned with rc=" + str(proc.returncode))
-        LOGGER.debug("\tstdout was " + out)
-        LOGGER.debug("\tstderr was " + err)
-
-    if proc.returncode != 0:
-        LOGGER.info("Unable to create bridge app, error was: " + out)
-        return False
-
-    return True
+    return backend.create_bridge_app()
 
 
 # look for our bridge app to bind this service to.  If it's not there,
 # attempt to create it.  Then bind the service to that app under the 
 # given plan.  If it all works, return that app name as the bound app
-def create_bound_app_for_service (service, plan=DEFAULT_SERVICE_PLAN):
+def create_bound_app_for_service (service, plan=DEFAULT_SERVICE_PLAN, target=None):
 
-    if not check_and_create_bridge_app():
+    if not check_and_create_bridge_app(target):
         return None
 
     # get or create the service if necessary
-    serviceName = get_or_create_service(service, plan)
+    serviceName = get_or_create_service(service, plan, target)
 
     if serviceName is None:
         return None
 
     # now try to bind the service to our bridge app
     LOGGER.info("Binding service \"" + serviceName + "\" to app \"" + DEFAULT_BRIDGEAPP_NAME + "\"")
-    proc = Popen(["cf bind-service " + DEFAULT_BRIDGEAPP_NAME + " \"" + serviceName + "\""], 
-                 shell=True, stdout=PIPE, stderr=PIPE)
-    out, err = proc.communicate();
+    bound = get_cf_backend(target).bind_service(DEFAULT_BRIDGEAPP_NAME, serviceName)
+    invalidate_services_snapshot(target)
 
-    if proc.returncode != 0:
-        LOGGER.info("Unable to bind service to the bridge app, error was: " + out)
+    if not bound:
         return None
 
     return DEFAULT_BRIDGEAPP_NAME
 
 # get or create the service and bind it to app
 # Returns app when bound to service, None if there is an error
-def bind_app_to_service (app, service, plan=DEFAULT_SERVICE_PLAN):
+def bind_app_to_service (app, service, plan=DEFAULT_SERVICE_PLAN, target=None):
     # get or create the service if necessary
-    serviceName = get_or_create_service(service, plan)
+    serviceName = get_or_create_service(service, plan, target)
 
     if serviceName is None:
         return None
@@ -393,159 +1846,428 @@ def bind_app_to_service (app, service, plan=DEFAULT_SERVICE_PLAN):
     #Doing a bind-service on an already bound service results in return code 0 and a no-op.
     #  it is quicker to do it this way than to check if the service is already bound
     LOGGER.info("Binding service \"" + serviceName + "\" to app \"" + app + "\"")
-    proc = Popen(["cf bind-service \"" + app + "\" \"" + serviceName + "\""], 
-                 shell=True, stdout=PIPE, stderr=PIPE)
-    out, err = proc.communicate();
+    bound = get_cf_backend(target).bind_service(app, serviceName)
+    invalidate_services_snapshot(target)
     #We do not restart the app, but we can still access the VCAP variables using cf calls.
-    if proc.returncode != 0:
-        LOGGER.info("Unable to bind service to the app, error was: " + out)
+    if not bound:
         return None
     return app
 
 # return the service name for the service, if the service doesn't exist, create it.
-def get_or_create_service(service, plan=DEFAULT_SERVICE_PLAN):
-    serviceName = find_service_name_in_space(service)
+def get_or_create_service(service, plan=DEFAULT_SERVICE_PLAN, target=None):
+    serviceName = find_service_name_in_space(service, target)
 
     # if we don't have the service name, means the tile isn't created in our space, so go
     # load it into our space if possible
     if serviceName == None:
         LOGGER.info("Service \"" + service + "\" is not loaded in this space, attempting to load it")
         serviceName = service
-        command = "cf create-service \"" + service + "\" \"" + plan + "\" \"" + serviceName + "\""
-        LOGGER.debug("Executing command \"" + command + "\"")
-        proc = Popen([command],
-                     shell=True, stdout=PIPE, stderr=PIPE)
-        out, err = proc.communicate();
+        created = get_cf_backend(target).create_service(service, plan, serviceName)
+        invalidate_services_snapshot(target)
 
-        if proc.returncode != 0:
-            LOGGER.info("Unable to create service in this space, error was: " + out)
+        if not created:
             return None
 
     return serviceName
 
 
+# return the compiled filters for run_with_retry, one regex per line of
+# filename (rmVersionMsg.txt next to this file by default)
+def load_output_filters (filename=None):
+    if filename is None:
+        filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rmVersionMsg.txt")
+    try:
+        with open(filename) as filterFile:
+            return [re.compile(line.rstrip("\n")) for line in filterFile if line.strip()]
+    except IOError:
+        return []
+
+# return True if a command that failed with rc and output is worth running
+# again
+def is_retryable_failure (rc, output):
+    if rc in (126, 127):
+        # couldn't run the command at all
+        return False
+    if rc in (RC_TIMED_OUT, RC_OUTPUT_TOO_LARGE):
+        # killed by run_command, running it again would only do the same
+        return False
+    if FATAL_OUTPUT.search(output):
+        return False
+    return True
+
+# run argv once, dropping stdout lines that match filters.  The remaining
+# lines are written to output as they arrive if it's given, and collected
+# otherwise.  stderr is passed through (when writing to output) and kept.
+# Returns the rc, the collected stdout, and the tail of stdout and stderr
+def run_filtered (argv, output, filters, env=None):
+    with trace_span(command_span_name(argv), command=" ".join(argv)) as span:
+        rc, collected, tail = run_filtered_untraced(argv, output, filters, env)
+        span.set("rc", rc)
+    return rc, collected, tail
+
+def run_filtered_untraced (argv, output, filters, env=None):
+    tail = collections.deque(maxlen=50)
+    def on_stderr (line):
+        tail.append(line)
+        if output is not None:
+            sys.stderr.write(line)
+    stream = CommandStream(argv, env, get_command_deadline(), on_stderr=on_stderr)
+
+    # only what's collected counts against MAX_COMMAND_OUTPUT
+    collected = []
+    size = 0
+    with stream:
+        for line in stream:
+            if any(f.search(line) for f in filters):
+                continue
+            tail.append(line)
+            if output is not None:
+                output.write(line)
+                output.flush()
+            else:
+                size += len(line)
+                if size > MAX_COMMAND_OUTPUT:
+                    break
+                collected.append(line)
+
+    rc = stream.returncode
+    if size > MAX_COMMAND_OUTPUT:
+        rc = RC_OUTPUT_TOO_LARGE
+        stream.message = "Stopped \"" + " ".join(argv) + "\", its output passed " + str(MAX_COMMAND_OUTPUT) + " characters"
+    if stream.message:
+        tail.append(stream.message + "\n")
+    return rc, "".join(collected), "".join(tail)
+
+# run argv until it works, up to attempts times, filtering its output
+# through the rmVersionMsg.txt patterns.  Retryable failures (see
+# is_retryable_failure) are retried after a jittered, exponentially growing
+# delay starting at base_delay seconds, as long as that fits before the
+# deadline (by default the one from get_wait_deadline).  output is where
+# the filtered stdout goes: a file object, the name of a file to rewrite on
+# each attempt, or None to collect it.  env is the environment to run argv
+# in, by default our own.  Returns the last rc and the collected output
+def run_with_retry (argv, attempts=5, deadline=None, output=None, base_delay=0.5, max_delay=20, env=None):
+    global OUTPUT_FILTERS
+
+    if OUTPUT_FILTERS is None:
+        OUTPUT_FILTERS = load_output_filters()
+    if deadline is None:
+        deadline = get_wait_deadline()
+
+    attempt = 0
+    while True:
+        attempt += 1
+        if isinstance(output, str):
+            with open(output, "w") as outputFile:
+                rc, out, tail = run_filtered(argv, outputFile, OUTPUT_FILTERS, env)
+        else:
+            rc, out, tail = run_filtered(argv, output, OUTPUT_FILTERS, env)
+
+        if rc == 0 or attempt >= attempts or not is_retryable_failure(rc, tail):
+            return rc, out
+
+        delay = min(max_delay, base_delay * (2 ** (attempt - 1))) * random.uniform(0.5, 1.0)
+        if (deadline is not None) and (timeit.default_timer() + delay >= deadline):
+            return rc, out
+
+        msg = "\"" + " ".join(argv) + "\" did not return successfully. RC=" + str(rc) + ". Sleep %.1f sec and try again." % delay
+        if LOGGER:
+            LOGGER.info(msg)
+        else:
+            print(LABEL_COLOR + msg + LABEL_NO_COLOR)
+            sys.stdout.flush()
+        with trace_span("retry backoff", "wait", command=" ".join(argv), attempt=attempt, delay=delay):
+            time.sleep(delay)
+
+
+# make sure each of the (service, plan) pairs in services has an instance
+# in our space bound to app (the bridge app if not given).  Missing services
+# are found from a single listing, then created and bound up to
+# max_workers at a time through the rest backend, or one at a time through
+# the cf cli, whose commands all share the CF_HOME config.json, stopping at
+# the deadline from get_remaining_wait_time.  Returns a dict of service -> result, where
+# each result is a dict of the instance "name" (None if it couldn't be set
+# up), whether it was "created", whether it is "bound", whether it
+# "timed_out" before it was done, and the "error" message if it failed.
+# The results are a copy, work still going on past the deadline doesn't
+# change them
+def ensure_services_bound (services, app=None, max_workers=4, target=None):
+    results = {}
+    for service, plan in services:
+        results[service] = {"name": None, "created": False, "bound": False, "timed_out": False, "error": None}
+
+    def fail_all (msg):
+        for result in results.values():
+            result["error"] = msg
+        return results
+
+    if app is None:
+        if not check_and_create_bridge_app(target):
+            return fail_all("Unable to find or create the bridge app")
+        app = DEFAULT_BRIDGEAPP_NAME
+
+    table = get_services_snapshot(target=target)
+    if table is None:
+        return fail_all("Unable to list the services in this space")
+
+    # work out what's missing
+    pending = queue.Queue()
+    for service, plan in services:
+        instances = table.find_by_service(service)
+        if instances:
+            results[service]["name"] = instances[0].name
+            if app in instances[0].bound_apps:
+                results[service]["bound"] = True
+                continue
+        pending.put((service, plan))
+
+    if pending.empty():
+        return results
+
+    deadline = get_wait_deadline()
+    backend = get_cf_backend(target)
+    if isinstance(backend, CFCliBackend):
+        # cf commands running at once in the same CF_HOME step on each
+        # other's config.json writes
+        max_workers = 1
+    # guards results once the workers are going
+    resultsLock = threading.Lock()
+    # set once we've stopped waiting, so no more work is started
+    stopped = threading.Event()
+
+    def setup_service (service, plan):
+        result = results[service]
+        name = result["name"]
+        if name is None:
+            LOGGER.info("Service \"" + service + "\" is not loaded in this space, attempting to load it")
+            if not backend.create_service(service, plan, service):
+                with resultsLock:
+                    result["error"] = "Unable to create service \"" + service + "\" in this space"
+                return
+            name = service
+            with resultsLock:
+                result["name"] = name
+                result["created"] = True
+
+        LOGGER.info("Binding service \"" + name + "\" to app \"" + app + "\"")
+        if not backend.bind_service(app, name):
+            with resultsLock:
+                result["error"] = "Unable to bind service \"" + name + "\" to app \"" + app + "\""
+            return
+        with resultsLock:
+            result["bound"] = True
+        # what was cached for the service may be for the old binding
+        invalidate_cached_credentials(service, plan, binding_app=app, target=target)
+
+    def worker ():
+        while True:
+            try:
+                service, plan = pending.get_nowait()
+            except queue.Empty:
+                return
+            if stopped.is_set() or ((deadline is not None) and (timeit.default_timer() >= deadline)):
+                with resultsLock:
+                    results[service]["timed_out"] = True
+                    results[service]["error"] = "Out of time before service \"" + service + "\" could be set up"
+                continue
+            try:
+                setup_service(service, plan)
+            except Exception as e:
+                with resultsLock:
+                    results[service]["error"] = str(e)
+
+    workers = []
+    for i in range(min(max_workers, pending.qsize())):
+        thread = threading.Thread(target=worker)
+        # don't hold up the process for work we've given up waiting on
+        thread.daemon = True
+        thread.start()
+        workers.append(thread)
+
+    with trace_span("ensure services bound", "wait", services=[service for service, plan in services]):
+        for thread in workers:
+            if deadline is None:
+                thread.join()
+            else:
+                thread.join(max(deadline - timeit.default_timer(), 0))
+    stopped.set()
+
+    invalidate_services_snapshot(target)
+
+    # the workers we've given up on may still be writing to results
+    with resultsLock:
+        done = dict((service, dict(results[service])) for service in results)
+    for service in done:
+        result = done[service]
+        if not result["bound"] and result["error"] is None:
+            result["timed_out"] = True
+            result["error"] = "Out of time waiting for service \"" + service + "\" to be set up"
+
+    return done
+
+
+# return True if credentials should be cached on disk
+def credentials_cache_enabled ():
+    useCache = os.environ.get('CF_CREDENTIALS_CACHE')
+    return (useCache != None) and (useCache.lower() == "true") and (CREDENTIALS_CACHE_TTL > 0)
+
+# return the cache file for the credentials identified by the key (a
+# tuple of strings), scoped to the space we're logged into (or target's),
+# or None if the space can't be determined
+def get_credentials_cache_file (key, target=None):
+    try:
+        bearer_token, space_guid = load_cf_auth_info(target)
+    except Exception as e:
+        debug("Not caching credentials, unable to find the space: " + str(e))
+        return None
+    if space_guid is None:
+        return None
+
+    digest = hashlib.sha256("\n".join((space_guid,) + key).encode("utf-8")).hexdigest()
+    return os.path.join(CREDENTIALS_CACHE_DIR, digest + ".json")
+
+# return the cached credentials for the key, or None if they aren't cached
+# or have expired
+def load_cached_credentials (key, target=None):
+    if not credentials_cache_enabled():
+        return None
+    cacheFile = get_credentials_cache_file(key, target)
+    if cacheFile is None:
+        return None
+
+    try:
+        with open(cacheFile) as f:
+            entry = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if time.time() - entry.get("time", 0) > CREDENTIALS_CACHE_TTL:
+        debug("Cached credentials in " + cacheFile + " have expired")
+        return None
+
+    debug("Using cached credentials from " + cacheFile)
+    return entry.get("credentials")
+
+# store credentials for the key, in a file only readable by the owner
+def save_cached_credentials (credentials, key, target=None):
+    if (credentials is None) or (not credentials_cache_enabled()):
+        return
+    cacheFile = get_credentials_cache_file(key, target)
+    if cacheFile is None:
+        return
+
+    try:
+        write_private_json(CREDENTIALS_CACHE_DIR, os.path.basename(cacheFile), {"time": time.time(), "credentials": credentials})
+    except (IOError, OSError) as e:
+        if LOGGER:
+            LOGGER.warning("Unable to cache credentials: " + str(e))
+
+# drop any cached credentials for the service: from its service key, from
+# whichever bound app was found, and from binding_app if given.  Called
+# when the service is rebound or can't be found, and for callers to use
+# when the credentials returned by get_credentials_from_bound_app or
+# get_credentials_for_non_binding_service turn out not to work
+def invalidate_cached_credentials (service, plan=DEFAULT_SERVICE_PLAN, key_name=DEFAULT_SERVICE_KEY, binding_app=None, target=None):
+    if not credentials_cache_enabled():
+        return
+    keys = [("bound", service, plan, ""), ("key", service, plan, key_name)]
+    if binding_app:
+        keys.append(("bound", service, plan, binding_app))
+    for key in keys:
+        cacheFile = get_credentials_cache_file(key, target)
+        if (cacheFile is not None) and os.path.exists(cacheFile):
+            try:
+                os.remove(cacheFile)
+            except OSError:
+                pass
+
+
 # find given bound app, and look for the passed bound service in cf.  once
 # found in VCAP_SERVICES, look for the credentials setting, and return the
 # dict.  Raises Exception on errors
-def get_credentials_from_bound_app (service, binding_app=None, plan=DEFAULT_SERVICE_PLAN):
+def get_credentials_from_bound_app (service, binding_app=None, plan=DEFAULT_SERVICE_PLAN, target=None):
+    cacheKey = ("bound", service, plan, binding_app or "")
+    credentials = load_cached_credentials(cacheKey, target)
+    if credentials is not None:
+        return credentials
+
     # if no binding app parm passed, go looking to find a bound app for this one
     if binding_app == None:
-        binding_app = find_bound_app_for_service(service)
+        binding_app = find_bound_app_for_service(service, target)
         # if still no binding app, and the user agreed, CREATE IT!
         if binding_app == None:
             setupSpace = os.environ.get('SETUP_SERVICE_SPACE')
             if (setupSpace != None) and (setupSpace.lower() == "true"):
-                binding_app = create_bound_app_for_service(service=service, plan=plan)
+                binding_app = create_bound_app_for_service(service=service, plan=plan, target=target)
             else:
+                invalidate_cached_credentials(service, plan, binding_app=cacheKey[3], target=target)
                 raise Exception("Service \"" + service + "\" is not loaded and bound in this space.  " + LABEL_COLOR + "Please add the service to the space and bind it to an app, or set the parameter to allow the space to be setup automatically" + LABEL_NO_COLOR)
     else:
         setupSpace = os.environ.get('SETUP_SERVICE_SPACE')
         if (setupSpace != None) and (setupSpace.lower() == "true"):
             #Make sure provided binding_app is bound to the service
-            binding_app = bind_app_to_service(app=binding_app, service=service, plan=plan)
+            binding_app = bind_app_to_service(app=binding_app, service=service, plan=plan, target=target)
 
 
     # if STILL no binding app, we're out of options, just fail out
     if binding_app == None:
+        invalidate_cached_credentials(service, plan, binding_app=cacheKey[3], target=target)
         raise Exception("Unable to access an app bound to the " + service + " service - this must be set to get the proper credentials.")
 
         
     # try to read the env vars off the bound app in cloud foundry, the one we
     # care about is "VCAP_SERVICES"
-    verProc = Popen(["cf env \"" + binding_app + "\""], shell=True, 
-                    stdout=PIPE, stderr=PIPE)
-    verOut, verErr = verProc.communicate();
+    serviceList = get_cf_backend(target).get_vcap_services(binding_app)
 
-    if verProc.returncode != 0:
+    if serviceList is None:
+        invalidate_cached_credentials(service, plan, binding_app=cacheKey[3], target=target)
         raise Exception("Unable to read credential information off the app bound to the " + service + " service - please check that it is set correctly.")
 
-    envList = []
-    envIndex = 0
-    inSection = False
-    # the cf env var data comes back in the form
-    # blah blah blah
-    # {
-    #    <some json data for a var>
-    # }
-    # ... repeat, possibly including blah blah blah
-    #
-    # parse through it, and extract out just the json blocks
-    for line in verOut.splitlines():
-        if inSection:
-            envList[envIndex] += line
-            if line.startswith("}"):
-                # block end
-                inSection = False
-                envIndex = envIndex+1
-        elif line.startswith("{"): 
-            # starting a block
-            envList.append(line)
-            inSection = True
-        else:
-            # just ignore this line
-            pass
-
-    # now parse that collected json data to get the actual vars
-    jsonEnvList = {}
-    for x in envList:
-        jsonEnvList.update(json.loads(x))
-
-    return_cred_list = []
-    found = False
-
     # find the credentials for the service in question
-    if jsonEnvList != None:
-        serviceList = jsonEnvList['VCAP_SERVICES']
-        if serviceList != None:
-            analyzerService = serviceList[service]
-            if analyzerService != None:
-                credentials = analyzerService[0]['credentials']
-                if credentials != None:
-                    found = True
-                    return credentials
-
-    if not found:
-        raise Exception("Unable to get bound credentials for access to the " + service + " service.")
+    analyzerService = serviceList.get(service)
+    if analyzerService:
+        credentials = analyzerService[0].get('credentials')
+        if credentials != None:
+            save_cached_credentials(credentials, cacheKey, target)
+            return credentials
 
-    return None
+    invalidate_cached_credentials(service, plan, binding_app=cacheKey[3], target=target)
+    raise Exception("Unable to get bound credentials for access to the " + service + " service.")
 
 
 # retrieve the credentials for non-binding service brokers which (optionally) implement the service_keys endpoint
-def get_credentials_for_non_binding_service(service, plan=DEFAULT_SERVICE_PLAN, key_name=DEFAULT_SERVICE_KEY):
+def get_credentials_for_non_binding_service(service, plan=DEFAULT_SERVICE_PLAN, key_name=DEFAULT_SERVICE_KEY, target=None):
+    cacheKey = ("key", service, plan, key_name)
+    result = load_cached_credentials(cacheKey, target)
+    if result is not None:
+        return result
+
     # get or create the service if allowed
     setupSpace = os.environ.get('SETUP_SERVICE_SPACE')
     if (setupSpace != None) and (setupSpace.lower() == "true"):
-        service_name = get_or_create_service(service, plan)
+        service_name = get_or_create_service(service, plan, target)
     else:
-        service_name = find_service_name_in_space(service)
+        service_name = find_service_name_in_space(service, target)
     if service_name is None:
         LOGGER.error("No instance of service \"%s\" setup in space" %(service))
+        invalidate_cached_credentials(service, plan, key_name, target=target)
         return None
 
-    result = execute_cf_cmd("cf service-keys '%s'" % service_name)
-    debug("Raw result: \n" + str(result))
-    # ignore the header and grab the first service key
-    result = result.splitlines()[3:4:]
-    debug("Raw filtered result: \n" + str(result))
+    backend = get_cf_backend(target)
+    keys = backend.list_service_keys(service_name) or []
+    debug("Service keys: \n" + str(keys))
     
-    if len(result) == 0:
+    if len(keys) == 0:
         #create the default service key
-        execute_cf_cmd("cf csk '%s' '%s'" % (service_name, key_name))
-        result = execute_cf_cmd("cf service-keys '%s'" % service_name)
-        debug("Raw result: \n" + str(result))
-        # ignore the header and grab the first service key
-        result = result.splitlines()[3:4:]
-        debug("Raw filtered result: \n" + str(result))
-
-    if len(result) > 0:
-        result = execute_cf_cmd("cf service-key '%s' '%s'" % (service_name, result[0].strip()))
-        debug("Raw result: \n" + str(result))
-        # extract out only the json portion of the command result
-        result = '\n'.join(result.split('\n')[1:-1])
-        debug("Raw filtered result: \n" + str(result))
+        backend.create_service_key(service_name, key_name)
+        keys = backend.list_service_keys(service_name) or []
+        debug("Service keys: \n" + str(keys))
 
-        result = json.loads(result)
+    if len(keys) > 0:
+        # grab the first service key
+        result = backend.get_service_key(service_name, keys[0])
         debug("JSON result: \n" + str(result))
+        save_cached_credentials(result, cacheKey, target)
 
         # return the json as-is, let the caller pull the appropriate data out (which may vary from one service broker
         # to another)
@@ -553,17 +2275,95 @@ def get_credentials_for_non_binding_service(service, plan=DEFAULT_SERVICE_PLAN,
     else:
         LOGGER.error("No service key for service instance %s", service_name)
 
+    invalidate_cached_credentials(service, plan, key_name, target=target)
     return None
 
 
-def execute_cf_cmd(command):
-    proc = Popen([command], shell=True, stdout=PIPE, stderr=PIPE)
-    out, err = proc.communicate()
+# run operation(*args, target=target, **kwargs) for each of targets at
+# once, each in a process of its own (up to processes at a time, by
+# default all of them), so the targets' cf cli runs, backends and services
+# snapshots can't get in each other's way.  operation has to be a module
+# level function taking target, such as get_credentials_from_bound_app,
+# ensure_services_bound or gp_create.create_groups.  Targets not done by
+# the deadline (by default the one from get_wait_deadline) are given up on.
+# Returns a dict per target, in order, with the target's "name", whether
+# it went "ok", and the "result" or the "error"
+def run_for_targets (operation, targets, args=(), kwargs=None, processes=None, deadline=None):
+    if not targets:
+        return []
+    if deadline is None:
+        deadline = get_wait_deadline()
+
+    tasks = [(operation, target, tuple(args), dict(kwargs or {})) for target in targets]
+    pool = multiprocessing.Pool(processes or len(targets), initializer=start_target_process)
+    results = []
+    timedOut = False
+    with trace_span("run for targets", "wait", operation=operation.__name__, targets=[target.name for target in targets]):
+        pending = [pool.apply_async(run_target_operation, (task,)) for task in tasks]
+        for target, asyncResult in zip(targets, pending):
+            timeout = None
+            if deadline is not None:
+                timeout = max(deadline - timeit.default_timer(), 0)
+            try:
+                results.append(asyncResult.get(timeout))
+            except multiprocessing.TimeoutError:
+                timedOut = True
+                results.append({"name": target.name, "ok": False, "error": "Out of time waiting for target \"" + target.name + "\""})
+
+    if timedOut:
+        pool.terminate()
+    else:
+        pool.close()
+    pool.join()
+    return results
+
+# set up a process of run_for_targets
+def start_target_process ():
+    # the spans so far are the parent's to write
+    with TRACE_LOCK:
+        del TRACE_SPANS[:]
+
+# run one operation of run_for_targets, in a process of the pool
+def run_target_operation (task):
+    operation, target, args, kwargs = task
+    # for anything that runs cf without going through the target
+    savedHome = os.environ.get('CF_HOME')
+    if target.cf_home is not None:
+        os.environ['CF_HOME'] = target.cf_home
+    try:
+        result = {"name": target.name, "ok": True, "result": operation(*args, target=target, **kwargs)}
+    except Exception as e:
+        result = {"name": target.name, "ok": False, "error": str(e)}
+    finally:
+        if savedHome is None:
+            os.environ.pop('CF_HOME', None)
+        else:
+            os.environ['CF_HOME'] = savedHome
+
+    # pool processes don't get to run the exit handlers
+    for handler in logging.getLogger('pipeline').handlers:
+        handler.flush()
+    write_trace()
+    return result
+
+
+# run a cf command through the cli, whichever backend is in use, and
+# return its output, or None if it failed.  command is an argv list, run
+# as is, or a command line, run by the shell as it always has been (so
+# pipes, redirects and variables in it still work).  env is the
+# environment to run it in, by default our own
+def execute_cf_cmd(command, env=None):
+    if isinstance(command, list):
+        argv = command
+        command = " ".join(argv)
+    else:
+        argv = ["/bin/sh", "-c", command]
+    rc, out, err = run_command(argv, env)
 
     debug("Executing command \"%s\" \n%s" % (command, out))
 
-    if proc.returncode != 0:
-        LOGGER.error("An error occurred running command '%s' " + out % command)
+    if rc != 0:
+        LOGGER.error("An error occurred running command '%s' %s%s" % (command, out, err))
         return None
 
     return out
@@ -574,3 +2374,145 @@ def debug(message):
         LOGGER.debug(message)
 
 
+# command line entry points, for the shell scripts
+#    python python_utils.py retry [--output FILE] -- command args...
+#        runs a command through run_with_retry, exits with its rc
+#    python python_utils.py targeting-exports [--cf-home DIR]
+#        prints export commands for the targeting variables from the cf
+#        config.json that aren't already set, for the shell to eval
+#    python python_utils.py trace-summary [FILE]
+#        prints the time spent in each kind of span in a trace file, by
+#        default $PIPELINE_TRACE_FILE
+#    python python_utils.py targets --cf-home DIR [--cf-home DIR]... OPERATION
+#        runs an operation for several cf targets at once, each logged in
+#        and targeted under its own CF_HOME (see run_for_targets), and
+#        prints a json result per target.  OPERATION is one of
+#            find-service SERVICE
+#            credentials SERVICE [--app APP] [--plan PLAN]
+#            key-credentials SERVICE [--plan PLAN] [--key KEY]
+#            bind SERVICE[:PLAN]... [--app APP]
+#            create-groups MANIFEST_FILE [--parallel COUNT] [--retries COUNT]
+def main (argv=None):
+    global LOGGER
+    global WAIT_TIME
+
+    parser = argparse.ArgumentParser(prog="python_utils.py")
+    subparsers = parser.add_subparsers(dest="action")
+
+    retry_parser = subparsers.add_parser("retry", help="run a command, retrying transient failures")
+    retry_parser.add_argument("--output", metavar="FILE", help="write the filtered output to FILE instead of stdout")
+    retry_parser.add_argument("--attempts", type=int, default=5, help="most times to run the command")
+    retry_parser.add_argument("--max-time", type=float, help="most seconds to spend retrying, by default what's left of the pipeline WAIT_TIME")
+    retry_parser.add_argument("cmd", nargs=argparse.REMAINDER, help="the command to run")
+
+    exports_parser = subparsers.add_parser("targeting-exports", help="print exports of the cf targeting variables")
+    exports_parser.add_argument("--cf-home", help="the CF_HOME to read config.json from")
+
+    summary_parser = subparsers.add_parser("trace-summary", help="summarize the spans in a trace file")
+    summary_parser.add_argument("file", nargs="?", default=TRACE_FILE, help="the trace file, by default $PIPELINE_TRACE_FILE")
+
+    targets_parser = subparsers.add_parser("targets", help="run an operation for several cf targets at once")
+    targets_parser.add_argument("--cf-home", action="append", required=True, dest="cf_homes", metavar="DIR", help="the CF_HOME of a target, once per target")
+    targets_parser.add_argument("--processes", type=int, help="most targets to work on at once, by default all of them")
+    operations = targets_parser.add_subparsers(dest="operation")
+    find_parser = operations.add_parser("find-service", help="find the instance of a service")
+    find_parser.add_argument("service")
+    credentials_parser = operations.add_parser("credentials", help="get the credentials of a service from a bound app")
+    credentials_parser.add_argument("service")
+    credentials_parser.add_argument("--app", help="the bound app, found (or set up) if not given")
+    credentials_parser.add_argument("--plan", default=DEFAULT_SERVICE_PLAN)
+    key_parser = operations.add_parser("key-credentials", help="get the credentials of a service from a service key")
+    key_parser.add_argument("service")
+    key_parser.add_argument("--plan", default=DEFAULT_SERVICE_PLAN)
+    key_parser.add_argument("--key", default=DEFAULT_SERVICE_KEY)
+    bind_parser = operations.add_parser("bind", help="make sure services are set up and bound")
+    bind_parser.add_argument("services", nargs="+", metavar="SERVICE[:PLAN]")
+    bind_parser.add_argument("--app", help="the app to bind to, by default the bridge app")
+    groups_parser = operations.add_parser("create-groups", help="create the container groups in a manifest")
+    groups_parser.add_argument("manifest", metavar="MANIFEST_FILE")
+    groups_parser.add_argument("--parallel", type=int, default=4, help="groups to create at once in each target")
+    groups_parser.add_argument("--retries", type=int, default=3, help="retries per group")
+
+    args = parser.parse_args(argv)
+
+    if args.action == "retry":
+        cmd = args.cmd
+        if cmd and cmd[0] == "--":
+            cmd = cmd[1:]
+        if not cmd:
+            parser.error("no command given to retry")
+        if args.max_time is not None:
+            deadline = timeit.default_timer() + args.max_time
+        else:
+            WAIT_TIME = get_remaining_wait_time(first=True)
+            deadline = get_wait_deadline()
+        output = args.output or sys.stdout
+        rc, out = run_with_retry(cmd, attempts=args.attempts, deadline=deadline, output=output)
+        return rc
+
+    if args.action == "targeting-exports":
+        # stdout is for the shell to eval, log anything else to stderr
+        LOGGER = logging.getLogger('pipeline')
+        LOGGER.addHandler(logging.StreamHandler(sys.stderr))
+        LOGGER.setLevel(logging.DEBUG if DEBUG else logging.WARNING)
+        try:
+            exports = get_targeting_exports(cf_home=args.cf_home)
+        except Exception as e:
+            sys.stderr.write("Unable to read the cf targeting: " + str(e) + "\n")
+            return 1
+        sys.stdout.write(format_exports(exports))
+        return 0
+
+    if args.action == "trace-summary":
+        if not args.file:
+            parser.error("no trace file given, and PIPELINE_TRACE_FILE isn't set")
+        sys.stdout.write(format_trace_summary(load_trace(args.file)))
+        return 0
+
+    if args.action == "targets":
+        # stdout is the results, log anything else to stderr
+        LOGGER = logging.getLogger('pipeline')
+        LOGGER.addHandler(logging.StreamHandler(sys.stderr))
+        LOGGER.setLevel(logging.DEBUG if DEBUG else logging.INFO)
+        targets = [CFTarget(cf_home) for cf_home in args.cf_homes]
+        kwargs = {}
+        if args.operation == "find-service":
+            operation = find_service_name_in_space
+            kwargs = {"service": args.service}
+        elif args.operation == "credentials":
+            operation = get_credentials_from_bound_app
+            kwargs = {"service": args.service, "binding_app": args.app, "plan": args.plan}
+        elif args.operation == "key-credentials":
+            operation = get_credentials_for_non_binding_service
+            kwargs = {"service": args.service, "plan": args.plan, "key_name": args.key}
+        elif args.operation == "bind":
+            services = []
+            for service in args.services:
+                name, sep, plan = service.partition(":")
+                services.append((name, plan or DEFAULT_SERVICE_PLAN))
+            operation = ensure_services_bound
+            kwargs = {"services": services, "app": args.app}
+        elif args.operation == "create-groups":
+            import gp_create
+            operation = gp_create.create_groups
+            kwargs = {"specs": gp_create.load_manifest(args.manifest), "parallel": max(args.parallel, 1), "retries": args.retries}
+        else:
+            parser.error("no operation given for the targets")
+
+        results = run_for_targets(operation, targets, kwargs=kwargs, processes=args.processes)
+        print(json.dumps(results, indent=2))
+        ok = all(result["ok"] for result in results)
+        # the operations that report on several things report failures
+        # of their own
+        if ok and args.operation == "bind":
+            ok = all(not status["error"] for result in results for status in result["result"].values())
+        if ok and args.operation == "create-groups":
+            ok = all(entry["status"] == "created" for result in results for entry in result["result"])
+        return 0 if ok else 1
+
+    parser.print_help()
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -354,6 +354,14 @@ sendHipChatNotify()
 # Main
 #############################################################################
 
+# Hand the message to send_message.py when python is around: it posts to
+# Slack and HipChat at the same time, and keeps undelivered messages to
+# retry.  Set USE_PYTHON_NOTIFIER=false to send from here
+SEND_MESSAGE_PY="${BASH_SOURCE%/*}/send_message.py"
+if [ "${USE_PYTHON_NOTIFIER}" != "false" ] && [ -f "${SEND_MESSAGE_PY}" ] && hash python 2>/dev/null; then
+    exec python "${SEND_MESSAGE_PY}" "$@"
+fi
+
 # Set options from the command line.
 while getopts ":m:l:h:d" FLAG; do
    case ${FLAG} in
@@ -0,0 +1,432 @@
+#!/usr/bin/python
+
+#***************************************************************************
+# Copyright 2015 IBM
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#***************************************************************************
+
+# Notifier behind sendMessage.sh: the same flags, environment variables,
+# colors, filtering and return codes, see sendMessage.sh -h.
+#
+# Every message goes into a spool directory first, then the spool is
+# flushed: all the messages waiting for a channel (a Slack webhook, a
+# HipChat room) go out as one post, and the channels are posted to at the
+# same time.  Messages that couldn't be delivered for a reason that might
+# pass (no connection, a 5xx) stay in the spool for the next flush, which
+# is the next message sent or "send_message.py --flush".
+#
+#    NOTIFICATION_COALESCE_SECONDS  if set, queue the message and return
+#                                   straight away; a background flusher
+#                                   sends everything queued after this
+#                                   many seconds
+#    NOTIFICATION_SPOOL_DIR         the spool (default EXT_DIR/.notification_spool)
+#    NOTIFICATION_TIMEOUT           seconds to wait on a webhook (default 10)
+#    NOTIFICATION_MAX_ATTEMPTS      deliveries to try before giving up on a
+#                                   message (default 5)
+#    SLACK_WEBHOOK_PATH             may be a full url, of a stand in server
+#    HIP_CHAT_API_URL               HipChat api (default https://api.hipchat.com)
+
+import argparse
+import collections
+import fcntl
+import json
+import os
+import os.path
+import python_utils
+import re
+import subprocess
+import sys
+import threading
+import time
+try:
+    import requests
+except ImportError:
+    requests = None
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+# return codes, as sendMessage.sh
+RC_SEND_MESSAGE_SUCCESS = 0
+RC_SLACK_ERROR = 1
+RC_HIP_CHAT_ERROR = 2
+RC_SLACK_AND_HIP_CHAT_ERROR = 3
+RC_NOTIFY_MSG_USAGE = 12
+RC_BAD_USAGE = 254
+
+SLACK_URL = "https://hooks.slack.com/services/"
+SLACK_INFO_COLOR = "#c3cab9"
+HIP_CHAT_COLORS = ["green", "red", "gray", "yellow", "purple", "random"]
+
+SPOOL_DIR = os.getenv('NOTIFICATION_SPOOL_DIR', os.path.join(python_utils.EXT_DIR, ".notification_spool"))
+try:
+    TIMEOUT = float(os.getenv('NOTIFICATION_TIMEOUT', "10"))
+except ValueError:
+    TIMEOUT = 10
+try:
+    MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', "5"))
+except ValueError:
+    MAX_ATTEMPTS = 5
+
+DEBUG = None
+
+
+def debugme (message):
+    if DEBUG:
+        print(message)
+
+def echo (color, message):
+    print(color + message + python_utils.LABEL_NO_COLOR)
+    sys.stdout.flush()
+
+# sendMessage.sh's filter table: whether a message of level gets through
+# notification_filter
+def should_send (level, notification_filter):
+    level = level or ""
+    if not notification_filter:
+        return level != "info"
+    notification_filter = notification_filter.lower()
+    if notification_filter == "bad":
+        return level not in ("good", "info")
+    if notification_filter == "info":
+        return True
+    return level != "info"
+
+def slack_color (level, environ):
+    if environ.get('SLACK_COLOR'):
+        return environ['SLACK_COLOR'].lower()
+    if environ.get('NOTIFICATION_COLOR'):
+        return { "good": "good", "danger": "danger", "info": SLACK_INFO_COLOR }.get(environ['NOTIFICATION_COLOR'].lower(), "")
+    return { "good": "good", "bad": "danger", "info": SLACK_INFO_COLOR }.get((level or "").lower(), "")
+
+def hip_chat_color (level, environ):
+    if environ.get('HIP_CHAT_COLOR'):
+        color = environ['HIP_CHAT_COLOR'].lower()
+    elif environ.get('NOTIFICATION_COLOR'):
+        color = { "good": "green", "danger": "red" }.get(environ['NOTIFICATION_COLOR'].lower(), "gray")
+    else:
+        color = { "good": "green", "bad": "red" }.get((level or "").lower(), "gray")
+    if color not in HIP_CHAT_COLORS:
+        debugme("Invalid HipChat color " + color + ". Setting to 'gray' color")
+        color = "gray"
+    return color
+
+# the project and url of the pipeline job, from IDS_PROJECT_NAME
+# ("user | project") and IDS_URL, or None outside a job
+def get_sender (environ):
+    projectName = environ.get('IDS_PROJECT_NAME')
+    if not projectName:
+        debugme("Sender for this notification message is not defined")
+        return None
+    project = projectName.split("| ")[-1]
+    user = projectName.split(" |")[0]
+    return project, user, "%s/%s/%s" % (environ.get('IDS_URL', ""), user, project)
+
+def get_slack_url (webhook_path):
+    if webhook_path.startswith("https://") or webhook_path.startswith("http://"):
+        return webhook_path
+    return SLACK_URL + webhook_path
+
+# turn slack style links, <url|name>, into just the url
+def strip_links (message):
+    return re.sub(r"<([^|>]*)\|[^>]*>", r"\1", message)
+
+# the deliveries of a message, a dict of channel -> what to post there
+def build_channels (message, level, environ):
+    channels = {}
+    sender = get_sender(environ)
+    if environ.get('SLACK_WEBHOOK_PATH'):
+        text = message
+        if sender:
+            project, user, url = sender
+            text = "<%s|%s-%s>: %s" % (url, project, user, message)
+        channels["slack"] = {
+            "url": get_slack_url(environ['SLACK_WEBHOOK_PATH']),
+            "text": text,
+            "color": slack_color(level, environ)
+        }
+    if environ.get('HIP_CHAT_TOKEN'):
+        text = message
+        if sender:
+            text = sender[2] + ": " + message
+        channels["hipchat"] = {
+            "api": environ.get('HIP_CHAT_API_URL', "https://api.hipchat.com").rstrip("/"),
+            "room": environ['HIP_CHAT_ROOM_NAME'],
+            "token": environ['HIP_CHAT_TOKEN'],
+            "text": strip_links(text),
+            "color": hip_chat_color(level, environ)
+        }
+    return channels
+
+# where a channel's messages go, the messages for the same one are posted
+# together
+def channel_key (channel, data):
+    if channel == "slack":
+        return (channel, data["url"])
+    return (channel, data["api"], data["room"], data["token"])
+
+
+# post the messages for a slack webhook as one payload, an attachment each.
+# Returns the status code
+def post_slack (session, key, messages):
+    payload = { "attachments": [{ "text": data["text"], "color": data["color"] } for data in messages] }
+    debugme("Slack Payload: " + json.dumps(payload))
+    response = session.post(key[1], data={ "payload": json.dumps(payload) }, timeout=TIMEOUT)
+    return response.status_code
+
+# post the messages for a hipchat room as one notification, in the color of
+# the most recent message, or red if any of them are.  Returns the status
+def post_hip_chat (session, key, messages):
+    channel, api, room, token = key
+    colors = [data["color"] for data in messages]
+    payload = {
+        "color": "red" if "red" in colors else colors[-1],
+        "message_format": "text",
+        "message": "\n".join(data["text"] for data in messages)
+    }
+    debugme("HipChat Payload: " + json.dumps(payload))
+    response = session.post(api + "/v2/room/" + quote(room, safe="") + "/notification",
+                            data=json.dumps(payload),
+                            headers={ "Content-type": "application/json", "Authorization": "Bearer " + token },
+                            timeout=TIMEOUT)
+    return response.status_code
+
+SUCCESS_STATUS = { "slack": (200,), "hipchat": (200, 204) }
+POSTERS = { "slack": post_slack, "hipchat": post_hip_chat }
+
+# deliver to every channel at once.  groups is a dict of channel key ->
+# list of messages for it.  Returns a dict of key -> (delivered, status),
+# where status is the http status code or the error that stopped the post
+def deliver (groups):
+    results = {}
+    def deliver_one (key):
+        session = python_utils.new_http_session()
+        try:
+            status = POSTERS[key[0]](session, key, groups[key])
+            results[key] = (status in SUCCESS_STATUS[key[0]], status)
+        except requests.exceptions.RequestException as e:
+            results[key] = (False, str(e))
+        except Exception as e:
+            # anything else that went wrong posting (a bad spool entry, a
+            # poster bug) fails this channel, not the flush
+            debugme("Delivering to " + key[0] + " failed: " + repr(e))
+            results[key] = (False, str(e))
+        finally:
+            session.close()
+    threads = [threading.Thread(target=deliver_one, args=(key,)) for key in groups]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+# whether a failed delivery could work if tried again later.  Bad tokens,
+# rooms and payloads won't
+def is_retryable (status):
+    if isinstance(status, int):
+        return status >= 500 or status == 429
+    return True
+
+
+# hold the spool lock for the with block, so only one process flushes
+class SpoolLock (object):
+
+    def __init__ (self, spool_dir):
+        self.filename = os.path.join(spool_dir, ".lock")
+        self.lockFile = None
+
+    def __enter__ (self):
+        self.lockFile = open(self.filename, "a")
+        fcntl.flock(self.lockFile, fcntl.LOCK_EX)
+        return self
+
+    def __exit__ (self, exc_type, exc_value, tb):
+        fcntl.flock(self.lockFile, fcntl.LOCK_UN)
+        self.lockFile.close()
+        return False
+
+# add a message to the spool, returns its file name
+def spool_message (channels, level, spool_dir=SPOOL_DIR):
+    name = "%.6f-%i.json" % (time.time(), os.getpid())
+    python_utils.write_private_json(spool_dir, name, { "time": time.time(), "level": level, "channels": channels, "attempts": 0 })
+    return name
+
+def load_spool (spool_dir):
+    entries = []
+    if not os.path.isdir(spool_dir):
+        return entries
+    for name in sorted(os.listdir(spool_dir)):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(spool_dir, name)) as spoolFile:
+                entries.append((name, json.load(spoolFile)))
+        except (IOError, OSError, ValueError):
+            continue
+    return entries
+
+# deliver everything in the spool, coalesced by channel.  Delivered
+# messages leave the spool, and so do ones that failed for good or have
+# used up their attempts (into spool_dir/failed).  Returns a dict of spool
+# file name -> dict of channel -> (delivered, status) for each message
+# that was in the spool
+def flush_spool (spool_dir=SPOOL_DIR):
+    if not os.path.isdir(spool_dir):
+        return {}
+    with SpoolLock(spool_dir):
+        entries = load_spool(spool_dir)
+        groups = collections.OrderedDict()
+        for name, record in entries:
+            for channel in sorted(record["channels"]):
+                data = record["channels"][channel]
+                groups.setdefault(channel_key(channel, data), []).append(data)
+        results = deliver(groups)
+
+        outcome = {}
+        for name, record in entries:
+            outcome[name] = {}
+            record["attempts"] += 1
+            for channel in list(record["channels"]):
+                delivered, status = results.get(channel_key(channel, record["channels"][channel]), (False, "not delivered"))
+                outcome[name][channel] = (delivered, status)
+                if delivered or not is_retryable(status):
+                    del record["channels"][channel]
+            path = os.path.join(spool_dir, name)
+            if not record["channels"]:
+                os.remove(path)
+            elif record["attempts"] >= MAX_ATTEMPTS:
+                python_utils.write_private_json(os.path.join(spool_dir, "failed"), name, record)
+                os.remove(path)
+            else:
+                python_utils.write_private_json(spool_dir, name, record)
+        return outcome
+
+# start a flusher that waits delay seconds for more messages, then flushes
+# the spool, without waiting for it
+def start_flusher (delay, spool_dir=SPOOL_DIR):
+    with open(os.devnull, "r+") as devnull:
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "--flush", "--flush-after", str(delay)],
+                         stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True, preexec_fn=os.setsid,
+                         env=dict(os.environ, NOTIFICATION_SPOOL_DIR=spool_dir))
+
+# report how a message's deliveries went, as sendMessage.sh does.
+# Returns its return code
+def report (outcome):
+    slackFailed = False
+    hipChatFailed = False
+    if "slack" in outcome:
+        delivered, status = outcome["slack"]
+        if delivered:
+            echo(python_utils.LABEL_GREEN, "Slack notification message has been sent succesfully.")
+        else:
+            slackFailed = True
+            reason = { 404: " 'Bad Slack Webhook URL token'", 500: " 'Slack Payload was not valid'" }.get(status, "")
+            echo(python_utils.LABEL_RED, "Slack notification message failed with (Response code = %s%s)." % (status, reason))
+    if "hipchat" in outcome:
+        delivered, status = outcome["hipchat"]
+        if delivered:
+            echo(python_utils.LABEL_GREEN, "HipChat notification message sent succesfully.")
+        else:
+            hipChatFailed = True
+            reason = { 401: " 'Bad HipChat token'", 400: " 'HipChat Payload was not valid'", 404: " 'HipChat room not found'" }.get(status, "")
+            echo(python_utils.LABEL_RED, "HipChat notification message failed with (Response code = %s%s)." % (status, reason))
+    if slackFailed or hipChatFailed:
+        if any(not delivered and is_retryable(status) for delivered, status in outcome.values()):
+            echo(python_utils.LABEL_COLOR, "The notification message has been kept to retry with the next message, or send_message.py --flush.")
+    if slackFailed and hipChatFailed:
+        return RC_SLACK_AND_HIP_CHAT_ERROR
+    if slackFailed:
+        return RC_SLACK_ERROR
+    if hipChatFailed:
+        return RC_HIP_CHAT_ERROR
+    return RC_SEND_MESSAGE_SUCCESS
+
+
+class UsageParser (argparse.ArgumentParser):
+
+    # bad usage exits like sendMessage.sh does
+    def error (self, message):
+        self.print_usage()
+        sys.stderr.write(message + "\n")
+        sys.exit(RC_BAD_USAGE)
+
+def main (argv=None):
+    global DEBUG
+
+    parser = UsageParser(prog="sendMessage.sh", description="Send notification message. See sendMessage.sh for the environment variables used.")
+    parser.add_argument("-m", dest="message", help="(required) the notification message, may contain URLs in slack format <url|name>")
+    parser.add_argument("-l", dest="level", help="(recommended) the notification level: good, info or bad")
+    parser.add_argument("-d", dest="debug", action="store_true", help="debug information")
+    parser.add_argument("--flush", action="store_true", help="deliver the messages waiting in the spool and exit")
+    parser.add_argument("--flush-after", type=float, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if requests is None:
+        # no requests module here, let the script do it the old way
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sendMessage.sh")
+        os.environ["USE_PYTHON_NOTIFIER"] = "false"
+        os.execv("/bin/bash", ["bash", script] + list(sys.argv[1:] if argv is None else argv))
+
+    environ = os.environ
+    if args.debug:
+        environ["DEBUG"] = "1"
+    DEBUG = environ.get('DEBUG') == "1"
+
+    if args.flush:
+        if args.flush_after > 0:
+            time.sleep(args.flush_after)
+        outcome = flush_spool()
+        return 0 if all(delivered for channels in outcome.values() for delivered, status in channels.values()) else 1
+
+    if not args.message:
+        parser.print_usage()
+        echo(python_utils.LABEL_RED, "Notification message must be used when invoking this script.")
+        return RC_NOTIFY_MSG_USAGE
+
+    level = args.level
+    if environ.get('NOTIFICATION_LEVEL'):
+        level = environ['NOTIFICATION_LEVEL']
+    if environ.get('MESSAGE_COLOR'):
+        environ['NOTIFICATION_COLOR'] = environ['MESSAGE_COLOR']
+    notificationFilter = environ.get('NOTIFY_FILTER') or environ.get('NOTIFICATION_FILTER')
+    debugme("Script Input:  NOTIFY_LEVEL = '%s', NOTIFY_MSG = '%s'" % (level, args.message))
+
+    if not should_send(level, notificationFilter):
+        if environ.get('SLACK_WEBHOOK_PATH') or environ.get('HIP_CHAT_TOKEN'):
+            print("skipped sending Notification message because the NOTIFICATION_FILTER = '%s' and NOTIFICATION_LEVEL = '%s'" % ((notificationFilter or "").lower(), level))
+        return RC_SEND_MESSAGE_SUCCESS
+
+    if not environ.get('SLACK_WEBHOOK_PATH') and not environ.get('HIP_CHAT_TOKEN'):
+        echo(python_utils.LABEL_COLOR, "To send notifications, set SLACK_WEBHOOK_PATH or HIP_CHAT_TOKEN in the environment")
+        return RC_SEND_MESSAGE_SUCCESS
+    if environ.get('HIP_CHAT_TOKEN') and not environ.get('HIP_CHAT_ROOM_NAME'):
+        print("HIP_CHAT_ROOM_NAME must be set when using HIP_CHAT_TOKEN")
+        return RC_HIP_CHAT_ERROR
+
+    name = spool_message(build_channels(args.message, level, environ), level)
+
+    try:
+        delay = float(environ.get('NOTIFICATION_COALESCE_SECONDS') or 0)
+    except ValueError:
+        delay = 0
+    if delay > 0:
+        start_flusher(delay)
+        echo(python_utils.LABEL_GREEN, "Notification message queued, it will be sent within %g seconds." % delay)
+        return RC_SEND_MESSAGE_SUCCESS
+
+    outcome = flush_spool()
+    return report(outcome.get(name, {}))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+#!/usr/bin/python
+
+#***************************************************************************
+# Copyright 2015 IBM
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#***************************************************************************
+
+# Small client for utils_daemon.py, for shell scripts to call the
+# python_utils lookups without starting python_utils up each time:
+#
+#    python utils_client.py find-service SERVICE
+#    python utils_client.py bound-app SERVICE
+#    python utils_client.py dashboard SERVICE
+#    python utils_client.py credentials SERVICE [--app APP] [--plan PLAN]
+#    python utils_client.py key-credentials SERVICE [--plan PLAN] [--key KEY]
+#    python utils_client.py api-servers
+#    python utils_client.py targeting-exports
+#    python utils_client.py create-group SPEC_JSON
+#    python utils_client.py stop
+#
+# Strings are printed as they are, anything else as json.  Exits 1 with
+# the error on stderr if the lookup failed, or found nothing.
+#
+# The daemon is optional: with USE_UTILS_DAEMON set to "true" the request
+# goes to the daemon for this EXT_DIR, which is started if it isn't
+# running.  Otherwise, or if the daemon can't be reached, the lookup is run
+# directly in this process.  Only the
+# standard library is imported until then, to keep this quick to start
+
+import argparse
+import hashlib
+import json
+import os
+import os.path
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+# the environment settings the daemon uses from each request, rather than
+# its own
+REQUEST_ENV = ["SETUP_SERVICE_SPACE", "CF_CREDENTIALS_CACHE"]
+
+# the targeting variables already set, which targeting-exports leaves
+# alone (see python_utils.get_targeting_exports)
+TARGETING_ENV = ["BLUEMIX_ACCESS_TOKEN", "UAA_END_POINT_URL", "BLUEMIX_API_HOST", "BLUEMIX_ORG", "BLUEMIX_SPACE", "BLUEMIX_USER"]
+
+# longest unix socket path that works everywhere
+MAX_SOCKET_PATH = 100
+
+
+# the socket of the daemon for this EXT_DIR.  In EXT_DIR if the path isn't
+# too long for a unix socket, and the temp dir otherwise
+def get_socket_path ():
+    extDir = os.path.abspath(os.getenv('EXT_DIR', "."))
+    path = os.path.join(extDir, ".utils_daemon.sock")
+    if len(path) > MAX_SOCKET_PATH:
+        digest = hashlib.sha256(extDir.encode("utf-8")).hexdigest()[:16]
+        path = os.path.join(tempfile.gettempdir(), "utils_daemon_" + digest + ".sock")
+    return path
+
+def use_daemon ():
+    return os.getenv('USE_UTILS_DAEMON', "false").lower() == "true"
+
+# send a request to the daemon, return its response dict, or None if the
+# daemon isn't there
+def send_request (request, path=None):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(1)
+        sock.connect(path or get_socket_path())
+        # lookups can take as long as cf does
+        sock.settimeout(None)
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    except (IOError, OSError, socket.error):
+        return None
+    finally:
+        sock.close()
+    if not data:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+# start the daemon in the background and wait a little for it to listen.
+# Returns True if it's up
+def start_daemon (path=None):
+    path = path or get_socket_path()
+    daemon = os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils_daemon.py")
+    with open(os.devnull, "r+") as devnull:
+        subprocess.Popen([sys.executable, daemon, "--socket", path], stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True, preexec_fn=os.setsid)
+    for i in range(50):
+        if send_request({ "op": "ping" }, path) is not None:
+            return True
+        time.sleep(0.1)
+    return False
+
+# run an operation, through the daemon if possible.  Returns the response
+# dict: "ok", and "result" or "error"
+def call (op, args):
+    request = {
+        "op": op,
+        "args": args,
+        "cf_home": os.getenv('CF_HOME', ""),
+        "env": dict((name, os.getenv(name)) for name in REQUEST_ENV)
+    }
+    if use_daemon():
+        response = send_request(request)
+        if response is None and start_daemon():
+            response = send_request(request)
+        if response is not None and not response.get("fallback"):
+            return response
+
+    # no daemon to be had, do it ourselves
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import utils_daemon
+    return utils_daemon.run_operation(op, args)
+
+
+def main (argv=None):
+    parser = argparse.ArgumentParser(prog="utils_client.py")
+    subparsers = parser.add_subparsers(dest="op")
+    for op in ("find-service", "bound-app", "dashboard"):
+        subparsers.add_parser(op).add_argument("service")
+    credentials_parser = subparsers.add_parser("credentials")
+    credentials_parser.add_argument("service")
+    credentials_parser.add_argument("--app", dest="binding_app")
+    credentials_parser.add_argument("--plan")
+    key_parser = subparsers.add_parser("key-credentials")
+    key_parser.add_argument("service")
+    key_parser.add_argument("--plan")
+    key_parser.add_argument("--key", dest="key_name")
+    subparsers.add_parser("api-servers")
+    subparsers.add_parser("targeting-exports")
+    group_parser = subparsers.add_parser("create-group")
+    group_parser.add_argument("spec", type=json.loads, help="the group spec as json")
+    subparsers.add_parser("stop")
+    args = vars(parser.parse_args(argv))
+
+    op = args.pop("op")
+    if op is None:
+        parser.print_help()
+        return 1
+    if op == "stop":
+        send_request({ "op": "shutdown" })
+        return 0
+    args = dict((name, value) for name, value in args.items() if value is not None)
+    if op == "targeting-exports":
+        args["environ"] = dict((name, os.environ[name]) for name in TARGETING_ENV if os.environ.get(name))
+
+    response = call(op, args)
+    if not response.get("ok"):
+        sys.stderr.write(str(response.get("error")) + "\n")
+        return 1
+    result = response.get("result")
+    if result is None:
+        return 1
+    if isinstance(result, type(u"")) or isinstance(result, str):
+        sys.stdout.write(result if result.endswith("\n") else result + "\n")
+    else:
+        print(json.dumps(result))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+#!/usr/bin/python
+
+#***************************************************************************
+# Copyright 2015 IBM
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#***************************************************************************
+
+# Long lived helper that keeps python_utils loaded, along with what it has
+# cached (the cf targeting, the services snapshot, the backend's and the
+# containers api's sessions), and serves lookups to utils_client.py over a
+# unix socket.  Started by the client when needed, and stops itself after
+# --idle-timeout seconds without a request.
+#
+# Requests and responses are a line of json each, one of each per
+# connection.  A request is {"op": ..., "args": {...}, "cf_home": ...,
+# "env": {...}}, answered with {"ok": true, "result": ...} or {"ok": false,
+# "error": ...}.  A request for another CF_HOME than the daemon's is
+# answered with "fallback" for the client to run it itself.  Requests are
+# handled one at a time, python_utils keeps its state in globals
+
+import argparse
+import json
+import logging
+import os
+import os.path
+import python_utils
+import sys
+import threading
+import time
+import timeit
+import utils_client
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+# session for the containers api, set up on first use
+GROUP_SESSION = None
+
+# modification time of the cf config.json when the cached state was loaded
+CONFIG_MTIME = None
+
+# held while a request is handled
+REQUEST_LOCK = threading.Lock()
+
+
+def get_group_session ():
+    global GROUP_SESSION
+
+    if GROUP_SESSION is None:
+        import gp_create
+        GROUP_SESSION = gp_create.new_session(pool_size=4)
+    return GROUP_SESSION
+
+def create_group (args):
+    import gp_create
+    return gp_create.create_group(args["spec"], get_group_session())
+
+# op name -> function of the request args
+OPERATIONS = {
+    "ping": lambda args: "pong",
+    "find-service": lambda args: python_utils.find_service_name_in_space(args["service"]),
+    "bound-app": lambda args: python_utils.find_bound_app_for_service(args["service"]),
+    "dashboard": lambda args: python_utils.find_service_dashboard(args["service"]),
+    "credentials": lambda args: python_utils.get_credentials_from_bound_app(args["service"], binding_app=args.get("binding_app"), plan=args.get("plan", python_utils.DEFAULT_SERVICE_PLAN)),
+    "key-credentials": lambda args: python_utils.get_credentials_for_non_binding_service(args["service"], plan=args.get("plan", python_utils.DEFAULT_SERVICE_PLAN), key_name=args.get("key_name", python_utils.DEFAULT_SERVICE_KEY)),
+    "api-servers": lambda args: list(python_utils.find_api_servers()),
+    "targeting-exports": lambda args: python_utils.format_exports(python_utils.get_targeting_exports(environ=args.get("environ", {}))),
+    "create-group": create_group,
+}
+
+# log to stderr rather than stdout, which is the client's result
+def setup_logging ():
+    logger = logging.getLogger('pipeline')
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        logger.addHandler(handler)
+        if python_utils.DEBUG:
+            logger.setLevel(logging.DEBUG)
+        else:
+            logger.setLevel(logging.INFO)
+    return logger
+
+# run an operation in this process, return the response dict
+def run_operation (op, args):
+    if python_utils.LOGGER is None:
+        python_utils.LOGGER = setup_logging()
+    operation = OPERATIONS.get(op)
+    if operation is None:
+        return { "ok": False, "error": "Unknown operation \"" + str(op) + "\"" }
+    try:
+        return { "ok": True, "result": operation(args) }
+    except Exception as e:
+        python_utils.debug("Operation %s failed: %s" % (op, e))
+        return { "ok": False, "error": str(e) }
+
+# drop everything cached from the cf config.json if it has changed since,
+# such as after a cf login or cf target
+def check_targeting ():
+    global CONFIG_MTIME, GROUP_SESSION
+
+    try:
+        mtime = os.path.getmtime(python_utils.get_cf_config_file())
+    except OSError:
+        mtime = None
+    if mtime != CONFIG_MTIME:
+        CONFIG_MTIME = mtime
+        python_utils.CF_TARGETING.clear()
+        python_utils.CF_TOKENS.clear()
+        python_utils.CF_BACKEND = None
+        python_utils.invalidate_services_snapshot()
+        GROUP_SESSION = None
+
+# run a request from a client with its environment settings
+def serve_request (request):
+    if request.get("cf_home", "") != os.getenv('CF_HOME', ""):
+        return { "ok": False, "fallback": True, "error": "Daemon is for another CF_HOME" }
+
+    with REQUEST_LOCK:
+        check_targeting()
+        saved = {}
+        for name, value in request.get("env", {}).items():
+            if name not in utils_client.REQUEST_ENV:
+                continue
+            saved[name] = os.environ.get(name)
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        try:
+            return run_operation(request.get("op"), request.get("args") or {})
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+
+class DaemonHandler (socketserver.StreamRequestHandler):
+
+    def handle (self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        self.server.begin_request()
+        try:
+            self.respond(line)
+        finally:
+            self.server.end_request()
+
+    def respond (self, line):
+        try:
+            request = json.loads(line.decode("utf-8"))
+        except ValueError:
+            response = { "ok": False, "error": "Request is not json" }
+        else:
+            if request.get("op") == "shutdown":
+                response = { "ok": True, "result": None }
+                threading.Thread(target=self.server.shutdown).start()
+            else:
+                response = serve_request(request)
+        self.wfile.write((json.dumps(response, default=str) + "\n").encode("utf-8"))
+
+
+class DaemonServer (socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__ (self, path, idle_timeout):
+        # only this user can talk to us, we hand out credentials
+        oldUmask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, DaemonHandler)
+        finally:
+            os.umask(oldUmask)
+        self.idle_timeout = idle_timeout
+        self.last_request = timeit.default_timer()
+        # requests being handled, guarded by active_lock
+        self.active = 0
+        self.active_lock = threading.Lock()
+
+    def begin_request (self):
+        with self.active_lock:
+            self.active += 1
+            self.last_request = timeit.default_timer()
+
+    def end_request (self):
+        with self.active_lock:
+            self.active -= 1
+            self.last_request = timeit.default_timer()
+
+    # stop serving once there's been no request for idle_timeout seconds.
+    # Waits for the request running, if there is one, and never stops
+    # while one is being handled
+    def watch_idle (self):
+        while True:
+            idle = timeit.default_timer() - self.last_request
+            if idle >= self.idle_timeout:
+                with REQUEST_LOCK:
+                    with self.active_lock:
+                        idle = timeit.default_timer() - self.last_request
+                        if idle >= self.idle_timeout and not self.active:
+                            self.shutdown()
+                            return
+                # busy, look again in a bit
+                time.sleep(1)
+                continue
+            time.sleep(min(self.idle_timeout - idle, 5))
+
+
+def main (argv=None):
+    parser = argparse.ArgumentParser(prog="utils_daemon.py")
+    parser.add_argument("--socket", metavar="PATH", default=utils_client.get_socket_path())
+    parser.add_argument("--idle-timeout", metavar="SECONDS", type=float, default=float(os.getenv('UTILS_DAEMON_IDLE_TIMEOUT', "600")))
+    args = parser.parse_args(argv)
+
+    if utils_client.send_request({ "op": "ping" }, args.socket) is not None:
+        # someone beat us to it
+        return 0
+    if os.path.exists(args.socket):
+        # left behind by a daemon that didn't get to clean up
+        os.remove(args.socket)
+
+    python_utils.LOGGER = setup_logging()
+    server = DaemonServer(args.socket, args.idle_timeout)
+    watcher = threading.Thread(target=server.watch_idle)
+    watcher.daemon = True
+    watcher.start()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())